@@ -1,21 +1,75 @@
+import functools
+from concurrent.futures import Future
+
 import langroid as lr
 from langroid import ChatDocument
 
 from langroid.agent.tools.recipient_tool import RecipientTool
-from langroid.agent.tools.orchestration import PassTool
+from langroid.agent.tools.orchestration import AgentDoneTool, PassTool
 
-from typing import Optional
+from typing import Any, List, Optional, Tuple
+from langroid.language_models import LLMMessage
 from config import LLM_CONFIGS
-from plugin import PluginManager
+from concurrency import limit_agent
+from plugin import PluginManager, PluginTasks, get_plugin_manager
+
+from dispatch import dispatch
+from escalation import ModelLadder
+from history import HistoryCompactor
+from ollama_client import pool_agent
+from tool_repair import ToolRepair
+from response_cache import ResponseCache
+from router import PluginRouter
+from speculation import Speculator
+from streaming import TokenSink, relay_to
+from tools import QuestionTool, AnswerTool, BatchQuestionTool, RoutedQuestion
+from tracing import get_tracer, trace_agent
 
-from tools import QuestionTool, AnswerTool
+plugin_manager = get_plugin_manager()
 
-plugin_manager = PluginManager()
+
+def replace_sub_task(task: lr.Task, old: lr.Task, new: lr.Task) -> None:
+    """Puts `new` in the place of the sub-task `old` of `task`."""
+    new.config_sub_task = old.config_sub_task
+    for responders in (
+        task.sub_tasks,
+        task.responders,
+        task.responders_async,
+        task.non_human_responders,
+        task.non_human_responders_async,
+    ):
+        responders[responders.index(old)] = new
+    task.name_sub_task_map[new.name] = new
 
 
 class MainAgent:
-    def __init__(self):
-        self.agent = lr.ChatAgent(
+    def __init__(
+        self,
+        router: PluginRouter | None = None,
+        cache: ResponseCache | None = None,
+        plugins: PluginManager | PluginTasks | None = None,
+        interactive: bool = True,
+        speculate: bool = False,
+    ):
+        """
+        Args:
+            router (PluginRouter | None): sends the queries it is confident
+                about straight to a plugin, without the orchestrator LLM.
+            cache (ResponseCache | None): answers the questions that were
+                already asked to the plugins which allow it (`cacheable`).
+            plugins (PluginManager | PluginTasks | None): where the plugin tasks
+                come from, the tasks shared by the process by default.
+            interactive (bool): whether the task asks the user for input.
+            speculate (bool): whether the plugins start on the questions of the
+                orchestrator while it is still generating them.
+        """
+        self.router = router
+        self.cache = cache
+        self.plugins = plugins or plugin_manager
+        self.speculator = (
+            Speculator(plugin_manager, router, cache) if speculate else None
+        )
+        self.agent = self.Agent(
             lr.ChatAgentConfig(
                 llm=LLM_CONFIGS.get("small"),
                 system_message="""
@@ -25,9 +79,13 @@ class MainAgent:
                 (the user) each TASK ONE BY ONE, using the `question_tool` in
                 the specified format, and I will execute the TASK and send you
                 a brief answer.
+                When several TASKS are INDEPENDENT of each other, send them all
+                at once using the `batch_question_tool`, with the specialist
+                that must execute each of them: they will be executed at the same time.
                 VERY IMPORTANT: You can not execute the TASK yourself, use a tool ONLY.
                 """,
-            )
+            ),
+            self,
         )
         self.agent.enable_message(
             [
@@ -35,9 +93,16 @@ class MainAgent:
                     plugin_manager.plugin_names,
                 ),
                 QuestionTool,
+                BatchQuestionTool,
                 PassTool,
             ]
         )
+        self.agent.enable_message(AnswerTool, use=False, handle=True)
+        # RecipientTool replaces the fallback of the agent with its own
+        del self.agent.handle_message_fallback
+        trace_agent(limit_agent(pool_agent(self.agent)))
+        if self.speculator is not None:
+            self.speculator.watch(self.agent)
         self.agent.enable_message(
             plugin_manager.tools,
             use=False,
@@ -45,23 +110,128 @@ class MainAgent:
         )
         self.task = lr.Task(
             self.agent,
+            interactive=interactive,
         )
-        self.task.add_sub_task(plugin_manager.tasks)
 
-    def run(self, message: str) -> ChatDocument:
-        return self.task.run(message)
+    def attach_plugin(self, name: str) -> bool:
+        """
+        Adds the task of the plugin `name` as a sub-task, building it if this is
+        the first time it is used, so only the plugins actually used are built.
+        The task of a plugin that was reloaded since is replaced.
+        """
+        task = self.plugins.get_task(name)
+        if task is None:
+            return False
+        attached = self.task.name_sub_task_map.get(task.name)
+        if attached is None:
+            self.task.add_sub_task(task)
+        elif attached is not task:
+            replace_sub_task(self.task, attached, task)
+        return True
+
+    def run(
+        self, message: str, on_token: TokenSink | None = None
+    ) -> ChatDocument | None:
+        """
+        Args:
+            message (str): the query of the user.
+            on_token (TokenSink | None): receives the answers of the plugins as
+                they are generated, before the final answer is returned.
+        """
+        with get_tracer().span(
+            "query", "MainAgent", query=message
+        ) as span, relay_to(on_token):
+            route = self.router.route(message) if self.router else None
+            span.attributes["routed"] = route is not None and route.confident
+            if route is not None:
+                span.attributes["recipient"] = route.recipient
+                span.attributes["score"] = route.score
+            if route is None or not route.confident:
+                try:
+                    return self.task.run(message)
+                finally:
+                    if self.speculator is not None:
+                        self.speculator.reset()
+            [answer] = dispatch(
+                self.plugins,
+                [RoutedQuestion(recipient=route.recipient, instruction=message)],
+                self.cache,
+            )
+            return self.agent.create_agent_response(content=answer.task_result)
+
+    def speculated(self, questions: List[RoutedQuestion]) -> List[Future | None]:
+        """
+        The answers the plugins started on `questions` ahead, if any. The other
+        runs are discarded right away, so they don't hold the LLMs the actual
+        questions wait for.
+        """
+        if self.speculator is None:
+            return [None for _ in questions]
+        futures = [self.speculator.take(question) for question in questions]
+        self.speculator.reset()
+        return futures
+
+    def ask(self, questions: List[RoutedQuestion]) -> List[AnswerTool]:
+        """
+        The answers of the plugins to `questions`, those started ahead by the
+        speculator waiting to finish while the others are dispatched.
+        """
+        speculated = self.speculated(questions)
+        missing = [q for q, future in zip(questions, speculated) if future is None]
+        answers = iter(dispatch(self.plugins, missing, self.cache) if missing else [])
+        return [
+            next(answers) if future is None else future.result()
+            for future in speculated
+        ]
+
+    def load(self, history: List[LLMMessage]) -> None:
+        """
+        Resumes a conversation with the message `history` of the agent, so one
+        MainAgent can take turns serving several conversations.
+        """
+        # The task would otherwise clear the history on every run
+        self.task.restart = False
+        for task in self.task.sub_tasks:
+            task.reset_all_sub_tasks()
+        self.agent.init_state()
+        self.agent.clear_history(0)
+        self.agent.message_history.extend(history)
+
+    def history(self) -> List[LLMMessage]:
+        return list(self.agent.message_history)
 
     class Agent(lr.ChatAgent):
+        def __init__(self, config: lr.ChatAgentConfig, main: "MainAgent"):
+            super().__init__(config)
+            self.ladder = ModelLadder(self)
+            self.repair = ToolRepair(self)
+            self.compactor = HistoryCompactor(self)
+            self.main = main
+
         def init_state(self) -> None:
             super().init_state()
             self.expecting_question_tool = False
             self.expecting_question: bool = False
             self.expecting_task_answer = False
             self.original_query: str | None = None
+            # The cache key of the question passed to a plugin, to store its answer
+            self.pending_question: Tuple[str, str, str] | None = None
+
+        def handle_message(self, msg: str | ChatDocument) -> Any:
+            # Nearly valid tool JSON is fixed here rather than by another generation
+            return super().handle_message(self.repair.apply(msg))
 
         def handle_message_fallback(
             self, msg: str | ChatDocument
-        ) -> str | ChatDocument | None:
+        ) -> str | ChatDocument | lr.ToolMessage | None:
+            if not (self.expecting_question or self.expecting_question_tool):
+                return None
+            if not self.repair.retry():
+                # Out of retries: what the LLM said last is the answer
+                content = msg if isinstance(msg, str) else msg.content
+                if self.expecting_question_tool:
+                    content = f"I could not find how to execute: {self.original_query}"
+                return AgentDoneTool(content=content)
             if self.expecting_question:
                 return """
                 You may have intended to use a tool, but your JSON format may be wrong.
@@ -76,16 +246,79 @@ class MainAgent:
                 smaller instructions that can be executed by a specialist.
                 """
 
+        def recipient_message(self, tool: RecipientTool) -> str | ChatDocument:
+            self.main.attach_plugin(tool.intended_recipient)
+            return tool.response(self)
+
         def question_tool(self, tool: QuestionTool) -> str | PassTool:
+            router = self.main.router
+            route = router.route(tool.instruction) if router else None
+            if route is not None and route.confident:
+                question = RoutedQuestion(
+                    recipient=route.recipient, instruction=tool.instruction
+                )
+                [future] = self.main.speculated([question])
+                if future is not None:
+                    # The plugin answered while the tool was being generated
+                    self.expecting_task_answer = True
+                    self.expecting_question_tool = False
+                    return self.answer_tool(future.result())
+                cached = self.cached_answer(route.recipient, tool.instruction)
+                if cached is not None:
+                    self.expecting_task_answer = True
+                    self.expecting_question_tool = False
+                    return self.answer_tool(AnswerTool(task_result=cached))
+                self.main.attach_plugin(route.recipient)
+            else:
+                # None of the runs started ahead answers this question
+                self.main.speculated([])
+                # Without a recipient, any plugin may be the one handling the question
+                for name in self.main.plugins.plugin_names:
+                    self.main.attach_plugin(name)
             self.expecting_task_answer = True
             self.expecting_question_tool = False
             return PassTool()
 
+        def cached_answer(self, recipient: str, instruction: str) -> str | None:
+            """
+            The answer of the cache to the question the plugin `recipient` is
+            about to be passed, if it may reuse one. On a miss, the answer the
+            plugin sends back is added to the cache by the `answer_tool`.
+            """
+            cache = self.main.cache
+            plugins = self.main.plugins
+            if cache is None or not plugins.is_cacheable(recipient):
+                return None
+            key = (recipient, plugins.get_data_version(recipient), instruction)
+            answer = cache.get(*key)
+            if answer is None:
+                self.pending_question = key
+            return answer
+
+        def batch_question_tool(self, tool: BatchQuestionTool) -> str:
+            self.expecting_question_tool = False
+            answers = self.main.ask(tool.questions)
+            self.expecting_question = True
+            results = "\n".join(
+                f"- {question.instruction}: {answer.task_result}"
+                for question, answer in zip(tool.questions, answers)
+            )
+            return f"""
+            Here are the results of the tasks' execution:
+            {results}
+            Now decide whether you want to:
+            - return the results of the tasks' execution to the user, OR
+            - execute other tasks using the `question_tool` or `batch_question_tool`.
+            """
+
         def answer_tool(self, tool: AnswerTool) -> str:
-            if not self.expecting_question:
+            if not self.expecting_task_answer:
                 return ""
 
-            self.expecting_question = False
+            if self.pending_question is not None and tool.task_result:
+                self.main.cache.put(*self.pending_question, tool.task_result)
+            self.pending_question = None
+            self.expecting_question = True
             self.expecting_task_answer = False
             return f"""
             Here's the result of the task execution: {tool.task_result}.
@@ -98,11 +331,18 @@ class MainAgent:
         def llm_response(
             self, message: Optional[str | ChatDocument] = None
         ) -> Optional[ChatDocument]:
+            # Every round adds a task result, the old ones are shortened
+            self.compactor.compact(self.message_history)
             if self.original_query is None:
                 self.original_query = (
                     message if isinstance(message, str) else message.content
                 )
                 # just received user query, so we expect a question tool next
                 self.expecting_question_tool = True
-            if self.expecting_question_tool or self.expecting_question:
+            if self.expecting_question_tool:
+                # Picking the tool is left to the cheapest model that gets it right
+                return self.ladder.respond(
+                    functools.partial(super().llm_response, message)
+                )
+            if self.expecting_question:
                 return super().llm_response(message)
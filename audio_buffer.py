@@ -0,0 +1,130 @@
+import threading
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+INT16_SCALE = 32768.0
+
+
+class AudioRingBuffer:
+    """
+    Preallocated float32 ring buffer shared by the audio producer and consumer.
+
+    Samples are addressed by their absolute position in the stream. Every
+    sample is stored twice, at `i` and `i + capacity`, so any range of up to
+    `capacity` samples can be returned as a contiguous view without copying.
+
+    There must be a single producer. A view stays valid as long as the
+    producer has not written `capacity` samples past its start, so the
+    capacity must be larger than the longest window the consumer reads.
+    With `blocking`, the producer instead waits for the consumer to `release`
+    samples before overwriting them (used when replaying files faster than
+    real time).
+    """
+
+    def __init__(
+        self,
+        capacity_seconds: float = 30.0,
+        sample_rate: int = SAMPLE_RATE,
+        blocking: bool = False,
+    ):
+        self.sample_rate = sample_rate
+        self.capacity = int(capacity_seconds * sample_rate)
+        self.blocking = blocking
+        self._data = np.zeros(2 * self.capacity, dtype=np.float32)
+        self._end = 0
+        self._released = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    @property
+    def start(self) -> int:
+        """Absolute position of the oldest sample still available."""
+        return max(0, self._end - self.capacity)
+
+    @property
+    def end(self) -> int:
+        """Absolute position one past the newest sample."""
+        return self._end
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def _store(self, samples: np.ndarray, scale: float) -> None:
+        written = 0
+        while written < len(samples):
+            index = (self._end + written) % self.capacity
+            size = min(len(samples) - written, self.capacity - index)
+            piece = samples[written : written + size]
+            for offset in (index, index + self.capacity):
+                np.multiply(
+                    piece,
+                    scale,
+                    out=self._data[offset : offset + size],
+                    casting="unsafe",
+                )
+            written += size
+
+    def write(self, samples: np.ndarray) -> None:
+        self._write(samples, 1.0)
+
+    def write_pcm16(self, pcm: bytes) -> None:
+        """Writes raw 16 bit PCM, normalized to [-1, 1]."""
+        self._write(np.frombuffer(pcm, np.int16), 1.0 / INT16_SCALE)
+
+    def _write(self, samples: np.ndarray, scale: float) -> None:
+        if len(samples) > self.capacity:
+            # Only the newest samples fit, the others would be overwritten anyway
+            with self._condition:
+                self._end += len(samples) - self.capacity
+            samples = samples[-self.capacity :]
+        if self.blocking:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._end + len(samples) - self._released
+                    <= self.capacity
+                    or self._closed
+                )
+        self._store(samples, scale)
+        with self._condition:
+            self._end += len(samples)
+            self._condition.notify_all()
+
+    def release(self, position: int) -> None:
+        """Lets a blocking producer overwrite the samples before `position`."""
+        with self._condition:
+            self._released = max(self._released, position)
+            self._condition.notify_all()
+
+    def view(self, start: int, stop: int) -> np.ndarray:
+        """
+        Returns the samples in [start, stop) as a view, without copying.
+
+        Raises:
+            ValueError: if the range was already overwritten or not written yet.
+        """
+        if start < self.start or stop > self._end or stop < start:
+            raise ValueError(
+                f"Range [{start}, {stop}) is not in the buffer "
+                f"[{self.start}, {self._end})"
+            )
+        index = start % self.capacity
+        return self._data[index : index + stop - start]
+
+    def wait(self, position: int, timeout: float | None = None) -> bool:
+        """
+        Blocks until the samples before `position` are written.
+
+        Returns:
+            bool: False if the buffer was closed (or timed out) before that.
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: self._end >= position or self._closed, timeout
+            ) and self._end >= position
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
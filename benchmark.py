@@ -0,0 +1,142 @@
+import json
+import time
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from dispatch import dispatch
+from MainAgent import MainAgent
+from plugin import PluginManager, PluginTasks
+from replay import LLMRecorder
+from tools import RoutedQuestion
+from tracing import Span, get_tracer
+
+# Compared with a baseline: the timings with a tolerance, the counts exactly
+TIMINGS = ["wall_seconds", "llm_seconds", "overhead_seconds"]
+COUNTS = ["rounds", "retries", "llm_calls"]
+
+
+def load_corpus(path: str) -> List[Dict[str, Any]]:
+    """
+    The queries of a JSONL corpus: {"query": ...}, sent to the MainAgent, or
+    {"query": ..., "plugin": ...}, sent straight to the task of a plugin.
+    """
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def busy_time(intervals: List[Tuple[float, float]]) -> float:
+    """How long at least one of the (possibly overlapping) intervals lasted."""
+    total = 0.0
+    end = float("-inf")
+    for start, stop in sorted(intervals):
+        if stop > end:
+            total += stop - max(start, end)
+            end = stop
+    return total
+
+
+def measure(
+    spans: List[Span],
+    intervals: List[Tuple[float, float]],
+    main_agent: str,
+    wall_seconds: float,
+) -> Dict[str, Any]:
+    # The plugins answer concurrently: the LLM time is the time during which
+    # any LLM was generating, and the rest is spent by the orchestration.
+    llm_seconds = busy_time(intervals)
+    return {
+        "wall_seconds": wall_seconds,
+        "llm_seconds": llm_seconds,
+        "overhead_seconds": max(0.0, wall_seconds - llm_seconds),
+        "rounds": sum(
+            s.kind == "llm_response" and s.name == main_agent for s in spans
+        ),
+        "retries": sum(
+            s.kind == "fallback" and bool(s.attributes.get("retried")) for s in spans
+        ),
+        "llm_calls": len(intervals),
+    }
+
+
+def aggregate(results: List[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    report = {}
+    for metric in TIMINGS + COUNTS:
+        values = np.array([result[metric] for result in results], dtype=float)
+        report[metric] = {
+            "mean": float(values.mean()) if len(values) else 0.0,
+            "p95": float(np.percentile(values, 95)) if len(values) else 0.0,
+            "total": float(values.sum()),
+        }
+    return report
+
+
+def run_benchmark(
+    corpus: List[Dict[str, Any]],
+    recorder: LLMRecorder,
+    plugin_manager: PluginManager,
+) -> Dict[str, Any]:
+    """
+    Drives the `corpus` through a MainAgent and the plugin tasks, with the
+    LLMs of `recorder`, and measures each query from its spans.
+    """
+    tracer = get_tracer()
+    results = []
+    with recorder.install():
+        # Built in the block, so that their LLMs are the recorded ones
+        plugins = PluginTasks(plugin_manager)
+        main_agent = MainAgent(plugins=plugins, interactive=False)
+        main_name = main_agent.agent.config.name
+        for item in corpus:
+            query = item["query"]
+            n_intervals = len(recorder.intervals)
+            start = time.time()
+            with tracer.span(
+                "query", "benchmark", query=query, plugin=item.get("plugin")
+            ) as root:
+                if item.get("plugin"):
+                    question = RoutedQuestion(
+                        recipient=item["plugin"], instruction=query
+                    )
+                    dispatch(plugins, [question])
+                else:
+                    main_agent.run(query)
+            wall_seconds = time.time() - start
+            spans = [s for s in list(tracer.spans) if s.trace_id == root.trace_id]
+            result = measure(
+                spans, recorder.intervals[n_intervals:], main_name, wall_seconds
+            )
+            results.append({"query": query, "plugin": item.get("plugin"), **result})
+    return {
+        "mode": recorder.mode,
+        "queries": results,
+        "summary": aggregate(results),
+    }
+
+
+def regressions(
+    report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float
+) -> List[str]:
+    """
+    The metrics of `report` worse than in `baseline`: the mean timings by
+    more than `tolerance` (a fraction), and the counts at all, since replayed
+    queries always take the same path.
+    """
+    found = []
+    for metric in TIMINGS + COUNTS:
+        current = report["summary"][metric]["mean"]
+        previous = baseline["summary"][metric]["mean"]
+        limit = previous * (1 + tolerance) if metric in TIMINGS else previous
+        if current > limit + 1e-9:
+            found.append(f"{metric}: {current:.3f} > {previous:.3f}")
+    return found
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    lines = [f"{'metric':<18}{'mean':>10}{'p95':>10}{'total':>10}"]
+    for metric, values in report["summary"].items():
+        lines.append(
+            f"{metric:<18}{values['mean']:>10.3f}{values['p95']:>10.3f}"
+            f"{values['total']:>10.3f}"
+        )
+    return "\n".join(lines)
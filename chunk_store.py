@@ -0,0 +1,175 @@
+import os
+import sqlite3
+import threading
+from contextlib import closing
+from typing import Callable, Dict, Iterable, Iterator, List
+
+import numpy as np
+
+from chunking import Piece, content_hash
+
+CHUNK_STORE_PATH = ".jarvis/index/chunks.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, content TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS files (
+    file_hash TEXT, chunker TEXT, position INTEGER, trail TEXT, chunk_id TEXT,
+    PRIMARY KEY (file_hash, chunker, position)
+);
+CREATE TABLE IF NOT EXISTS chunked (
+    file_hash TEXT, chunker TEXT, PRIMARY KEY (file_hash, chunker)
+);
+CREATE TABLE IF NOT EXISTS vectors (
+    id TEXT, embedding TEXT, vector BLOB, PRIMARY KEY (id, embedding)
+);
+"""
+
+EmbeddingFunction = Callable[[List[str]], List[List[float]]]
+
+
+class ChunkStore:
+    """
+    On-disk store shared by the indexes of all the plugins:
+
+    - the chunks of each file, keyed by the hash of the file and the
+      fingerprint of the chunker, so an unchanged file is never split again,
+      whichever plugin indexes it;
+    - the content of each chunk and its embedding, keyed by the hash of the
+      content, so a chunk found in several plugins is embedded once.
+    """
+
+    def __init__(self, path: str = CHUNK_STORE_PATH, batch_size: int = 500):
+        self.path = path
+        self.batch_size = batch_size
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with closing(self.connect()) as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+
+    def connect(self) -> sqlite3.Connection:
+        # One connection per use, so the store can be used from any thread
+        return sqlite3.connect(self.path, timeout=60)
+
+    def get_pieces(self, file_hash: str, chunker: str) -> Iterator[Piece] | None:
+        """The cached chunks of a file, or None if it was never chunked."""
+        with closing(self.connect()) as db:
+            found = db.execute(
+                "SELECT 1 FROM chunked WHERE file_hash = ? AND chunker = ?",
+                (file_hash, chunker),
+            ).fetchone()
+        if found is None:
+            return None
+        return self.__read_pieces(file_hash, chunker)
+
+    def __read_pieces(self, file_hash: str, chunker: str) -> Iterator[Piece]:
+        with closing(self.connect()) as db:
+            rows = db.execute(
+                "SELECT files.trail, chunks.content FROM files"
+                " JOIN chunks ON chunks.id = files.chunk_id"
+                " WHERE files.file_hash = ? AND files.chunker = ?"
+                " ORDER BY files.position",
+                (file_hash, chunker),
+            )
+            for trail, content in rows:
+                yield trail, content
+
+    def put_pieces(
+        self, file_hash: str, chunker: str, pieces: Iterable[Piece]
+    ) -> Iterator[Piece]:
+        """
+        Yields `pieces` while storing them in batches, so that a large file
+        is never held in memory. The cached chunks of the file are only used
+        once all of them are stored.
+        """
+        with closing(self.connect()) as db:
+            db.execute(
+                "DELETE FROM files WHERE file_hash = ? AND chunker = ?",
+                (file_hash, chunker),
+            )
+            db.commit()
+            batch = []
+            for position, (trail, content) in enumerate(pieces):
+                batch.append((file_hash, chunker, position, trail, content))
+                if len(batch) >= self.batch_size:
+                    self.__write_pieces(db, batch)
+                    batch = []
+                yield trail, content
+            self.__write_pieces(db, batch)
+            db.execute(
+                "INSERT OR IGNORE INTO chunked VALUES (?, ?)", (file_hash, chunker)
+            )
+            db.commit()
+
+    def __write_pieces(self, db: sqlite3.Connection, batch: List[tuple]) -> None:
+        db.executemany(
+            "INSERT OR IGNORE INTO chunks VALUES (?, ?)",
+            [(content_hash(content), content) for *_, content in batch],
+        )
+        # Two indexes may chunk the same file at the same time, into the same rows
+        db.executemany(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+            [
+                (file_hash, chunker, position, trail, content_hash(content))
+                for file_hash, chunker, position, trail, content in batch
+            ],
+        )
+        db.commit()
+
+    def get_vectors(self, ids: List[str], embedding: str) -> Dict[str, np.ndarray]:
+        with closing(self.connect()) as db:
+            rows = db.execute(
+                "SELECT id, vector FROM vectors WHERE embedding = ?"
+                f" AND id IN ({','.join('?' * len(ids))})",
+                (embedding, *ids),
+            ).fetchall()
+        return {id: np.frombuffer(vector, dtype=np.float32) for id, vector in rows}
+
+    def put_vectors(self, vectors: Dict[str, List[float]], embedding: str) -> None:
+        with closing(self.connect()) as db:
+            db.executemany(
+                "INSERT OR IGNORE INTO vectors VALUES (?, ?, ?)",
+                [
+                    (id, embedding, np.asarray(vector, dtype=np.float32).tobytes())
+                    for id, vector in vectors.items()
+                ],
+            )
+            db.commit()
+
+    def embedding_fn(
+        self, embed: EmbeddingFunction, embedding: str
+    ) -> EmbeddingFunction:
+        """
+        `embed`, but reusing the vectors stored for the fingerprint
+        `embedding` of the embedding model, and storing the new ones.
+        """
+
+        def cached_embed(texts: List[str]) -> List[List[float]]:
+            ids = [content_hash(text) for text in texts]
+            found: Dict[str, List[float]] = {
+                id: vector.tolist()
+                for i in range(0, len(ids), self.batch_size)
+                for id, vector in self.get_vectors(
+                    ids[i : i + self.batch_size], embedding
+                ).items()
+            }
+            missing = {id: text for id, text in zip(ids, texts) if id not in found}
+            if missing:
+                vectors = dict(zip(missing, embed(list(missing.values()))))
+                self.put_vectors(vectors, embedding)
+                found.update(vectors)
+            return [found[id] for id in ids]
+
+        return cached_embed
+
+
+_chunk_store: ChunkStore | None = None
+_chunk_store_lock = threading.Lock()
+
+
+def get_chunk_store() -> ChunkStore:
+    """Returns the ChunkStore shared by the whole process."""
+    global _chunk_store
+    with _chunk_store_lock:
+        if _chunk_store is None:
+            _chunk_store = ChunkStore()
+    return _chunk_store
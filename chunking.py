@@ -0,0 +1,126 @@
+import hashlib
+import os
+import re
+from typing import Iterable, Iterator, List, Tuple
+
+from langroid.mytypes import DocMetaData, Document
+from langroid.parsing.parser import Parser, ParsingConfig
+from langroid.parsing.repo_loader import RepoLoader
+
+# Bump when the splitting below changes, so the cached chunks are not reused
+CHUNKER_VERSION = 1
+
+STREAMED_EXTENSIONS = {".md", ".mdx", ".markdown", ".txt", ".rst"}
+
+HEADING = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+FENCE = re.compile(r"^\s*(```|~~~)")
+
+# A chunk: the headings it is under, and its content
+Piece = Tuple[str, str]
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def to_document(path: str, trail: str, content: str) -> Document:
+    id = content_hash(content)
+    return Document(
+        content=content,
+        metadata=DocMetaData(
+            source=f"{path}: {trail}" if trail else path,
+            id=id,
+            window_ids=[id],
+            is_chunk=True,
+        ),
+    )
+
+
+class MarkdownChunker:
+    """
+    Splits documents along their markdown structure: a chunk starts at a
+    heading, unless the previous section is too small to stand alone, and
+    sections longer than `chunk_size` tokens are split between paragraphs.
+    Code blocks are only split when they alone exceed `chunk_size`, and then
+    each part keeps its fences.
+
+    Text files are read line by line, so their size does not matter. Since
+    the boundaries only depend on the structure nearby, editing a part of a
+    file leaves the chunks of the rest of it unchanged.
+    """
+
+    def __init__(self, parsing: ParsingConfig):
+        self.parsing = parsing
+        self.parser = Parser(parsing)
+        self.max_tokens = parsing.chunk_size
+        self.min_tokens = max(1, parsing.chunk_size // 4)
+
+    def fingerprint(self) -> str:
+        """Changes whenever the chunks of a file would change."""
+        return content_hash(
+            f"{CHUNKER_VERSION}:{self.parsing.json(sort_keys=True)}"
+        )
+
+    def streams(self, path: str) -> bool:
+        return os.path.splitext(path)[1].lower() in STREAMED_EXTENSIONS
+
+    def chunks(self, path: str) -> Iterator[Piece]:
+        if self.streams(path):
+            with open(path, encoding="utf-8", errors="replace") as f:
+                yield from self.split(f)
+            return
+        # Other formats (pdf, docx...) are loaded whole by langroid
+        docs = RepoLoader.get_documents(path, parser=self.parser)
+        for doc in self.parser.split(docs):
+            yield "", doc.content
+
+    def split(self, lines: Iterable[str]) -> Iterator[Piece]:
+        headings: List[str] = []
+        buffer: List[str] = []
+        counts: List[int] = []
+        trail = ""
+        # Where the buffer may be cut: after its last blank line out of code
+        boundary = 0
+        # The opening line of the code block the current line is in
+        fence: str | None = None
+
+        def cut(end: int) -> Piece:
+            nonlocal buffer, counts, boundary, trail
+            content = "".join(buffer[:end]).strip()
+            buffer, counts = buffer[end:], counts[end:]
+            boundary = 0
+            piece = (trail, content)
+            trail = " > ".join(h for h in headings if h)
+            return piece
+
+        for line in lines:
+            tokens = self.parser.num_tokens(line)
+            heading = HEADING.match(line) if fence is None else None
+            if heading:
+                if sum(counts) >= self.min_tokens:
+                    yield cut(len(buffer))
+                level = len(heading.group(1))
+                headings = headings[: level - 1]
+                headings += [""] * (level - 1 - len(headings)) + [heading.group(2)]
+                if not buffer:
+                    trail = " > ".join(h for h in headings if h)
+            elif buffer and sum(counts) + tokens > self.max_tokens:
+                if boundary > 0:
+                    yield cut(boundary)
+                elif fence is None:
+                    yield cut(len(buffer))
+                else:
+                    # Each part of a code block keeps its fences
+                    buffer.append(FENCE.match(fence).group(1) + "\n")
+                    yield cut(len(buffer))
+                    buffer, counts = [fence], [self.parser.num_tokens(fence)]
+
+            buffer.append(line)
+            counts.append(tokens)
+            if FENCE.match(line):
+                fence = line if fence is None else None
+            elif fence is None and not line.strip():
+                boundary = len(buffer)
+
+        if "".join(buffer).strip():
+            yield cut(len(buffer))
@@ -0,0 +1,129 @@
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator
+
+import langroid as lr
+
+from config import TIER_CONCURRENCY, TIER_QUEUE_SIZE
+from tracing import current_span, model_tier
+
+
+class Overloaded(Exception):
+    """Raised when too many LLM calls are already waiting for a tier."""
+
+
+class TierLimiter:
+    """
+    Bounds the number of concurrent LLM calls per `LLM_CONFIGS` tier. The
+    calls over the limit wait for their turn, up to `queue_size` of them per
+    tier, after which `Overloaded` is raised.
+    """
+
+    def __init__(
+        self,
+        limits: Dict[str, int] = TIER_CONCURRENCY,
+        queue_size: int = TIER_QUEUE_SIZE,
+    ):
+        self.limits = limits
+        self.queue_size = queue_size
+        self.__semaphores = {
+            tier: threading.BoundedSemaphore(limit) for tier, limit in limits.items()
+        }
+        self.__waiting: Dict[str, int] = {tier: 0 for tier in limits}
+        self.__active: Dict[str, int] = {tier: 0 for tier in limits}
+        self.__rejected: Dict[str, int] = {tier: 0 for tier in limits}
+        self.__lock = threading.Lock()
+
+    @contextmanager
+    def slot(self, tier: str | None) -> Iterator[None]:
+        semaphore = self.__semaphores.get(tier or "")
+        if semaphore is None:
+            # Models outside of the tiers are not limited
+            yield
+            return
+        with self.__lock:
+            if self.__waiting[tier] >= self.queue_size:
+                self.__rejected[tier] += 1
+                raise Overloaded(f"Too many requests waiting for the {tier} model")
+            self.__waiting[tier] += 1
+        start = time.time()
+        semaphore.acquire()
+        with self.__lock:
+            self.__waiting[tier] -= 1
+            self.__active[tier] += 1
+        span = current_span()
+        if span is not None:
+            span.attributes["queued_seconds"] = time.time() - start
+        try:
+            yield
+        finally:
+            with self.__lock:
+                self.__active[tier] -= 1
+            semaphore.release()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self.__lock:
+            return {
+                tier: {
+                    "limit": self.limits[tier],
+                    "active": self.__active[tier],
+                    "waiting": self.__waiting[tier],
+                    "rejected": self.__rejected[tier],
+                }
+                for tier in self.limits
+            }
+
+
+def limit_agent(
+    agent: lr.ChatAgent, limiter: TierLimiter | None = None
+) -> lr.ChatAgent:
+    """Makes every LLM call of `agent` wait for a slot of its tier."""
+    limiter = limiter or get_tier_limiter()
+    llm_response_messages = agent.llm_response_messages
+    llm_response_messages_async = agent.llm_response_messages_async
+
+    def tier() -> str | None:
+        return model_tier(agent.llm.config if agent.llm else agent.config.llm)
+
+    def limited_llm_response_messages(*args: Any, **kwargs: Any) -> Any:
+        with limiter.slot(tier()):
+            return llm_response_messages(*args, **kwargs)
+
+    async def limited_llm_response_messages_async(*args: Any, **kwargs: Any) -> Any:
+        # The slot is waited for in a thread, not to block the event loop
+        slot = limiter.slot(tier())
+        entering = asyncio.ensure_future(asyncio.to_thread(slot.__enter__))
+
+        def release(entered: asyncio.Future) -> None:
+            if not entered.cancelled() and entered.exception() is None:
+                slot.__exit__(None, None, None)
+
+        try:
+            await asyncio.shield(entering)
+        except asyncio.CancelledError:
+            # The thread still gets the slot after the call is cancelled
+            entering.add_done_callback(release)
+            raise
+        try:
+            return await llm_response_messages_async(*args, **kwargs)
+        finally:
+            slot.__exit__(None, None, None)
+
+    agent.llm_response_messages = limited_llm_response_messages
+    agent.llm_response_messages_async = limited_llm_response_messages_async
+    return agent
+
+
+_tier_limiter: TierLimiter | None = None
+_tier_limiter_lock = threading.Lock()
+
+
+def get_tier_limiter() -> TierLimiter:
+    """Returns the TierLimiter shared by the whole process."""
+    global _tier_limiter
+    with _tier_limiter_lock:
+        if _tier_limiter is None:
+            _tier_limiter = TierLimiter()
+    return _tier_limiter
@@ -1,4 +1,7 @@
+import os
+
 import langroid.language_models as lm
+from langroid.agent.special.doc_chat_agent import DocChatAgentConfig
 from langroid.utils.configuration import settings
 
 CONTEXT_LENGTH = 128000
@@ -6,6 +9,114 @@ CONTEXT_LENGTH = 128000
 settings.debug = False
 settings.cache = False
 
+"""
+MAX_TOOL_RETRIES: int
+    How many times in a row an agent asks its LLM again for a tool that it
+    failed to use, before giving up on the task.
+"""
+MAX_TOOL_RETRIES = 2
+
+"""
+TIER_CONCURRENCY: dict
+    How many LLM calls may run at the same time on each tier of `LLM_CONFIGS`,
+    the others wait for their turn.
+TIER_QUEUE_SIZE: int
+    How many LLM calls may wait for a tier before new ones are rejected.
+"""
+TIER_CONCURRENCY = {"medium": 1, "small": 2, "tiny": 4}
+TIER_QUEUE_SIZE = 32
+
+"""
+HISTORY_TOKEN_BUDGET: int
+    How many tokens the message history of the main agent may hold, well under
+    `CONTEXT_LENGTH`, so each turn costs about the same to process.
+HISTORY_KEEP_RECENT: int
+    How many of the last messages of the history are never compacted.
+HISTORY_RESULT_TOKENS: int
+    How many tokens of the older task results are kept when compacting.
+"""
+HISTORY_TOKEN_BUDGET = 6000
+HISTORY_KEEP_RECENT = 6
+HISTORY_RESULT_TOKENS = 200
+
+"""
+TOOL_WORKERS: int
+    How many tools of the plugins may run at the same time.
+TOOL_TIMEOUT: float
+    How many seconds a tool may run before its result is given up on, unless
+    its `Config` sets another `timeout`.
+"""
+TOOL_WORKERS = 8
+TOOL_TIMEOUT = 30
+
+"""
+RETRIEVAL_TOP_K: int
+    How many chunks of the docs the doc plugins give to their LLM at most.
+RETRIEVAL_CANDIDATES: int
+    How many chunks the keyword and vector searches each find, before they
+    are fused and reranked.
+RETRIEVAL_TOKEN_BUDGET: int
+    How many tokens the chunks given to the LLM may hold in total.
+"""
+RETRIEVAL_TOP_K = 4
+RETRIEVAL_CANDIDATES = 12
+RETRIEVAL_TOKEN_BUDGET = 2000
+
+"""
+INDEX_WORKERS: int
+    How many processes embed the chunks of the doc plugins' indexes, each
+    with its own copy of the embedding model.
+EMBED_BATCH_SIZE: int
+    How many chunks an indexing process embeds at once.
+"""
+INDEX_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+EMBED_BATCH_SIZE = 32
+
+"""
+PLUGIN_WATCH_INTERVAL: float
+    How often, in seconds, the files of the plugins are checked for changes
+    when they are reloaded on the fly.
+"""
+PLUGIN_WATCH_INTERVAL = 2.0
+
+"""
+SPECULATIVE_RUNS: int
+    How many questions a MainAgent may send to the plugins at the same time
+    before its orchestrator has finished asking them.
+"""
+SPECULATIVE_RUNS = 2
+
+"""
+VOICE_QUEUE_SIZE: int
+    How many spoken queries may wait for the agent, the oldest being dropped
+    beyond that.
+VOICE_DEBOUNCE: float
+    How many seconds of silence end a spoken query. Utterances closer than
+    that are one query, as a pause in a sentence ends an utterance.
+"""
+VOICE_QUEUE_SIZE = 4
+VOICE_DEBOUNCE = 0.6
+
+"""
+WARM_TIERS: list
+    The tiers of `LLM_CONFIGS` whose models are loaded by Ollama at startup, in
+    this order, as long as they fit in `OLLAMA_MEMORY_BUDGET`.
+OLLAMA_MEMORY_BUDGET: int
+    How many bytes of memory the warmed up models may take.
+OLLAMA_KEEP_ALIVE: int
+    How many seconds the warmed up models stay loaded after the last query.
+OLLAMA_PING_INTERVAL: int
+    How often the warmed up models are pinged to keep them loaded, less than
+    the 5 minutes after which Ollama unloads a model by default.
+OLLAMA_MAX_CONNECTIONS: int
+    The size of the pool of HTTP connections to the Ollama server.
+"""
+WARM_TIERS = ["tiny", "small", "medium"]
+OLLAMA_MEMORY_BUDGET = 24 * 1024**3
+OLLAMA_KEEP_ALIVE = 30 * 60
+OLLAMA_PING_INTERVAL = 2 * 60
+OLLAMA_MAX_CONNECTIONS = 16
+
 """
 LLM_CONFIGS: dict
     A dictionary of OpenAIGPTConfig objects for different LLM models.
@@ -37,3 +148,10 @@ LLM_CONFIGS = {
         timeout=180,
     ),
 }
+
+"""
+EMBEDDING_CONFIG: EmbeddingModelsConfig
+    The embedding model of the doc plugins' indexes, also used to route the
+    user's queries to the plugins.
+"""
+EMBEDDING_CONFIG = DocChatAgentConfig().vecdb.embedding
@@ -0,0 +1,134 @@
+import asyncio
+import contextvars
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import langroid as lr
+
+from plugin import PluginManager, PluginTasks
+from response_cache import ResponseCache
+from tools import QuestionTool, AnswerTool, RoutedQuestion
+from tracing import Span, get_tracer
+
+
+NO_RESULT = "The task did not return any result."
+
+
+def task_answer(task: lr.Task, result: lr.ChatDocument | None) -> str | None:
+    """Extracts the `AnswerTool` result of a plugin task run."""
+    if result is None:
+        return None
+    answers = [
+        tool
+        for tool in task.agent.get_tool_messages(result)
+        if isinstance(tool, AnswerTool)
+    ]
+    return answers[0].task_result if answers else result.content
+
+
+async def run_questions(
+    task: lr.Task, questions: List[RoutedQuestion]
+) -> List[str | None]:
+    # A task holds the state of its agent, so the questions sent to the same
+    # plugin still run one after the other.
+    results = []
+    for question in questions:
+        msg = task.agent.create_agent_response(
+            tool_messages=[QuestionTool(instruction=question.instruction)]
+        )
+        result = await task.run_async(msg)
+        results.append(task_answer(task, result))
+    return results
+
+
+async def dispatch_async(
+    plugin_manager: PluginManager | PluginTasks,
+    questions: List[RoutedQuestion],
+    cache: ResponseCache | None = None,
+) -> List[AnswerTool]:
+    """
+    Runs the plugin tasks of `questions` concurrently, so the batch takes as
+    long as its slowest plugin. The questions answered by `cache` don't reach
+    the plugins, and the new answers are added to it.
+
+    Returns:
+        List[AnswerTool]: one answer per question, in the same order.
+    """
+    by_recipient: Dict[str, List[int]] = defaultdict(list)
+    for i, question in enumerate(questions):
+        by_recipient[question.recipient].append(i)
+    results: List[str] = [""] * len(questions)
+
+    async def run(recipient: str, indexes: List[int]) -> None:
+        with get_tracer().span("dispatch", recipient, questions=len(indexes)) as span:
+            await run_plugin(recipient, indexes, span)
+
+    async def run_plugin(recipient: str, indexes: List[int], span: Span) -> None:
+        if recipient not in plugin_manager.plugin_names:
+            for i in indexes:
+                results[i] = f"There is no specialist named {recipient}."
+            return
+        # Only the answers of the plugins without side effects are reused
+        plugin_cache = cache if plugin_manager.is_cacheable(recipient) else None
+        if plugin_cache is not None:
+            version = plugin_manager.get_data_version(recipient)
+            missed = []
+            for i in indexes:
+                answer = await asyncio.to_thread(
+                    plugin_cache.get, recipient, version, questions[i].instruction
+                )
+                if answer is None:
+                    missed.append(i)
+                else:
+                    results[i] = answer
+            span.attributes["cache_hits"] = len(indexes) - len(missed)
+            indexes = missed
+        if not indexes:
+            return
+        # Only built when some question is not answered by the cache
+        task = plugin_manager.get_task(recipient)
+        try:
+            answers = await run_questions(task, [questions[i] for i in indexes])
+        except Exception as e:
+            span.error = repr(e)
+            for i in indexes:
+                results[i] = f"The task failed: {e}"
+            return
+        for i, answer in zip(indexes, answers):
+            results[i] = NO_RESULT if answer is None else answer
+            if plugin_cache is not None and answer is not None:
+                await asyncio.to_thread(
+                    plugin_cache.put,
+                    recipient,
+                    version,
+                    questions[i].instruction,
+                    answer,
+                )
+
+    await asyncio.gather(
+        *(run(recipient, indexes) for recipient, indexes in by_recipient.items())
+    )
+    return [AnswerTool(task_result=result) for result in results]
+
+
+def dispatch(
+    plugin_manager: PluginManager | PluginTasks,
+    questions: List[RoutedQuestion],
+    cache: ResponseCache | None = None,
+) -> List[AnswerTool]:
+    """Synchronous version of `dispatch_async`, usable from a tool handler."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(dispatch_async(plugin_manager, questions, cache))
+    # We are called from inside an event loop (e.g. `Task.run_async`),
+    # which can't be re-entered, so the batch gets its own loop. The context is
+    # copied so the plugin spans are still children of the current one.
+    context = contextvars.copy_context()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(
+            context.run,
+            asyncio.run,
+            dispatch_async(plugin_manager, questions, cache),
+        ).result()
@@ -0,0 +1,245 @@
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Set, Tuple
+
+from langroid.agent.special import DocChatAgent, DocChatAgentConfig
+from langroid.mytypes import Document
+from langroid.vector_store.base import VectorStore
+from langroid.vector_store.qdrantdb import QdrantDBConfig
+
+from chunk_store import ChunkStore, get_chunk_store
+from chunking import MarkdownChunker, content_hash, to_document
+from indexing import Progress, embedding_pool
+from retrieval import Corpus, HybridDocChatAgent
+from tracing import get_tracer
+
+INDEX_DIR = ".jarvis/index"
+
+# A local Qdrant storage can only be opened once, so the agents built on the
+# same index share its store (which is synced when it is opened). Each index
+# has its own lock, so several indexes are synced at the same time. Their
+# chunks are loaded once as well, for the keyword (BM25) search.
+_vecdbs: Dict[str, VectorStore] = {}
+_corpora: Dict[Tuple[str, str], Corpus] = {}
+# The version of each index, updated when it is synced
+_versions: Dict[str, str] = {}
+_vecdb_locks: Dict[str, threading.Lock] = {}
+_vecdbs_lock = threading.Lock()
+
+
+def doc_chat_config(**kwargs: Any) -> DocChatAgentConfig:
+    """
+    The config of the agent of a doc plugin. The chunks it retrieves are few
+    enough to be given to the LLM as they are, rather than with an LLM call
+    per chunk to extract them.
+    """
+    return DocChatAgentConfig(relevance_extractor_config=None, **kwargs)
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DocIndex:
+    """
+    Persistent vector index for the `doc_paths` of a DocChatAgent.
+
+    The chunks are stored in an on-disk Qdrant collection under
+    `INDEX_DIR/<name>`, identified by the hash of their content. A manifest
+    keeps the hash of every source file and the ids of its chunks, so on
+    start only the files that changed are chunked again, and only the chunks
+    that are not stored yet are embedded.
+
+    The chunks and their vectors also go through the ChunkStore shared by
+    all the indexes, so a file or a chunk another index has already seen is
+    neither chunked nor embedded again. The files are streamed through, and
+    embedded `embed_batch_size` chunks at a time by the processes of an
+    EmbeddingPool, while the next chunks are read.
+    """
+
+    def __init__(
+        self, name: str, root: str = INDEX_DIR, store: ChunkStore | None = None
+    ):
+        self.name = name
+        self.path = os.path.join(root, name)
+        self.manifest_path = os.path.join(self.path, "manifest.json")
+        self.store = store or get_chunk_store()
+
+    def vecdb_config(self, config: DocChatAgentConfig) -> QdrantDBConfig:
+        embedding = (
+            config.vecdb.embedding if config.vecdb else QdrantDBConfig().embedding
+        )
+        return QdrantDBConfig(
+            collection_name=self.name.lower(),
+            storage_path=os.path.join(self.path, "qdrant"),
+            replace_collection=False,
+            cloud=False,
+            embedding=embedding,
+        )
+
+    def embedding_fingerprint(self, config: DocChatAgentConfig) -> str:
+        return content_hash(self.vecdb_config(config).embedding.json(sort_keys=True))
+
+    def fingerprint(self, config: DocChatAgentConfig) -> str:
+        """Chunks and vectors must be rebuilt when any of these settings change."""
+        return content_hash(
+            MarkdownChunker(config.parsing).fingerprint()
+            + self.embedding_fingerprint(config)
+        )
+
+    def load_manifest(self) -> Dict:
+        if not os.path.exists(self.manifest_path):
+            return {"fingerprint": "", "files": {}}
+        with open(self.manifest_path) as f:
+            return json.load(f)
+
+    def save_manifest(self, manifest: Dict) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+        _versions[self.path] = content_hash(json.dumps(manifest, sort_keys=True))
+
+    def version(self) -> str:
+        """
+        Changes whenever the indexed documents or their chunking change. The
+        manifest is only read the first time, then kept up to date by `sync`.
+        """
+        version = _versions.get(self.path)
+        if version is None:
+            manifest = self.load_manifest()
+            version = content_hash(json.dumps(manifest, sort_keys=True))
+            _versions.setdefault(self.path, version)
+        return version
+
+    def chunk(
+        self, chunker: MarkdownChunker, path: str, digest: str
+    ) -> Iterator[Document]:
+        """The chunks of the file `path`, whose hash is `digest`."""
+        pieces = self.store.get_pieces(digest, chunker.fingerprint())
+        if pieces is None:
+            pieces = self.store.put_pieces(
+                digest, chunker.fingerprint(), chunker.chunks(path)
+            )
+        for trail, content in pieces:
+            yield to_document(path, trail, content)
+
+    def delete(self, agent: DocChatAgent, ids: Set[str]) -> None:
+        from qdrant_client.http.models import PointIdsList
+
+        agent.vecdb.client.delete(
+            collection_name=agent.vecdb.config.collection_name,
+            points_selector=PointIdsList(
+                points=[agent.vecdb._to_int_or_uuid(id) for id in ids]
+            ),
+        )
+
+    def sync(self, agent: DocChatAgent, doc_paths: List[str]) -> int:
+        """
+        Brings the collection up to date with `doc_paths`.
+
+        Returns:
+            int: the number of chunks that were embedded.
+        """
+        manifest = self.load_manifest()
+        fingerprint = self.fingerprint(agent.config)
+        if manifest["fingerprint"] != fingerprint:
+            if manifest["files"]:
+                agent.clear()
+            manifest = {"fingerprint": fingerprint, "files": {}}
+
+        files: Dict[str, Dict] = manifest["files"]
+        stored = {id for entry in files.values() for id in entry["chunks"]}
+        chunker = MarkdownChunker(agent.config.parsing)
+        added: Set[str] = set()
+        batch: List[Document] = []
+
+        progress = Progress(self.name, len(doc_paths))
+        # While a batch is embedded and stored, the next one is being chunked
+        writer = ThreadPoolExecutor(1, thread_name_prefix=f"index-{self.name}")
+        stored_batch: Future | None = None
+
+        def store(batch: List[Document]) -> None:
+            agent.vecdb.add_documents(batch)
+            progress.update(embedded=len(batch))
+
+        def add(batch: List[Document]) -> None:
+            nonlocal stored_batch
+            if stored_batch is not None:
+                stored_batch.result()
+            stored_batch = writer.submit(store, batch)
+
+        embedding_fn = agent.vecdb.embedding_fn
+        try:
+            with embedding_pool(agent.vecdb.config.embedding) as pool:
+                agent.vecdb.embedding_fn = self.store.embedding_fn(
+                    pool, self.embedding_fingerprint(agent.config)
+                )
+                for path in doc_paths:
+                    digest = file_hash(path)
+                    if path in files and files[path]["hash"] == digest:
+                        progress.update(files_done=1)
+                        continue
+                    ids: Dict[str, None] = {}
+                    for chunk in self.chunk(chunker, path, digest):
+                        id = chunk.id()
+                        ids[id] = None
+                        if id in stored or id in added:
+                            continue
+                        added.add(id)
+                        batch.append(chunk)
+                        if len(batch) >= agent.config.embed_batch_size:
+                            add(batch)
+                            batch = []
+                    files[path] = {"hash": digest, "chunks": list(ids)}
+                    progress.update(files_done=1)
+                add(batch)
+                stored_batch.result()
+        finally:
+            writer.shutdown()
+            agent.vecdb.embedding_fn = embedding_fn
+
+        for path in set(files) - set(doc_paths):
+            del files[path]
+
+        # A chunk can be shared by several files, only delete the orphans
+        live = {id for entry in files.values() for id in entry["chunks"]}
+        if stored - live:
+            self.delete(agent, stored - live)
+
+        self.save_manifest(manifest)
+        return len(added)
+
+    def build(self, config: DocChatAgentConfig) -> HybridDocChatAgent:
+        """Creates the agent on top of the persistent index of `config.doc_paths`."""
+        doc_paths = [str(path) for path in config.doc_paths]
+        vecdb_config = self.vecdb_config(config)
+        agent = HybridDocChatAgent(
+            config.copy(update={"doc_paths": [], "vecdb": None})
+        )
+        agent.config.vecdb = vecdb_config
+        with _vecdbs_lock:
+            lock = _vecdb_locks.setdefault(self.path, threading.Lock())
+        with lock:
+            opened = self.path in _vecdbs
+            if not opened:
+                _vecdbs[self.path] = VectorStore.create(vecdb_config)
+            agent.vecdb = _vecdbs[self.path]
+            if not opened:
+                with get_tracer().span("index", self.name) as span:
+                    span.attributes["embedded"] = self.sync(agent, doc_paths)
+            key = (self.path, agent.config.filter or "")
+            if key not in _corpora and agent.vecdb.list_collections():
+                _corpora[key] = Corpus(agent.vecdb.get_all_documents(where=key[1]))
+            corpus = _corpora.get(key)
+        if corpus is not None:
+            agent.use_corpus(corpus)
+        return agent
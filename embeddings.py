@@ -0,0 +1,69 @@
+import threading
+from collections import OrderedDict
+from typing import List
+
+import numpy as np
+from langroid.embedding_models.base import EmbeddingModel, EmbeddingModelsConfig
+
+from config import EMBEDDING_CONFIG
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class Embedder:
+    """
+    Embeds texts into unit vectors, so their dot product is their cosine
+    similarity. The model is created on first use, and the vectors of the
+    last `cache_size` texts are kept, since the same query is usually
+    embedded by the router and then by the answer cache.
+    """
+
+    def __init__(
+        self,
+        config: EmbeddingModelsConfig = EMBEDDING_CONFIG,
+        cache_size: int = 256,
+    ):
+        self.config = config
+        self.cache_size = cache_size
+        self.__model: EmbeddingModel | None = None
+        self.__vectors: OrderedDict[str, np.ndarray] = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        with self.__lock:
+            if self.__model is None:
+                self.__model = EmbeddingModel.create(self.config)
+            found = {
+                text: self.__vectors[text] for text in texts if text in self.__vectors
+            }
+            for text in found:
+                self.__vectors.move_to_end(text)
+        missing = [text for text in dict.fromkeys(texts) if text not in found]
+        if missing:
+            vectors = self.__model.embedding_fn()(missing)
+            vectors = normalize(np.asarray(vectors, dtype=np.float32))
+            found.update(zip(missing, vectors))
+            with self.__lock:
+                for text in missing:
+                    self.__vectors[text] = found[text]
+                while len(self.__vectors) > self.cache_size:
+                    self.__vectors.popitem(last=False)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([found[text] for text in texts])
+
+
+_embedder: Embedder | None = None
+_embedder_lock = threading.Lock()
+
+
+def get_embedder() -> Embedder:
+    """Returns the Embedder shared by the whole process."""
+    global _embedder
+    with _embedder_lock:
+        if _embedder is None:
+            _embedder = Embedder()
+    return _embedder
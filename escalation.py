@@ -0,0 +1,150 @@
+import threading
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, TypeVar
+
+import langroid as lr
+import langroid.language_models as lm
+from langroid.pydantic_v1 import ValidationError
+
+from config import LLM_CONFIGS
+
+T = TypeVar("T")
+
+TIERS = ["tiny", "small", "medium"]
+
+
+def tool_selection_error(agent: lr.ChatAgent, response: Any) -> str | None:
+    """
+    Why `response` is not a valid tool selection for `agent`, or None if it is:
+    it must contain well-formed JSON for tools the agent may use.
+    """
+    if response is None:
+        return "no response"
+    try:
+        tools = agent.get_tool_messages(response, all_tools=True)
+    except (ValidationError, ValueError) as e:
+        return f"malformed tool: {e}"
+    if not tools:
+        return "no tool"
+    unknown = [
+        tool.default_value("request")
+        for tool in tools
+        if tool.default_value("request") not in agent.llm_tools_usable
+        and tool.default_value("request") not in agent.llm_tools_handled
+    ]
+    if unknown:
+        return f"unknown tools: {unknown}"
+    return None
+
+
+class EscalationPolicy:
+    """
+    Tool-selection turns are first sent to the cheapest tier of `tiers`, and
+    only sent to the next one when the answer is not a valid tool selection.
+    The tier each turn ended on is recorded per agent.
+    """
+
+    def __init__(self, tiers: List[str] = TIERS, enabled: bool = True):
+        self.tiers = tiers
+        self.enabled = enabled
+        self.__turns: Dict[str, Dict[str, int]] = defaultdict(
+            lambda: defaultdict(int)
+        )
+        self.__failures: Dict[str, int] = defaultdict(int)
+        self.__lock = threading.Lock()
+
+    def record(self, agent: str, tier: str, valid: bool) -> None:
+        with self.__lock:
+            self.__turns[agent][tier] += 1
+            if not valid:
+                self.__failures[agent] += 1
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per agent: the turns ended on each tier and the escalation rate."""
+        with self.__lock:
+            stats = {}
+            for agent, by_tier in self.__turns.items():
+                turns = sum(by_tier.values())
+                escalated = turns - by_tier.get(self.tiers[0], 0)
+                stats[agent] = {
+                    "turns": turns,
+                    "by_tier": dict(by_tier),
+                    "escalation_rate": escalated / turns if turns else 0.0,
+                    "failures": self.__failures[agent],
+                }
+            return stats
+
+
+class ModelLadder:
+    """
+    The LLMs of the tiers an agent can be escalated through. They are created
+    the first time they are used, and belong to the agent since langroid sets
+    the streaming callback on the LLM of the responding agent.
+    """
+
+    def __init__(self, agent: lr.ChatAgent, policy: EscalationPolicy | None = None):
+        self.agent = agent
+        self.policy = policy or get_escalation_policy()
+        self.__models: Dict[str, lm.LanguageModel] = {}
+
+    def model(self, tier: str) -> lm.LanguageModel:
+        if tier not in self.__models:
+            self.__models[tier] = lm.LanguageModel.create(LLM_CONFIGS[tier])
+        return self.__models[tier]
+
+    def __attempt(self, tier: str, response: Any, last: bool) -> bool:
+        error = tool_selection_error(self.agent, response)
+        if error is None or last:
+            self.policy.record(self.agent.config.name, tier, error is None)
+            return True
+        return False
+
+    def respond(self, respond: Callable[[], T]) -> T:
+        """Runs the tool-selection turn `respond`, escalating on failure."""
+        if not self.policy.enabled:
+            return respond()
+        agent = self.agent
+        llm = agent.llm
+        n_messages = len(agent.message_history)
+        try:
+            for i, tier in enumerate(self.policy.tiers):
+                agent.llm = self.model(tier)
+                response = respond()
+                if self.__attempt(tier, response, i == len(self.policy.tiers) - 1):
+                    return response
+                # The failed attempt must not be seen by the next tier
+                del agent.message_history[n_messages:]
+        finally:
+            agent.llm = llm
+        return response
+
+    async def respond_async(self, respond: Callable[[], Awaitable[T]]) -> T:
+        """Async version of `respond`."""
+        if not self.policy.enabled:
+            return await respond()
+        agent = self.agent
+        llm = agent.llm
+        n_messages = len(agent.message_history)
+        try:
+            for i, tier in enumerate(self.policy.tiers):
+                agent.llm = self.model(tier)
+                response = await respond()
+                if self.__attempt(tier, response, i == len(self.policy.tiers) - 1):
+                    return response
+                del agent.message_history[n_messages:]
+        finally:
+            agent.llm = llm
+        return response
+
+
+_escalation_policy: EscalationPolicy | None = None
+_escalation_policy_lock = threading.Lock()
+
+
+def get_escalation_policy() -> EscalationPolicy:
+    """Returns the EscalationPolicy shared by the whole process."""
+    global _escalation_policy
+    with _escalation_policy_lock:
+        if _escalation_policy is None:
+            _escalation_policy = EscalationPolicy()
+    return _escalation_policy
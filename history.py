@@ -0,0 +1,115 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+import langroid as lr
+from langroid import ChatDocument
+from langroid.language_models import LLMMessage, Role
+
+from config import (
+    HISTORY_KEEP_RECENT,
+    HISTORY_RESULT_TOKENS,
+    HISTORY_TOKEN_BUDGET,
+)
+from tracing import current_span
+
+TRUNCATED = " [...]"
+
+
+class HistoryCompactor:
+    """
+    Keeps the message history of an agent under `budget` tokens. The system
+    message, the first user message (the original query) and the last
+    `keep_recent` messages are kept as they are. Older messages longer than
+    `result_tokens` (mostly the answers of the plugins) are truncated first.
+    Then the oldest messages are dropped.
+
+    The token count of each message is cached, since the same messages are
+    counted again on every turn.
+    """
+
+    def __init__(
+        self,
+        agent: lr.ChatAgent,
+        budget: int = HISTORY_TOKEN_BUDGET,
+        keep_recent: int = HISTORY_KEEP_RECENT,
+        result_tokens: int = HISTORY_RESULT_TOKENS,
+        cache_size: int = 4096,
+    ):
+        self.agent = agent
+        self.budget = budget
+        self.keep_recent = keep_recent
+        self.result_tokens = result_tokens
+        self.cache_size = cache_size
+        self.truncated = 0
+        self.dropped = 0
+        self.tokens_saved = 0
+        self.__counts: OrderedDict[Tuple[str, str], int] = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def count(self, text: str) -> int:
+        if self.agent.parser is None:
+            return len(text) // 4
+        return self.agent.parser.num_tokens(text)
+
+    def tokens(self, msg: LLMMessage) -> int:
+        key = (msg.content, str(msg.function_call or msg.tool_calls or ""))
+        with self.__lock:
+            if key in self.__counts:
+                self.__counts.move_to_end(key)
+                return self.__counts[key]
+        tokens = self.count(key[0]) + self.count(key[1])
+        with self.__lock:
+            self.__counts[key] = tokens
+            if len(self.__counts) > self.cache_size:
+                self.__counts.popitem(last=False)
+        return tokens
+
+    def truncate(self, text: str) -> str:
+        """The first `result_tokens` tokens of `text`."""
+        if self.agent.parser is None:
+            return text[: self.result_tokens * 4] + TRUNCATED
+        tokenizer = self.agent.parser.tokenizer
+        tokens = tokenizer.encode(text)[: self.result_tokens]
+        return tokenizer.decode(tokens) + TRUNCATED
+
+    def compact(self, history: List[LLMMessage]) -> int:
+        """Compacts `history` in place, returns its number of tokens."""
+        total = sum(self.tokens(msg) for msg in history)
+        before = total
+        start = 1 if history and history[0].role == Role.SYSTEM else 0
+        # The original query is what the later messages are all about
+        first_user = next(
+            (i for i in range(start, len(history)) if history[i].role == Role.USER),
+            None,
+        )
+        if first_user is not None:
+            start = first_user + 1
+        end = max(start, len(history) - self.keep_recent)
+        if total > self.budget:
+            for i in range(start, end):
+                msg = history[i]
+                tokens = self.tokens(msg)
+                if tokens <= self.result_tokens or msg.content.endswith(TRUNCATED):
+                    continue
+                history[i] = msg.copy(update={"content": self.truncate(msg.content)})
+                total += self.tokens(history[i]) - tokens
+                self.truncated += 1
+        while total > self.budget and end > start:
+            total -= self.tokens(history[start])
+            ChatDocument.delete_id(history[start].chat_document_id)
+            del history[start]
+            end -= 1
+            self.dropped += 1
+        self.tokens_saved += before - total
+        span = current_span()
+        if span is not None:
+            span.attributes["history_tokens"] = total
+        return total
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "truncated": self.truncated,
+            "dropped": self.dropped,
+            "tokens_saved": self.tokens_saved,
+        }
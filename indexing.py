@@ -0,0 +1,151 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+import numpy as np
+from langroid.embedding_models.base import EmbeddingModelsConfig
+
+from config import EMBED_BATCH_SIZE, INDEX_WORKERS
+
+# The embedding function of an indexing process
+_embed: Callable[[List[str]], Any] | None = None
+
+
+def init_worker(config: EmbeddingModelsConfig, threads: int) -> None:
+    global _embed
+    try:
+        import torch
+
+        # The processes share the cores rather than each using all of them
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    from langroid.embedding_models.base import EmbeddingModel
+
+    _embed = EmbeddingModel.create(config).embedding_fn()
+
+
+def embed(texts: List[str]) -> np.ndarray:
+    assert _embed is not None
+    return np.asarray(_embed(texts), dtype=np.float32)
+
+
+class EmbeddingPool:
+    """
+    Embeds texts on a pool of processes, each with its own copy of the
+    embedding model, so indexing uses all the cores. The texts are split in
+    batches of `batch_size`, of texts of similar lengths since a batch is
+    padded to its longest one.
+
+    At most `max_pending` batches wait for a process: the callers block
+    until one is done, so several indexes filling the pool at the same time
+    don't pile their chunks up in memory.
+    """
+
+    def __init__(
+        self,
+        config: EmbeddingModelsConfig,
+        workers: int = INDEX_WORKERS,
+        batch_size: int = EMBED_BATCH_SIZE,
+        max_pending: int | None = None,
+    ):
+        self.batch_size = batch_size
+        self.__pending = threading.BoundedSemaphore(max_pending or 2 * workers)
+        # The processes are started, and load the model, on the first batch
+        self.__pool = ProcessPoolExecutor(
+            workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(config, max(1, (os.cpu_count() or 1) // workers)),
+        )
+
+    def batches(self, texts: List[str]) -> List[List[int]]:
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        return [
+            order[i : i + self.batch_size]
+            for i in range(0, len(order), self.batch_size)
+        ]
+
+    def submit(self, texts: List[str]) -> Future:
+        self.__pending.acquire()
+        future = self.__pool.submit(embed, texts)
+        future.add_done_callback(lambda _: self.__pending.release())
+        return future
+
+    def __call__(self, texts: List[str]) -> List[List[float]]:
+        vectors: List[List[float]] = [[] for _ in texts]
+        futures = [
+            (batch, self.submit([texts[i] for i in batch]))
+            for batch in self.batches(texts)
+        ]
+        for batch, future in futures:
+            for i, vector in zip(batch, future.result()):
+                vectors[i] = vector.tolist()
+        return vectors
+
+    def close(self) -> None:
+        self.__pool.shutdown()
+
+
+# The pools in use, per embedding model, with how many indexes use them
+_pools: Dict[str, Tuple[EmbeddingPool, int]] = {}
+_pools_lock = threading.Lock()
+
+
+@contextmanager
+def embedding_pool(config: EmbeddingModelsConfig) -> Iterator[EmbeddingPool]:
+    """
+    The EmbeddingPool of the model `config`, shared by the indexes built at
+    the same time. Its processes stop once the last of them is done, so the
+    copies of the model don't stay in memory.
+    """
+    key = config.json(sort_keys=True)
+    with _pools_lock:
+        pool, users = _pools.get(key, (None, 0))
+        if pool is None:
+            pool = EmbeddingPool(config)
+        _pools[key] = (pool, users + 1)
+    try:
+        yield pool
+    finally:
+        with _pools_lock:
+            pool, users = _pools.pop(key)
+            if users > 1:
+                _pools[key] = (pool, users - 1)
+        if users == 1:
+            pool.close()
+
+
+class Progress:
+    """Prints how far the indexing of `name` is, every `interval` seconds."""
+
+    def __init__(self, name: str, files: int, interval: float = 5.0):
+        self.name = name
+        self.files = files
+        self.interval = interval
+        self.files_done = 0
+        self.embedded = 0
+        self.start = time.time()
+        self.last = self.start
+        self.__lock = threading.Lock()
+
+    def update(self, files_done: int = 0, embedded: int = 0) -> None:
+        with self.__lock:
+            self.files_done += files_done
+            self.embedded += embedded
+            now = time.time()
+            if now - self.last < self.interval:
+                return
+            self.last = now
+        print(self)
+
+    def __str__(self) -> str:
+        rate = self.embedded / max(time.time() - self.start, 1e-6)
+        return (
+            f"{self.name} index: {self.files_done}/{self.files} files, "
+            f"{self.embedded} chunks stored ({rate:.1f}/s)"
+        )
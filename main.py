@@ -1,25 +1,228 @@
+import threading
+from typing import List
+
 import langroid as lr
 import typer
 from rich.prompt import Prompt
 
 from config import LLM_CONFIGS
 
-from MainAgent import MainAgent
-from plugin import PluginManager
+from MainAgent import MainAgent, plugin_manager
+from response_cache import ResponseCache
+from escalation import get_escalation_policy
+from ollama_client import get_ollama
+from tool_executor import get_tool_executor
+from router import PluginRouter
+from tracing import format_summary, get_tracer, load_spans, summarize
 
 app = typer.Typer()
 
 lr.utils.logging.setup_colored_logging()
 
-plugin_manager = PluginManager()
-
 
 @app.command()
-def chat():
-    main_agent = MainAgent()
+def chat(
+    route: bool = typer.Option(
+        True, "--route/--no-route", help="skip the LLM for unambiguous queries"
+    ),
+    answer_cache: bool = typer.Option(
+        True, "--answer-cache/--no-answer-cache", help="reuse the plugins' answers"
+    ),
+    trace: str = typer.Option("", "--trace", help="append the spans to this JSONL"),
+    escalate: bool = typer.Option(
+        True, "--escalate/--no-escalate", help="pick tools with the cheapest LLM first"
+    ),
+    warm_up: bool = typer.Option(
+        True, "--warm-up/--no-warm-up", help="load the models and the plugins up front"
+    ),
+    speculate: bool = typer.Option(
+        False, "--speculate/--no-speculate", help="start the plugins on the tool JSON"
+    ),
+):
+    if warm_up:
+        # The models load, and the docs are indexed, while the user types
+        get_ollama().start()
+        threading.Thread(target=plugin_manager.build_all, daemon=True).start()
+    tracer = get_tracer()
+    tracer.path = trace or None
+    get_escalation_policy().enabled = escalate
+    cache = ResponseCache() if answer_cache else None
+    main_agent = MainAgent(
+        PluginRouter(plugin_manager) if route else None, cache, speculate=speculate
+    )
 
     question = Prompt.ask("What do you want to do ?")
     main_agent.run(question)
+    if cache is not None:
+        print("Answer cache:", cache.stats())
+    if escalate:
+        print("Model escalation:", get_escalation_policy().stats())
+    print("History compaction:", main_agent.agent.compactor.stats())
+    print("Ollama:", get_ollama().stats())
+    print("Plugin tools:", get_tool_executor().stats())
+    if main_agent.speculator is not None:
+        print("Speculation:", main_agent.speculator.stats())
+    print(format_summary(tracer.summary()))
+
+
+@app.command()
+def serve(
+    host: str = typer.Option("127.0.0.1", "--host", help="address to listen on"),
+    port: int = typer.Option(8080, "--port", "-p", help="port to listen on"),
+    pool_size: int = typer.Option(
+        2, "--pool-size", help="how many sessions are answered at the same time"
+    ),
+    route: bool = typer.Option(
+        True, "--route/--no-route", help="skip the LLM for unambiguous queries"
+    ),
+    answer_cache: bool = typer.Option(
+        True, "--answer-cache/--no-answer-cache", help="reuse the plugins' answers"
+    ),
+    trace: str = typer.Option("", "--trace", help="append the spans to this JSONL"),
+    warm_up: bool = typer.Option(
+        True, "--warm-up/--no-warm-up", help="load the models and the plugins up front"
+    ),
+    reload: bool = typer.Option(
+        False, "--reload/--no-reload", help="reload the plugins whose files change"
+    ),
+    speculate: bool = typer.Option(
+        False, "--speculate/--no-speculate", help="start the plugins on the tool JSON"
+    ),
+):
+    """Serves many concurrent sessions over HTTP and WebSocket."""
+    from aiohttp import web
+
+    from plugin_watcher import PluginWatcher
+    from server import AgentPool, JarvisServer
+
+    if warm_up:
+        get_ollama().start()
+        threading.Thread(target=plugin_manager.build_all, daemon=True).start()
+    if reload:
+        PluginWatcher(plugin_manager).start()
+    get_tracer().path = trace or None
+    pool = AgentPool(
+        pool_size,
+        PluginRouter(plugin_manager) if route else None,
+        ResponseCache() if answer_cache else None,
+        speculate,
+    )
+    web.run_app(JarvisServer(pool).app(), host=host, port=port)
+
+
+@app.command()
+def voice(
+    file: str = typer.Option(
+        "", "--file", "-f", help="a 16kHz mono WAV/PCM to use instead of the mic"
+    ),
+    speed: float = typer.Option(
+        1.0, "--speed", "-s", help="replay speed of --file, 1 is real time"
+    ),
+    model_size: str = typer.Option("small", "--model", "-m", help="whisper size"),
+    device: str = typer.Option("auto", "--device", "-d", help="auto, cpu or cuda"),
+    backend: str = typer.Option(
+        "whisper", "--backend", "-b", help="whisper or faster-whisper"
+    ),
+    route: bool = typer.Option(
+        True, "--route/--no-route", help="skip the LLM for unambiguous queries"
+    ),
+    answer_cache: bool = typer.Option(
+        True, "--answer-cache/--no-answer-cache", help="reuse the plugins' answers"
+    ),
+    warm_up: bool = typer.Option(
+        True, "--warm-up/--no-warm-up", help="load the models and the plugins up front"
+    ),
+):
+    """Runs the queries spoken into the microphone, as they are transcribed."""
+    from speech_model import SpeechModelConfig, SpeechModelProvider
+    from voice import UtteranceQueue, listen, run_queries
+
+    if warm_up:
+        get_ollama().start()
+        threading.Thread(target=plugin_manager.build_all, daemon=True).start()
+    speech_model = SpeechModelProvider(
+        SpeechModelConfig(size=model_size, device=device, backend=backend)
+    )
+    # Loaded now, so the first query is not late
+    speech_model.get()
+    main_agent = MainAgent(
+        PluginRouter(plugin_manager) if route else None,
+        ResponseCache() if answer_cache else None,
+        interactive=False,
+    )
+    queue = UtteranceQueue()
+    listen(speech_model, queue, file or None, speed)
+    try:
+        stats = run_queries(main_agent, queue)
+    except KeyboardInterrupt:
+        print("Exiting...")
+        return
+    print("Voice:", stats)
+
+
+@app.command()
+def index(
+    names: List[str] = typer.Argument(None, help="the plugins, all of them by default")
+):
+    """Builds the plugins, indexing the docs of the doc plugins in parallel."""
+    plugin_manager.build_all(names or None)
+
+
+@app.command()
+def traces(path: str = typer.Argument(..., help="JSONL written by chat --trace")):
+    """Shows where the time and the tokens of the traced queries were spent."""
+    print(format_summary(summarize(load_spans(path))))
+
+
+@app.command()
+def bench(
+    corpus: str = typer.Argument(
+        "benchmarks/queries.jsonl", help="JSONL of the queries to run"
+    ),
+    fixtures: str = typer.Option(
+        "benchmarks/fixtures.jsonl", "--fixtures", help="the recorded LLM answers"
+    ),
+    record: bool = typer.Option(
+        False, "--record", help="call the real LLMs and record their answers"
+    ),
+    first_token_latency: float = typer.Option(
+        0.2, "--first-token-latency", help="replayed seconds before the first token"
+    ),
+    token_latency: float = typer.Option(
+        0.02, "--token-latency", help="replayed seconds between tokens"
+    ),
+    output: str = typer.Option("", "--output", help="write the report to this JSON"),
+    baseline: str = typer.Option(
+        "", "--baseline", help="fail if worse than the report in this JSON"
+    ),
+    tolerance: float = typer.Option(
+        0.1, "--tolerance", help="allowed slowdown of the timings, as a fraction"
+    ),
+):
+    """Runs a corpus of queries with replayed LLM answers, for regressions."""
+    import json
+
+    from benchmark import format_report, load_corpus, regressions, run_benchmark
+    from replay import LLMRecorder
+
+    recorder = LLMRecorder(
+        fixtures,
+        mode="record" if record else "replay",
+        first_token_latency=first_token_latency,
+        token_latency=token_latency,
+    )
+    report = run_benchmark(load_corpus(corpus), recorder, plugin_manager)
+    print(format_report(report))
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+    if baseline:
+        with open(baseline) as f:
+            found = regressions(report, json.load(f), tolerance)
+        for regression in found:
+            print("REGRESSION", regression)
+        if found:
+            raise typer.Exit(1)
 
 
 @app.command()
@@ -41,7 +244,15 @@ def main(
             stream=not no_stream,
         )
     )
-    chat(tools)
+    # Called as a function, so the typer options get their defaults here
+    chat(
+        route=True,
+        answer_cache=True,
+        trace="",
+        escalate=True,
+        warm_up=True,
+        speculate=False,
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,313 @@
+import asyncio
+import threading
+import time
+import weakref
+from collections import defaultdict
+from typing import Any, Dict, List
+
+import httpx
+import langroid as lr
+import langroid.language_models as lm
+from langroid.language_models.openai_gpt import OLLAMA_BASE_URL, OpenAIGPT
+from openai import AsyncOpenAI, OpenAI, Timeout
+
+from config import (
+    LLM_CONFIGS,
+    OLLAMA_KEEP_ALIVE,
+    OLLAMA_MAX_CONNECTIONS,
+    OLLAMA_MEMORY_BUDGET,
+    OLLAMA_PING_INTERVAL,
+    WARM_TIERS,
+)
+from tracing import current_span, model_name
+
+# How long Ollama keeps a model loaded after a request without `keep_alive`
+SERVER_KEEP_ALIVE = 5 * 60
+
+
+class Ollama:
+    """
+    The client side of the Ollama server shared by all the LLMs of the process:
+
+    - the LLM calls reuse a pool of keep-alive HTTP connections, rather than
+      each LLM opening its own. The async calls have a pool per event loop,
+      as their connections can't be used by another loop;
+    - `warm_up` loads the models of the tiers before the first query, as long
+      as they fit in `memory_budget` bytes;
+    - while the process has been used in the last `keep_alive` seconds, the
+      warmed up models are pinged so that the server does not unload them;
+    - every LLM call is recorded as cold (the model had to be loaded first)
+      or warm, with its time to first token.
+
+    Whether a model is loaded is tracked from the warm-up, the pings and the
+    LLM calls, rather than asked to the server on every call.
+    """
+
+    def __init__(
+        self,
+        url: str = OLLAMA_BASE_URL.removesuffix("/v1"),
+        keep_alive: int = OLLAMA_KEEP_ALIVE,
+        memory_budget: int = OLLAMA_MEMORY_BUDGET,
+        max_connections: int = OLLAMA_MAX_CONNECTIONS,
+    ):
+        self.url = url
+        self.keep_alive = keep_alive
+        self.memory_budget = memory_budget
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=keep_alive,
+        )
+        self.timeout = max(config.timeout for config in LLM_CONFIGS.values())
+        self.http = httpx.Client(limits=self.limits, timeout=self.timeout)
+        self.last_used = time.time()
+        self.__shared: weakref.WeakSet[lm.LanguageModel] = weakref.WeakSet()
+        self.__async_http: weakref.WeakKeyDictionary[
+            asyncio.AbstractEventLoop, httpx.AsyncClient
+        ] = weakref.WeakKeyDictionary()
+        # The async connections each LLM was given, those of its last loop
+        self.__async_shared: weakref.WeakKeyDictionary[
+            lm.LanguageModel, httpx.AsyncClient
+        ] = weakref.WeakKeyDictionary()
+        self.__pinned: Dict[str, int] = {}
+        self.__loads: Dict[str, float] = {}
+        # Until when each model should stay loaded on the server
+        self.__loaded_until: Dict[str, float] = {}
+        self.__latencies: Dict[str, Dict[bool, List[float]]] = defaultdict(
+            lambda: {True: [], False: []}
+        )
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+        self.__pinger: threading.Thread | None = None
+
+    def share_connections(self, llm: lm.LanguageModel) -> lm.LanguageModel:
+        """Makes the Ollama LLM `llm` use the pooled connections."""
+        if not isinstance(llm, OpenAIGPT) or not llm.config.ollama:
+            return llm
+        with self.__lock:
+            if llm in self.__shared:
+                return llm
+            self.__shared.add(llm)
+        llm.client = OpenAI(
+            api_key=llm.api_key,
+            base_url=llm.api_base,
+            organization=llm.config.organization,
+            timeout=Timeout(llm.config.timeout),
+            http_client=self.http,
+        )
+        return llm
+
+    def async_http(self) -> httpx.AsyncClient:
+        """The pooled async connections of the running event loop."""
+        loop = asyncio.get_running_loop()
+        with self.__lock:
+            client = self.__async_http.get(loop)
+            if client is None:
+                client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+                self.__async_http[loop] = client
+        return client
+
+    def share_async_connections(self, llm: lm.LanguageModel) -> lm.LanguageModel:
+        """
+        Makes the async calls of the Ollama LLM `llm` use the pooled
+        connections of the running event loop.
+        """
+        if not isinstance(llm, OpenAIGPT) or not llm.config.ollama:
+            return llm
+        http = self.async_http()
+        with self.__lock:
+            if self.__async_shared.get(llm) is http:
+                return llm
+            self.__async_shared[llm] = http
+        llm.async_client = AsyncOpenAI(
+            api_key=llm.api_key,
+            base_url=llm.api_base,
+            organization=llm.config.organization,
+            timeout=Timeout(llm.config.timeout),
+            http_client=http,
+        )
+        return llm
+
+    def sizes(self) -> Dict[str, int]:
+        """The size in bytes of the models pulled on the server."""
+        response = self.http.get(f"{self.url}/api/tags")
+        response.raise_for_status()
+        return {m["name"]: m["size"] for m in response.json().get("models", [])}
+
+    def loaded(self) -> Dict[str, int]:
+        """The size in memory of the models currently loaded by the server."""
+        response = self.http.get(f"{self.url}/api/ps")
+        response.raise_for_status()
+        return {m["name"]: m["size"] for m in response.json().get("models", [])}
+
+    def mark_loaded(self, model: str, seconds: float) -> None:
+        """Records that `model` stays loaded for at least `seconds` from now."""
+        with self.__lock:
+            until = time.time() + seconds
+            self.__loaded_until[model] = max(self.__loaded_until.get(model, 0), until)
+
+    def is_loaded(self, model: str) -> bool:
+        with self.__lock:
+            return self.__loaded_until.get(model, 0) > time.time()
+
+    def load(self, model: str) -> float:
+        """
+        Loads `model` for `keep_alive` seconds, returns how long loading it
+        took: 0 when it was already loaded.
+        """
+        start = time.time()
+        response = self.http.post(
+            f"{self.url}/api/generate",
+            json={"model": model, "keep_alive": self.keep_alive},
+        )
+        response.raise_for_status()
+        self.mark_loaded(model, self.keep_alive)
+        load_duration = response.json().get("load_duration")
+        if load_duration is None:
+            return time.time() - start
+        return load_duration / 1e9
+
+    def warm_up(self, tiers: List[str] = WARM_TIERS) -> Dict[str, float]:
+        """
+        Loads the models of `tiers`, in this order, skipping those that would
+        exceed the memory budget. Returns the load time of each tier.
+        """
+        try:
+            sizes = self.sizes()
+            loaded = self.loaded()
+        except httpx.HTTPError as e:
+            print(f"Ollama warm-up skipped: {e}")
+            return {}
+        for model in loaded:
+            self.mark_loaded(model, SERVER_KEEP_ALIVE)
+        times = {}
+        used = sum(self.__pinned.values())
+        for tier in tiers:
+            model = model_name(LLM_CONFIGS[tier].chat_model)
+            size = loaded.get(model) or sizes.get(model)
+            if size is None:
+                print(f"Ollama warm-up: {model} is not pulled")
+                continue
+            if model in self.__pinned:
+                continue
+            if used + size > self.memory_budget:
+                print(f"Ollama warm-up: {model} does not fit in the memory budget")
+                continue
+            used += size
+            times[tier] = 0.0 if model in loaded else self.load(model)
+            with self.__lock:
+                self.__pinned[model] = size
+                self.__loads[model] = times[tier]
+        return times
+
+    def ping(self) -> None:
+        """Keeps the warmed up models loaded, unless the process is idle."""
+        if time.time() - self.last_used > self.keep_alive:
+            return
+        for model in list(self.__pinned):
+            try:
+                self.load(model)
+            except httpx.HTTPError:
+                pass
+
+    def start(self, interval: float = OLLAMA_PING_INTERVAL) -> None:
+        """Warms the models up and keeps them loaded, in the background."""
+        if self.__pinger is not None:
+            return
+
+        def run() -> None:
+            self.warm_up()
+            while not self.__stop.wait(interval):
+                self.ping()
+
+        self.__pinger = threading.Thread(target=run, daemon=True)
+        self.__pinger.start()
+
+    def stop(self) -> None:
+        self.__stop.set()
+
+    def record(self, model: str, cold: bool, seconds: float) -> None:
+        # The call loaded the model, if it was not already
+        self.mark_loaded(model, SERVER_KEEP_ALIVE)
+        with self.__lock:
+            self.last_used = time.time()
+            self.__latencies[model][cold].append(seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        def mean(values: List[float]) -> float | None:
+            return sum(values) / len(values) if values else None
+
+        with self.__lock:
+            return {
+                "warm_up_seconds": dict(self.__loads),
+                "models": {
+                    model: {
+                        "cold_calls": len(latencies[True]),
+                        "warm_calls": len(latencies[False]),
+                        "cold_mean_seconds": mean(latencies[True]),
+                        "warm_mean_seconds": mean(latencies[False]),
+                    }
+                    for model, latencies in self.__latencies.items()
+                },
+            }
+
+
+def pool_agent(agent: lr.ChatAgent, ollama: Ollama | None = None) -> lr.ChatAgent:
+    """
+    Makes the LLM calls of `agent` share the pooled connections, and records
+    whether the model had to be loaded for each of them.
+    """
+    ollama = ollama or get_ollama()
+    llm_response_messages = agent.llm_response_messages
+    llm_response_messages_async = agent.llm_response_messages_async
+
+    def before() -> tuple[str | None, bool, float]:
+        # The LLM may be swapped for another tier by a ModelLadder
+        llm = agent.llm
+        if llm is None or not llm.config.ollama:
+            return None, False, time.time()
+        ollama.share_connections(llm)
+        model = model_name(llm.config.chat_model)
+        return model, not ollama.is_loaded(model), time.time()
+
+    def after(model: str | None, cold: bool, start: float) -> None:
+        if model is None:
+            return
+        span = current_span()
+        seconds = time.time() - start
+        if span is not None:
+            span.attributes["cold"] = cold
+            if span.time_to_first_token is not None:
+                seconds = span.time_to_first_token
+        ollama.record(model, cold, seconds)
+
+    def pooled_llm_response_messages(*args: Any, **kwargs: Any) -> Any:
+        call = before()
+        result = llm_response_messages(*args, **kwargs)
+        after(*call)
+        return result
+
+    async def pooled_llm_response_messages_async(*args: Any, **kwargs: Any) -> Any:
+        call = before()
+        if agent.llm is not None:
+            ollama.share_async_connections(agent.llm)
+        result = await llm_response_messages_async(*args, **kwargs)
+        after(*call)
+        return result
+
+    agent.llm_response_messages = pooled_llm_response_messages
+    agent.llm_response_messages_async = pooled_llm_response_messages_async
+    return agent
+
+
+_ollama: Ollama | None = None
+_ollama_lock = threading.Lock()
+
+
+def get_ollama() -> Ollama:
+    """Returns the Ollama client shared by the whole process."""
+    global _ollama
+    with _ollama_lock:
+        if _ollama is None:
+            _ollama = Ollama()
+    return _ollama
@@ -1,16 +1,31 @@
 # https://mwax911.medium.com/building-a-plugin-architecture-with-python-7b4ab39ad4fc
 
-from typing import Iterable, Optional, List, Type
+from typing import Any, Dict, Iterable, Iterator, Optional, List, Tuple, Type
+from contextlib import contextmanager
+from contextvars import ContextVar
 from dataclasses import dataclass
 from abc import ABC, abstractmethod
 import langroid as lr
 from langroid.agent.tools.orchestration import AgentDoneTool
+from langroid.pydantic_v1 import ValidationError
+import functools
 import importlib
+import importlib.util
 import pkgutil
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import plugins
 import inspect
+from concurrency import limit_agent
+from escalation import ModelLadder
+from ollama_client import pool_agent
+from streaming import relay_agent
+from tool_executor import combine_results, get_tool_executor
+from tool_repair import ToolRepair
 from tools import QuestionTool, AnswerTool
+from tracing import trace_agent
 
 
 @dataclass
@@ -23,6 +38,66 @@ class Meta:
         return f"{self.name}: {self.version}"
 
 
+def as_list(value: Any) -> List[Any]:
+    """Plugins may register nothing, a single object, or a list of them."""
+    if not value:
+        return []
+    if isinstance(value, Iterable):
+        return list(value)
+    return [value]
+
+
+class Discarded(Exception):
+    """Raised in a plugin whose answer is not wanted anymore."""
+
+
+# Set once the answers of the plugins running in the context are not wanted
+_discarded: ContextVar[threading.Event | None] = ContextVar("discarded", default=None)
+
+
+@contextmanager
+def discard_on(event: threading.Event) -> Iterator[None]:
+    """
+    Stops the plugins answering in the block (or in the threads and asyncio
+    tasks it starts) before their next generation, once `event` is set.
+    """
+    token = _discarded.set(event)
+    try:
+        yield
+    finally:
+        _discarded.reset(token)
+
+
+def check_discarded() -> None:
+    event = _discarded.get()
+    if event is not None and event.is_set():
+        raise Discarded("The answer was discarded")
+
+
+def discard_agent(agent: lr.ChatAgent) -> lr.ChatAgent:
+    """
+    Makes every LLM call of `agent` raise `Discarded` once its answer is not
+    wanted anymore. Wrapped by `limit_agent`, so it is checked once the slot
+    of the tier is acquired and a discarded answer doesn't hold it.
+    """
+    llm_response_messages = agent.llm_response_messages
+    llm_response_messages_async = agent.llm_response_messages_async
+
+    def discardable_llm_response_messages(*args: Any, **kwargs: Any) -> Any:
+        check_discarded()
+        return llm_response_messages(*args, **kwargs)
+
+    async def discardable_llm_response_messages_async(
+        *args: Any, **kwargs: Any
+    ) -> Any:
+        check_discarded()
+        return await llm_response_messages_async(*args, **kwargs)
+
+    agent.llm_response_messages = discardable_llm_response_messages
+    agent.llm_response_messages_async = discardable_llm_response_messages_async
+    return agent
+
+
 class PluginAgent(lr.ChatAgent, ABC):
     def init_state(self) -> None:
         super().init_state()
@@ -33,20 +108,52 @@ class PluginAgent(lr.ChatAgent, ABC):
     def __init__(self, config: lr.ChatAgentConfig):
         super().__init__(config)
         self.config = config
+        self.ladder = ModelLadder(self)
+        self.repair = ToolRepair(self)
         self.enable_message(self.register_tools())
         self.enable_message([QuestionTool, AnswerTool], use=False, handle=True)
+        self.plugin_tools = {
+            tool.default_value("request") for tool in as_list(self.register_tools())
+        }
 
     @abstractmethod
     def register_tools(self) -> List[lr.ToolMessage] | None:
         return None
 
+    def handle_message(self, msg: str | lr.ChatDocument) -> Any:
+        # Nearly valid tool JSON is fixed here rather than by another generation
+        msg = self.repair.apply(msg)
+        try:
+            tools = [
+                tool
+                for tool in self.get_tool_messages(msg)
+                if self._tool_recipient_match(tool)
+            ]
+        except (ValidationError, ValueError):
+            tools = []
+        if not tools or any(
+            tool.default_value("request") not in self.plugin_tools for tool in tools
+        ):
+            return super().handle_message(msg)
+        # The plugin's own tools run concurrently, the orchestration ones in order
+        chat_doc = msg if isinstance(msg, lr.ChatDocument) else None
+        results = get_tool_executor().run(self, tools, chat_doc)
+        # Set here rather than only by the handlers, which a cached result skips
+        self.expecting_tool_result = True
+        self.expecting_tool_use = False
+        return combine_results(tools, results)
+
     def handle_message_fallback(
         self, msg: str | lr.ChatDocument
-    ) -> str | lr.ChatDocument | None:
-        print("FALLBACK")
+    ) -> str | lr.ChatDocument | lr.ToolMessage | None:
         if self.current_query is None:
             return None
         if self.expecting_tool_use:
+            if not self.repair.retry():
+                result = f"The task could not be executed: {self.current_query}"
+                self.current_query = None
+                self.expecting_tool_use = False
+                return AgentDoneTool(tools=[AnswerTool(task_result=result)])
             return f"""
                 You forgot to use a tool to execute the user query: {self.current_query}!!
                 REMEMBER - you must ONLY execute the user's query based on
@@ -54,39 +161,63 @@ class PluginAgent(lr.ChatAgent, ABC):
                 """
 
     def question_tool(self, msg: QuestionTool) -> str:
-        print("QUESTION TOOL")
         self.current_query = msg.instruction
         self.expecting_tool_use = True
         return f"""
         User asked for this TASK to be executed: {msg.instruction}.
         Execute the TASK using the appropriate tool
         using the specified JSON format.
+        If the TASK needs several tools, use them all at once.
         """
 
     def answer_tool(self, msg: AnswerTool) -> AgentDoneTool:
-        print("ANSWER TOOL")
         return AgentDoneTool(tools=[msg])
 
+    def _answer(
+        self, current_query: str | None, result: lr.ChatDocument
+    ) -> lr.ChatDocument:
+        answer = f"""
+            Here is the result of the execution of the task: {current_query}.
+            ===
+            {result}
+            ===
+            """
+        answer_tool = AnswerTool(task_result=answer)
+        return self.create_llm_response(tool_messages=[answer_tool])
+
     def llm_response(self, msg: str | lr.ChatDocument) -> str | lr.ChatDocument | None:
-        print("LLM RESPONSE: ", msg)
         if self.expecting_tool_result:
             current_query = self.current_query
             self.current_query = None
             self.expecting_tool_result = False
             self.expecting_tool_use = False
             result = super().llm_response_forget(msg)
-
-            answer = f"""
-            Here is the result of the execution of the task: {current_query}.
-            ===
-            {result}
-            ===
-            """
-            answer_tool = AnswerTool(task_result=answer)
-            return self.create_llm_response(tool_messages=[answer_tool])
+            return self._answer(current_query, result)
+        if self.expecting_tool_use:
+            # Picking the tool is left to the cheapest model that gets it right
+            return self.ladder.respond(
+                functools.partial(super().llm_response_forget, msg)
+            )
         result = super().llm_response_forget(msg)
         return result
 
+    async def llm_response_async(
+        self, msg: str | lr.ChatDocument
+    ) -> str | lr.ChatDocument | None:
+        if self.expecting_tool_result:
+            current_query = self.current_query
+            self.current_query = None
+            self.expecting_tool_result = False
+            self.expecting_tool_use = False
+            result = await super().llm_response_forget_async(msg)
+            return self._answer(current_query, result)
+        if self.expecting_tool_use:
+            return await self.ladder.respond_async(
+                functools.partial(super().llm_response_forget_async, msg)
+            )
+        result = await super().llm_response_forget_async(msg)
+        return result
+
 
 class PluginCore(ABC):
     """
@@ -97,6 +228,9 @@ class PluginCore(ABC):
 
     agents: Optional[PluginAgent | List[PluginAgent]] = None
     tools: Optional[lr.ToolMessage | List[lr.ToolMessage]] = None
+    # Whether the answers may be reused for the same question: only for the
+    # plugins without side effects, whose answers depend on `data_version`
+    cacheable: bool = False
 
     def register_agents(self) -> PluginAgent | List[PluginAgent] | None:
         """
@@ -117,37 +251,93 @@ class PluginCore(ABC):
         """
         return self.tools
 
-    def register_tasks(self) -> lr.Task | List[lr.Task] | None:
+    def data_version(self) -> str:
+        """
+        Identifies the data the answers of the plugin depend on, so that cached
+        answers are not reused once it changes.
+        """
+        return self.Meta.version
+
+    def register_tasks(
+        self, agents: List[PluginAgent] | None = None
+    ) -> lr.Task | List[lr.Task] | None:
         """
         Registers tasks for each agent in the `self.agents` list.
         Note that you very likely don't want to override this method,
         unless you know what you're doing.
 
+        Args:
+            agents (List[PluginAgent] | None): The agents returned by `register_agents`,
+                which is called when they are not given.
+
         Returns:
             lr.Task | None: A list of `lr.Task` objects for each agent, or None if no agents are present.
         """
-        agents = [self.register_agents()]
-        return (
-            [
-                lr.Task(agent, single_round=False, interactive=False, llm_delegate=True)
-                for agent in agents
-            ]
-            if agents
-            else []
-        )
+        if agents is None:
+            agents = as_list(self.register_agents())
+        return [
+            lr.Task(agent, single_round=False, interactive=False, llm_delegate=True)
+            for agent in agents
+        ]
+
+
+@dataclass
+class PluginManifest:
+    """
+    What is known about a plugin before its agents are built.
+    """
+
+    name: str
+    description: str
+    version: str
+    tools: List[str]
+    module: str
+    # How many times the plugin was reloaded
+    generation: int = 0
+
+    @property
+    def package(self) -> str:
+        """The package of the `plugins` namespace the plugin comes from."""
+        return ".".join(self.module.split(".")[:2])
+
+
+def build_plugin_agents(plugin: PluginCore) -> List[PluginAgent]:
+    return [
+        trace_agent(limit_agent(pool_agent(discard_agent(relay_agent(agent)))))
+        for agent in as_list(plugin.register_agents())
+    ]
+
+
+def find_task(tasks: List[lr.Task], name: str) -> lr.Task | None:
+    """The task named after its plugin, or else its first task."""
+    for task in tasks:
+        if task.name == name:
+            return task
+    return tasks[0] if tasks else None
 
 
 class PluginManager:
     """
     PluginManager is responsible for managing plugins, agents, tools, and tasks.
-    """
 
-    __plugins: List[PluginCore] = []
-    __agents: List[PluginAgent] = []
-    __tools: List[lr.ToolMessage] = []
-    __tasks: List[lr.Task] = []
+    Plugins are discovered and described by a manifest up front, but their agents
+    and tasks are only built the first time they are requested.
+
+    The registrations of the plugins are swapped as a whole, by replacing the
+    dicts rather than changing them, so a plugin reloaded while queries run
+    is never seen half registered.
+    """
 
     def __init__(self):
+        self.__plugins: Dict[str, PluginCore] = {}
+        self.__manifests: Dict[str, PluginManifest] = {}
+        self.__tools: Dict[str, List[lr.ToolMessage]] = {}
+        self.__agents: Dict[str, List[PluginAgent]] = {}
+        self.__tasks: Dict[str, List[lr.Task]] = {}
+        self.__building: Dict[str, threading.Lock] = {}
+        self.__generations: Dict[str, int] = {}
+        self.__lock = threading.RLock()
+        self.__reload_lock = threading.Lock()
         self.load_plugins()
 
     def __iter_namespace(self, ns_pkg):
@@ -161,21 +351,100 @@ class PluginManager:
                     agent_classes.append(obj)
         return agent_classes
 
+    @property
+    def manifests(self) -> List[PluginManifest]:
+        return list(self.__manifests.values())
+
     @property
     def agents(self) -> List[PluginAgent]:
-        return self.__agents
+        """The agents that were built so far."""
+        return [agent for agents in self.__agents.values() for agent in agents]
 
     @property
     def tools(self) -> List[lr.ToolMessage]:
-        return self.__tools
+        return [tool for tools in self.__tools.values() for tool in tools]
 
     @property
     def tasks(self) -> List[lr.Task]:
-        return self.__tasks
+        """The tasks of every plugin, building the ones that are not built yet."""
+        return [task for name in self.plugin_names for task in self.get_tasks(name)]
 
     @property
     def plugin_names(self) -> List[str]:
-        return [plugin.Meta.name for plugin in self.__plugins]
+        return list(self.__manifests)
+
+    def is_built(self, name: str) -> bool:
+        return name in self.__tasks
+
+    def get_tools(self, name: str) -> List[lr.ToolMessage]:
+        return self.__tools.get(name, [])
+
+    def generation(self, name: str) -> int:
+        manifest = self.__manifests.get(name)
+        return manifest.generation if manifest else 0
+
+    def is_cacheable(self, name: str) -> bool:
+        plugin = self.__plugins.get(name)
+        return plugin is not None and plugin.cacheable
+
+    def get_data_version(self, name: str) -> str:
+        version = self.__plugins[name].data_version()
+        # The answers of the code before a reload are not reused either
+        generation = self.generation(name)
+        return f"{version}+{generation}" if generation else version
+
+    def get_tasks(self, name: str) -> List[lr.Task]:
+        """Returns the tasks of the plugin `name`, building them on first use."""
+        if name not in self.__plugins:
+            return []
+        with self.__lock:
+            building = self.__building.setdefault(name, threading.Lock())
+        # Each plugin has its own lock, so that several can be built at once
+        with building:
+            if name not in self.__tasks:
+                self.register_agents(name)
+                self.register_tasks(name)
+        return self.__tasks[name]
+
+    def build_all(self, names: List[str] | None = None) -> None:
+        """
+        Builds the plugins `names` (all of them by default) at the same time,
+        so that e.g. the docs of the doc plugins are indexed in parallel.
+        """
+        names = [name for name in names or self.plugin_names if not self.is_built(name)]
+        if names:
+            with ThreadPoolExecutor(len(names), thread_name_prefix="plugin") as pool:
+                list(pool.map(self.get_tasks, names))
+
+    def get_task(self, name: str) -> lr.Task | None:
+        return find_task(self.get_tasks(name), name)
+
+    def build_agents(self, name: str) -> List[PluginAgent]:
+        """Builds new agents for the plugin `name`."""
+        return build_plugin_agents(self.__plugins[name])
+
+    def build_tasks(self, name: str) -> List[lr.Task]:
+        """
+        Builds new agents and tasks for the plugin `name`, that are not shared
+        with the ones returned by `get_tasks`.
+        """
+        if name not in self.__plugins:
+            return []
+        plugin = self.__plugins[name]
+        return as_list(plugin.register_tasks(self.build_agents(name)))
+
+    def manifest(
+        self, plugin: PluginCore, tools: List[lr.ToolMessage]
+    ) -> PluginManifest:
+        name = plugin.Meta.name
+        return PluginManifest(
+            name=name,
+            description=plugin.Meta.description,
+            version=plugin.Meta.version,
+            tools=[tool.default_value("request") for tool in tools],
+            module=type(plugin).__module__,
+            generation=self.__generations.get(name, 0),
+        )
 
     def load_plugins(self) -> None:
         discovered_plugins = {
@@ -183,41 +452,142 @@ class PluginManager:
             for _, name, _ in self.__iter_namespace(plugins)
         }
         plugins_classes = self.__find_plugin_classes(discovered_plugins)
-        self.__plugins = [plugin() for plugin in plugins_classes]
-        self.register_agents()
-        self.register_tools()
-        self.register_tasks()
+        for plugin_class in plugins_classes:
+            plugin = plugin_class()
+            name = plugin.Meta.name
+            self.__plugins[name] = plugin
+            self.register_tools(name)
+            self.__manifests[name] = self.manifest(plugin, self.__tools[name])
+
+    def reload_package(self, package: str) -> List[str]:
+        """
+        Imports the plugin package `package` (e.g. "plugins.langroidExpert")
+        again, and swaps its plugins for the new ones. The plugins that were
+        built are built again before the swap, so the old ones keep serving
+        queries meanwhile, and the tasks already running are left alone. The
+        other plugins, and their indexes, are not touched.
+
+        Returns:
+            List[str]: the plugins that were added, replaced or removed.
+        """
+        with self.__reload_lock:
+            for module in list(sys.modules):
+                if module == package or module.startswith(package + "."):
+                    del sys.modules[module]
+            importlib.invalidate_caches()
+            new_plugins: List[PluginCore] = []
+            if importlib.util.find_spec(package) is not None:
+                module = importlib.import_module(package)
+                new_plugins = [
+                    plugin_class()
+                    for plugin_class in self.__find_plugin_classes({package: module})
+                ]
+            old_names = [m.name for m in self.manifests if m.package == package]
+
+            built: Dict[str, List[PluginAgent]] = {}
+            for plugin in new_plugins:
+                if self.is_built(plugin.Meta.name):
+                    built[plugin.Meta.name] = build_plugin_agents(plugin)
+
+            with self.__lock:
+                registries = [
+                    dict(registry)
+                    for registry in (
+                        self.__plugins,
+                        self.__manifests,
+                        self.__tools,
+                        self.__agents,
+                        self.__tasks,
+                    )
+                ]
+                cores, manifests, tools, agents, tasks = registries
+                for name in old_names:
+                    for registry in registries:
+                        registry.pop(name, None)
+                for plugin in new_plugins:
+                    name = plugin.Meta.name
+                    self.__generations[name] = self.__generations.get(name, 0) + 1
+                    cores[name] = plugin
+                    tools[name] = as_list(plugin.register_tools())
+                    manifests[name] = self.manifest(plugin, tools[name])
+                    if name in built:
+                        agents[name] = built[name]
+                        tasks[name] = as_list(plugin.register_tasks(built[name]))
+                self.__plugins = cores
+                self.__manifests = manifests
+                self.__tools = tools
+                self.__agents = agents
+                self.__tasks = tasks
+        return sorted(set(old_names) | {plugin.Meta.name for plugin in new_plugins})
 
     def reload_plugins(self) -> None:
-        self.__plugins = list()
-        self.load_plugins()
+        """Reloads every plugin package, including the new and removed ones."""
+        packages = {name for _, name, _ in self.__iter_namespace(plugins)}
+        packages |= {manifest.package for manifest in self.manifests}
+        for package in sorted(packages):
+            self.reload_package(package)
+
+    def register_agents(self, name: str) -> None:
+        self.__agents[name] = self.build_agents(name)
+
+    def register_tools(self, name: str) -> None:
+        self.__tools[name] = as_list(self.__plugins[name].register_tools())
+
+    def register_tasks(self, name: str) -> None:
+        plugin = self.__plugins[name]
+        self.__tasks[name] = as_list(plugin.register_tasks(self.__agents[name]))
+
+
+class PluginTasks:
+    """
+    A set of plugin tasks of its own, built on first use.
+
+    A task holds the conversation of its agent, so it can't serve two queries
+    at the same time: MainAgents that run concurrently each need their own
+    set, while the tasks of `PluginManager.get_task` are shared by the process.
+    """
 
-    def register_agents(self) -> None:
-        for plugin in self.__plugins:
-            agents = plugin.register_agents()
-            if not agents:
-                continue
-            if isinstance(agents, Iterable):
-                self.__agents.extend(agents)
-            else:
-                self.__agents.append(agents)
-
-    def register_tools(self) -> None:
-        for plugin in self.__plugins:
-            tools = plugin.register_tools()
-            if not tools:
-                continue
-            if isinstance(tools, Iterable):
-                self.__tools.extend(tools)
-            else:
-                self.__tools.append(tools)
-
-    def register_tasks(self) -> None:
-        for plugin in self.__plugins:
-            tasks = plugin.register_tasks()
-            if not tasks:
-                continue
-            if isinstance(tasks, Iterable):
-                self.__tasks.extend(tasks)
-            else:
-                self.__tasks.append(tasks)
+    def __init__(self, plugin_manager: PluginManager):
+        self.plugin_manager = plugin_manager
+        # The tasks of each plugin, with the generation of the plugin
+        self.__tasks: Dict[str, Tuple[int, List[lr.Task]]] = {}
+        self.__lock = threading.Lock()
+
+    @property
+    def plugin_names(self) -> List[str]:
+        return self.plugin_manager.plugin_names
+
+    def is_cacheable(self, name: str) -> bool:
+        return self.plugin_manager.is_cacheable(name)
+
+    def get_data_version(self, name: str) -> str:
+        return self.plugin_manager.get_data_version(name)
+
+    def get_tasks(self, name: str) -> List[lr.Task]:
+        """The tasks of the plugin `name`, built again once it is reloaded."""
+        generation = self.plugin_manager.generation(name)
+        with self.__lock:
+            built = self.__tasks.get(name)
+            if built is None or built[0] != generation:
+                built = (generation, self.plugin_manager.build_tasks(name))
+                self.__tasks[name] = built
+        return built[1]
+
+    def get_task(self, name: str) -> lr.Task | None:
+        return find_task(self.get_tasks(name), name)
+
+
+_plugin_manager: PluginManager | None = None
+_plugin_manager_lock = threading.Lock()
+
+
+def get_plugin_manager() -> PluginManager:
+    """
+    Returns the PluginManager shared by the whole process, so plugins are only
+    discovered (and their agents built) once.
+    """
+    global _plugin_manager
+    with _plugin_manager_lock:
+        if _plugin_manager is None:
+            _plugin_manager = PluginManager()
+    return _plugin_manager
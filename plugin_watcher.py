@@ -0,0 +1,119 @@
+import os
+import threading
+from typing import Dict, List, Tuple
+
+import plugins
+from config import PLUGIN_WATCH_INTERVAL
+from plugin import PluginManager
+from tracing import get_tracer
+
+# The path, modification time and size of the files of a plugin package
+Signature = Tuple[Tuple[str, int, int], ...]
+
+
+def package_files(path: str) -> List[str]:
+    if not os.path.isdir(path):
+        return [path]
+    return [
+        os.path.join(root, file)
+        for root, dirs, files in os.walk(path)
+        if "__pycache__" not in root
+        for file in files
+        if file.endswith(".py")
+    ]
+
+
+class PluginWatcher:
+    """
+    Watches the files of the plugin packages, and reloads the packages that
+    changed in the background, with `PluginManager.reload_package`.
+
+    A package is reloaded once its files stayed the same for `interval`
+    seconds, so a plugin being saved is not imported half written. If it
+    can't be imported, its old plugins stay until its files change again.
+    """
+
+    def __init__(
+        self, plugin_manager: PluginManager, interval: float = PLUGIN_WATCH_INTERVAL
+    ):
+        self.plugin_manager = plugin_manager
+        self.interval = interval
+        self.reloads = 0
+        self.errors = 0
+        self.__loaded = self.scan()
+        self.__last = self.__loaded
+        self.__stop = threading.Event()
+        self.__watcher: threading.Thread | None = None
+
+    def scan(self) -> Dict[str, Signature]:
+        signatures = {}
+        for directory in plugins.__path__:
+            for entry in os.scandir(directory):
+                name, extension = os.path.splitext(entry.name)
+                is_package = entry.is_dir() and os.path.exists(
+                    os.path.join(entry.path, "__init__.py")
+                )
+                if name.startswith((".", "_")) or not (
+                    is_package or extension == ".py"
+                ):
+                    continue
+                signature = []
+                for path in package_files(entry.path):
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    signature.append((path, stat.st_mtime_ns, stat.st_size))
+                signatures[f"{plugins.__name__}.{name}"] = tuple(sorted(signature))
+        return signatures
+
+    def check(self) -> List[str]:
+        """
+        Reloads the packages that changed since the last check.
+
+        Returns:
+            List[str]: the plugins that were reloaded.
+        """
+        signatures = self.scan()
+        changed = sorted(
+            package
+            for package in signatures.keys() | self.__loaded.keys()
+            if signatures.get(package) != self.__loaded.get(package)
+            and signatures.get(package) == self.__last.get(package)
+        )
+        self.__last = signatures
+        reloaded = []
+        for package in changed:
+            if package in signatures:
+                self.__loaded[package] = signatures[package]
+            else:
+                del self.__loaded[package]
+            with get_tracer().span("reload", package) as span:
+                try:
+                    names = self.plugin_manager.reload_package(package)
+                except Exception as e:
+                    self.errors += 1
+                    span.error = repr(e)
+                    continue
+                span.attributes["plugins"] = names
+            self.reloads += 1
+            reloaded += names
+        return reloaded
+
+    def start(self) -> None:
+        """Checks the plugins every `interval` seconds, in the background."""
+        if self.__watcher is not None:
+            return
+
+        def run() -> None:
+            while not self.__stop.wait(self.interval):
+                self.check()
+
+        self.__watcher = threading.Thread(target=run, daemon=True)
+        self.__watcher.start()
+
+    def stop(self) -> None:
+        self.__stop.set()
+
+    def stats(self) -> Dict[str, int]:
+        return {"reloads": self.reloads, "errors": self.errors}
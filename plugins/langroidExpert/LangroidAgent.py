@@ -1,12 +1,12 @@
 from typing import List
 import typer
-from langroid.agent.special import DocChatAgent, DocChatAgentConfig
 from rich.prompt import Prompt
 
 
 from tools import QuestionTool, AnswerTool
 from plugin import PluginAgent, PluginCore
 from config import LLM_CONFIGS
+from doc_index import DocIndex, doc_chat_config
 
 app = typer.Typer()
 
@@ -17,8 +17,13 @@ class LangroidAgent(PluginCore):
         description = "A plugin that allows the user to ask questions about the Langroid LLM framework."
         version = "0.1"
 
+    cacheable = True
+
+    def data_version(self) -> str:
+        return f"{self.Meta.version}:{DocIndex(self.Meta.name).version()}"
+
     def register_agents(self) -> PluginAgent | List[PluginAgent] | None:
-        config = DocChatAgentConfig(
+        config = doc_chat_config(
             name=self.Meta.name,
             llm=LLM_CONFIGS.get("medium"),
             doc_paths=[
@@ -32,7 +37,7 @@ class LangroidAgent(PluginCore):
                 """,
         )
 
-        agent = DocChatAgent(config)
+        agent = DocIndex(self.Meta.name).build(config)
         agent.enable_message([QuestionTool, AnswerTool], use=False, handle=True)
 
         return agent
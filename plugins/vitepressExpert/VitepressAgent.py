@@ -2,10 +2,10 @@ from typing import List
 import typer
 import langroid as lr
 import langroid.language_models as lm
-from langroid.agent.special import DocChatAgent, DocChatAgentConfig
 from rich.prompt import Prompt
 
 from config import LLM_CONFIGS
+from doc_index import DocIndex, doc_chat_config
 from plugin import PluginAgent, PluginCore
 
 from tools import QuestionTool, AnswerTool
@@ -19,8 +19,13 @@ class VitepressAgent(PluginCore):
         description = "A plugin that allows the user to ask questions about the Vitepress framework."
         version = "0.1"
 
+    cacheable = True
+
+    def data_version(self) -> str:
+        return f"{self.Meta.version}:{DocIndex(self.Meta.name).version()}"
+
     def register_agents(self) -> PluginAgent | List[PluginAgent] | None:
-        config = DocChatAgentConfig(
+        config = doc_chat_config(
             name=self.Meta.name,
             llm=LLM_CONFIGS.get("small"),
             doc_paths=[
@@ -34,7 +39,7 @@ class VitepressAgent(PluginCore):
                 """,
         )
 
-        agent = DocChatAgent(config)
+        agent = DocIndex(self.Meta.name).build(config)
         agent.enable_message([QuestionTool, AnswerTool], use=False, handle=True)
         return agent
 
@@ -0,0 +1,183 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Tuple
+
+import langroid.language_models as lm
+from langroid.language_models import LLMMessage, LLMResponse
+
+# Roughly how the LLMs stream their answers
+TOKEN = re.compile(r"\s*\S+")
+
+
+class MissingRecording(KeyError):
+    """Raised when replaying a prompt that was never recorded."""
+
+
+def prompt_dicts(messages: str | List[LLMMessage]) -> List[Dict[str, Any]]:
+    if isinstance(messages, str):
+        return [{"role": "user", "content": messages}]
+    return [message.api_dict() for message in messages]
+
+
+class LLMRecorder:
+    """
+    Record/replay backend for the LLMs. In "record" mode, the completions of
+    the real LLMs are appended to the JSONL fixture `path`. In "replay"
+    mode, they are read back instead of calling the LLMs, streamed token by
+    token with a synthetic latency, so that the agents can run without
+    Ollama and always get the same answers.
+
+    A prompt is identified by the model and the messages sent. When the same
+    prompt was recorded several times, its completions are replayed in the
+    order they were recorded.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        mode: str = "replay",
+        first_token_latency: float = 0.0,
+        token_latency: float = 0.0,
+    ):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.first_token_latency = first_token_latency
+        self.token_latency = token_latency
+        # When each LLM call started and ended
+        self.intervals: List[Tuple[float, float]] = []
+        self.__recordings: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self.__replayed: Dict[str, int] = defaultdict(int)
+        self.__lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        recording = json.loads(line)
+                        self.__recordings[recording["key"]].append(recording)
+
+    def key(self, llm: lm.LanguageModel, messages: str | List[LLMMessage]) -> str:
+        prompt = json.dumps(
+            [llm.config.chat_model, prompt_dicts(messages)], sort_keys=True
+        )
+        return hashlib.sha256(prompt.encode()).hexdigest()
+
+    def recorded(self, key: str) -> LLMResponse:
+        with self.__lock:
+            recordings = self.__recordings.get(key)
+            if not recordings:
+                raise MissingRecording(
+                    f"No recording for this prompt in {self.path}, run with "
+                    "the real LLMs in record mode first"
+                )
+            n = self.__replayed[key]
+            self.__replayed[key] += 1
+        recording = recordings[min(n, len(recordings) - 1)]
+        return LLMResponse.parse_obj(recording["response"])
+
+    def record(
+        self,
+        key: str,
+        llm: lm.LanguageModel,
+        messages: str | List[LLMMessage],
+        response: LLMResponse,
+    ) -> None:
+        recording = {
+            "key": key,
+            "model": llm.config.chat_model,
+            "messages": prompt_dicts(messages),
+            "response": json.loads(response.json()),
+        }
+        with self.__lock:
+            self.__recordings[key].append(recording)
+            with open(self.path, "a") as f:
+                f.write(json.dumps(recording) + "\n")
+
+    def tokens(self, llm: lm.LanguageModel, response: LLMResponse) -> List[str]:
+        """The tokens to stream, if the LLM streams."""
+        if not llm.get_stream() or response.function_call or response.oai_tool_calls:
+            return []
+        return TOKEN.findall(response.message)
+
+    def account(self, start: float) -> None:
+        with self.__lock:
+            self.intervals.append((start, time.time()))
+
+    def wrap(self, llm: lm.LanguageModel | None) -> lm.LanguageModel | None:
+        """Makes the completions of `llm` (`chat`, `generate`...) record or replay."""
+        if llm is None:
+            return None
+        for name in ("chat", "generate"):
+            self.__wrap_sync(llm, name)
+            self.__wrap_async(llm, "a" + name)
+        return llm
+
+    def __wrap_sync(self, llm: lm.LanguageModel, name: str) -> None:
+        complete = getattr(llm, name)
+
+        def recorded(prompt: str | List[LLMMessage], *args: Any, **kwargs: Any) -> Any:
+            start = time.time()
+            key = self.key(llm, prompt)
+            if self.mode == "record":
+                response = complete(prompt, *args, **kwargs)
+                self.record(key, llm, prompt, response)
+            else:
+                response = self.recorded(key)
+                time.sleep(self.first_token_latency)
+                for token in self.tokens(llm, response):
+                    llm.config.streamer(token)
+                    time.sleep(self.token_latency)
+            self.account(start)
+            return response
+
+        setattr(llm, name, recorded)
+
+    def __wrap_async(self, llm: lm.LanguageModel, name: str) -> None:
+        complete = getattr(llm, name)
+
+        async def recorded(
+            prompt: str | List[LLMMessage], *args: Any, **kwargs: Any
+        ) -> Any:
+            start = time.time()
+            key = self.key(llm, prompt)
+            if self.mode == "record":
+                response = await complete(prompt, *args, **kwargs)
+                self.record(key, llm, prompt, response)
+            else:
+                response = self.recorded(key)
+                # The async responses stream through their own streamer, when
+                # the installed langroid has one
+                streamer_async = getattr(llm.config, "streamer_async", None)
+                await asyncio.sleep(self.first_token_latency)
+                for token in self.tokens(llm, response):
+                    if streamer_async is None:
+                        llm.config.streamer(token)
+                    else:
+                        await streamer_async(token)
+                    await asyncio.sleep(self.token_latency)
+            self.account(start)
+            return response
+
+        setattr(llm, name, recorded)
+
+    @contextmanager
+    def install(self) -> Iterator["LLMRecorder"]:
+        """Every LLM created in the block records or replays."""
+        create = lm.LanguageModel.create
+
+        def recorded_create(config: lm.LLMConfig | None) -> lm.LanguageModel | None:
+            return self.wrap(create(config))
+
+        lm.LanguageModel.create = staticmethod(recorded_create)
+        try:
+            yield self
+        finally:
+            lm.LanguageModel.create = staticmethod(create)
@@ -0,0 +1,113 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict
+
+import numpy as np
+
+from embeddings import Embedder, get_embedder
+
+
+@dataclass
+class CacheEntry:
+    plugin: str
+    version: str
+    instruction: str
+    vector: np.ndarray
+    answer: str
+    created: float
+
+
+class ResponseCache:
+    """
+    Reuses the answers of the plugins for the same or a paraphrased question.
+
+    An answer is found when the embedding of the instruction has a cosine
+    similarity of at least `threshold` with a cached one, asked to the same
+    plugin while its data had the same version. Answers older than
+    `ttl_seconds` are ignored, and the least recently used ones are evicted
+    beyond `max_entries`.
+    """
+
+    def __init__(
+        self,
+        embed: Embedder | None = None,
+        threshold: float = 0.92,
+        ttl_seconds: float = 24 * 3600,
+        max_entries: int = 1000,
+    ):
+        self.embed = embed or get_embedder()
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.__entries: OrderedDict[int, CacheEntry] = OrderedDict()
+        self.__next_id = 0
+        self.__lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def __expire(self, now: float) -> None:
+        expired = [
+            id
+            for id, entry in self.__entries.items()
+            if now - entry.created > self.ttl_seconds
+        ]
+        for id in expired:
+            del self.__entries[id]
+        self.expirations += len(expired)
+
+    def get(self, plugin: str, version: str, instruction: str) -> str | None:
+        vector = self.embed([instruction])[0]
+        with self.__lock:
+            self.__expire(time.time())
+            best_id, best_score = None, self.threshold
+            for id, entry in self.__entries.items():
+                if entry.plugin != plugin or entry.version != version:
+                    continue
+                score = float(entry.vector @ vector)
+                if score >= best_score:
+                    best_id, best_score = id, score
+            if best_id is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.__entries.move_to_end(best_id)
+            return self.__entries[best_id].answer
+
+    def put(self, plugin: str, version: str, instruction: str, answer: str) -> None:
+        vector = self.embed([instruction])[0]
+        with self.__lock:
+            self.__entries[self.__next_id] = CacheEntry(
+                plugin=plugin,
+                version=version,
+                instruction=instruction,
+                vector=vector,
+                answer=answer,
+                created=time.time(),
+            )
+            self.__next_id += 1
+            while len(self.__entries) > self.max_entries:
+                self.__entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__entries.clear()
+
+    def stats(self) -> Dict[str, float | int]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.__entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
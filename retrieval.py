@@ -0,0 +1,191 @@
+import heapq
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+import numpy as np
+from langroid.agent.special import DocChatAgent, DocChatAgentConfig
+from langroid.mytypes import Document
+from langroid.parsing.search import preprocess_text
+
+from config import RETRIEVAL_CANDIDATES, RETRIEVAL_TOKEN_BUDGET, RETRIEVAL_TOP_K
+from tracing import get_tracer
+
+WORD = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+")
+WORD_PART = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+")
+
+# The usual constant of reciprocal rank fusion
+RRF_K = 60
+
+
+def terms(text: str) -> Iterator[str]:
+    """
+    The lowercased words of `text`. Identifiers are kept whole, and their
+    parts are added, so "RecipientTool" matches "recipient_tool" as well.
+    """
+    for word in WORD.findall(text):
+        yield word.lower()
+        parts = WORD_PART.findall(word)
+        if len(parts) > 1:
+            yield from (part.lower() for part in parts)
+
+
+class BM25Index:
+    """
+    Inverted index of a list of texts, searched with BM25. A query only
+    scores the texts that contain one of its terms.
+    """
+
+    def __init__(self, texts: Iterable[str], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self.lengths: List[int] = []
+        for i, text in enumerate(texts):
+            counts = Counter(terms(text))
+            self.lengths.append(sum(counts.values()))
+            for term, count in counts.items():
+                self.postings[term].append((i, count))
+        self.average_length = float(np.mean(self.lengths)) if self.lengths else 1.0
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """The indexes of the `k` best texts for `query`, with their scores."""
+        n = len(self.lengths)
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(terms(query)):
+            postings = self.postings.get(term)
+            # Terms found in most texts barely change the ranking
+            if not postings or len(postings) > n / 2:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for i, count in postings:
+                length = self.lengths[i] / self.average_length
+                norm = count + self.k1 * (1 - self.b + self.b * length)
+                scores[i] += idf * count * (self.k1 + 1) / norm
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+
+def fuse(rankings: List[List[Document]]) -> List[Document]:
+    """Merges rankings of documents by reciprocal rank fusion."""
+    scores: Dict[str, float] = defaultdict(float)
+    docs: Dict[str, Document] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            scores[doc.id()] += 1 / (RRF_K + rank + 1)
+            docs.setdefault(doc.id(), doc)
+    return [docs[id] for id in sorted(scores, key=scores.__getitem__, reverse=True)]
+
+
+class Corpus:
+    """
+    The chunks of a collection, their cleaned up copies for the lexical
+    searches of DocChatAgent, and their BM25 index. Built once and shared by
+    the agents on the same collection.
+    """
+
+    def __init__(self, docs: List[Document]):
+        self.docs = docs
+        self.clean_docs = [
+            Document(content=preprocess_text(doc.content), metadata=doc.metadata)
+            for doc in docs
+        ]
+        self.bm25 = BM25Index(doc.content for doc in docs)
+
+
+_cross_encoders: Dict[str, Any] = {}
+_cross_encoders_lock = threading.Lock()
+
+
+def cross_encoder(name: str) -> Any:
+    """The CrossEncoder `name`, loaded once per process."""
+    from sentence_transformers import CrossEncoder
+
+    with _cross_encoders_lock:
+        if name not in _cross_encoders:
+            _cross_encoders[name] = CrossEncoder(name)
+    return _cross_encoders[name]
+
+
+class HybridDocChatAgent(DocChatAgent):
+    """
+    DocChatAgent whose retrieval combines a BM25 lookup, good at exact
+    identifiers, with the vector search. The two rankings are fused, their
+    best `candidates` chunks are reranked by the cross-encoder of the config
+    (if any), and at most `top_k` chunks are given to the LLM, within
+    `token_budget` tokens.
+
+    The BM25 index is built once, when the documents are set up, rather than
+    on every query like the keyword searches of DocChatAgent. The agents on
+    the same collection share it with `use_corpus`.
+    """
+
+    def __init__(
+        self,
+        config: DocChatAgentConfig,
+        top_k: int = RETRIEVAL_TOP_K,
+        candidates: int = RETRIEVAL_CANDIDATES,
+        token_budget: int = RETRIEVAL_TOKEN_BUDGET,
+    ):
+        self.top_k = top_k
+        self.candidates = candidates
+        self.token_budget = token_budget
+        self.bm25 = BM25Index([])
+        super().__init__(config)
+
+    def setup_documents(
+        self, docs: List[Document] = [], filter: str | None = None
+    ) -> None:
+        super().setup_documents(docs, filter)
+        self.bm25 = BM25Index(doc.content for doc in self.chunked_docs)
+
+    def use_corpus(self, corpus: Corpus) -> None:
+        # The lists are copied, as documents ingested later are added to them
+        self.chunked_docs = list(corpus.docs)
+        self.chunked_docs_clean = list(corpus.clean_docs)
+        self.bm25 = corpus.bm25
+
+    def rerank(self, query: str, passages: List[Document]) -> List[Document]:
+        name = self.config.cross_encoder_reranking_model
+        if not name or len(passages) < 2:
+            return passages
+        scores = cross_encoder(name).predict([(query, p.content) for p in passages])
+        order = np.argsort(-np.asarray(scores), kind="stable")
+        return [passages[i] for i in order]
+
+    def select(self, passages: List[Document]) -> List[Document]:
+        """The first `top_k` passages that fit in the token budget."""
+        selected: List[Document] = []
+        tokens = 0
+        for passage in passages:
+            if len(selected) == self.top_k:
+                break
+            n_tokens = self.parser.num_tokens(passage.content) if self.parser else 0
+            if selected and tokens + n_tokens > self.token_budget:
+                continue
+            selected.append(passage)
+            tokens += n_tokens
+        return selected
+
+    def get_relevant_chunks(
+        self, query: str, query_proxies: List[str] = []
+    ) -> List[Document]:
+        if self.vecdb is None:
+            raise ValueError("VecDB not set")
+        with get_tracer().span("retrieval", self.config.name) as span:
+            rankings = [
+                [doc for doc, _ in self.get_semantic_search_results(q, self.candidates)]
+                for q in [query] + query_proxies
+            ]
+            rankings.append(
+                [
+                    self.chunked_docs[i]
+                    for i, _ in self.bm25.search(query, self.candidates)
+                ]
+            )
+            passages = fuse(rankings)[: self.candidates]
+            passages = self.select(self.rerank(query, passages))
+            span.attributes["candidates"] = len({d.id() for r in rankings for d in r})
+            span.attributes["selected"] = len(passages)
+        return passages
@@ -0,0 +1,97 @@
+import re
+import threading
+from dataclasses import dataclass
+from typing import List, Tuple
+
+import numpy as np
+
+from embeddings import Embedder, get_embedder
+from plugin import PluginManager
+from tracing import get_tracer
+
+
+@dataclass
+class Route:
+    recipient: str
+    score: float
+    margin: float
+    confident: bool
+
+
+class PluginRouter:
+    """
+    Picks the plugin that should execute an instruction without asking the LLM.
+
+    The description of every plugin and the purpose of its tools are embedded
+    once. An instruction is scored against each plugin by its best cosine
+    similarity, and it is only routed directly when the best plugin scores
+    above `threshold` and beats the next one by `margin`; ambiguous (or
+    multi-step) instructions are left to the orchestrator LLM.
+    """
+
+    def __init__(
+        self,
+        plugin_manager: PluginManager,
+        embed: Embedder | None = None,
+        threshold: float = 0.6,
+        margin: float = 0.05,
+    ):
+        self.plugin_manager = plugin_manager
+        self.embed = embed or get_embedder()
+        self.threshold = threshold
+        self.margin = margin
+        self.__signature: Tuple = ()
+        self.__owners: List[str] = []
+        self.__vectors = np.zeros((0, 0), dtype=np.float32)
+        self.__lock = threading.Lock()
+
+    def plugin_texts(self) -> List[Tuple[str, str]]:
+        """The (plugin, text) pairs describing what each plugin can do."""
+        texts = []
+        for manifest in self.plugin_manager.manifests:
+            texts.append((manifest.name, manifest.description))
+            for tool in self.plugin_manager.get_tools(manifest.name):
+                purpose = re.sub(r"[<>]", "", tool.default_value("purpose"))
+                texts.append((manifest.name, purpose.strip()))
+        return texts
+
+    def update(self) -> None:
+        """Embeds the plugin texts, again only when the plugins changed."""
+        signature = tuple(
+            (manifest.name, manifest.version, manifest.generation)
+            for manifest in self.plugin_manager.manifests
+        )
+        with self.__lock:
+            if signature == self.__signature:
+                return
+            texts = self.plugin_texts()
+            self.__owners = [name for name, _ in texts]
+            self.__vectors = self.embed([text for _, text in texts])
+            self.__signature = signature
+
+    def scores(self, instruction: str) -> List[Tuple[str, float]]:
+        """Score of each plugin for `instruction`, best first."""
+        self.update()
+        if not self.__owners:
+            return []
+        similarities = self.__vectors @ self.embed([instruction])[0]
+        best = {}
+        for name, similarity in zip(self.__owners, similarities):
+            best[name] = max(best.get(name, -1.0), float(similarity))
+        return sorted(best.items(), key=lambda item: item[1], reverse=True)
+
+    def route(self, instruction: str) -> Route | None:
+        with get_tracer().span("route", "PluginRouter") as span:
+            scores = self.scores(instruction)
+            if not scores:
+                return None
+            recipient, score = scores[0]
+            margin = score - scores[1][1] if len(scores) > 1 else score
+            route = Route(
+                recipient=recipient,
+                score=score,
+                margin=margin,
+                confident=score >= self.threshold and margin >= self.margin,
+            )
+            span.attributes.update(route.__dict__)
+            return route
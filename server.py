@@ -0,0 +1,253 @@
+import asyncio
+import json
+import time
+import uuid
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List
+
+from aiohttp import WSMsgType, web
+from langroid.language_models import LLMMessage
+
+from concurrency import Overloaded, get_tier_limiter
+from MainAgent import MainAgent, plugin_manager
+from ollama_client import get_ollama
+from plugin import PluginTasks
+from response_cache import ResponseCache
+from router import PluginRouter
+from streaming import TokenSink
+from tracing import get_tracer
+
+
+@dataclass
+class Session:
+    id: str
+    history: List[LLMMessage] = field(default_factory=list)
+    last_used: float = field(default_factory=time.time)
+    # A session answers its messages one at a time, in order
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+
+class AgentPool:
+    """
+    MainAgents built once and lent to the sessions, each with its own plugin
+    tasks, so that concurrent sessions never share a task. A session waits
+    for a free MainAgent when all of them are busy.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        router: PluginRouter | None = None,
+        cache: ResponseCache | None = None,
+        speculate: bool = False,
+    ):
+        self.size = size
+        self.router = router
+        self.cache = cache
+        self.speculate = speculate
+        self.__idle: asyncio.Queue[MainAgent] = asyncio.Queue()
+
+    def build(self) -> MainAgent:
+        main_agent = MainAgent(
+            self.router,
+            self.cache,
+            plugins=PluginTasks(plugin_manager),
+            interactive=False,
+            speculate=self.speculate,
+        )
+        # Plugins and indexes are built now, rather than by the first query
+        for name in plugin_manager.plugin_names:
+            main_agent.attach_plugin(name)
+        return main_agent
+
+    async def start(self) -> None:
+        for _ in range(self.size):
+            self.__idle.put_nowait(await asyncio.to_thread(self.build))
+        if self.router is not None:
+            await asyncio.to_thread(self.router.update)
+
+    @property
+    def idle(self) -> int:
+        return self.__idle.qsize()
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[MainAgent]:
+        main_agent = await self.__idle.get()
+        try:
+            yield main_agent
+        finally:
+            self.__idle.put_nowait(main_agent)
+
+
+class JarvisServer:
+    """
+    Serves the conversations of many users over HTTP and WebSocket, with the
+    agents kept warm between the requests.
+
+    POST /sessions                    -> {"session_id": ...}
+    POST /sessions/{id}/messages      {"message": ...} -> {"answer": ...}
+    DELETE /sessions/{id}
+    GET /sessions/{id}/ws             one answer per text message
+    GET /stats
+
+    The tokens of the plugins' answers are sent as they are generated over
+    the WebSocket, and by POST when the body has `"stream": true`.
+    """
+
+    def __init__(
+        self,
+        pool: AgentPool,
+        max_sessions: int = 1000,
+        session_ttl: float = 3600,
+    ):
+        self.pool = pool
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self.sessions: Dict[str, Session] = {}
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.add_routes(
+            [
+                web.post("/sessions", self.create_session),
+                web.delete("/sessions/{id}", self.delete_session),
+                web.post("/sessions/{id}/messages", self.post_message),
+                web.get("/sessions/{id}/ws", self.websocket),
+                web.get("/stats", self.stats),
+            ]
+        )
+        app.on_startup.append(self.on_startup)
+        return app
+
+    async def on_startup(self, app: web.Application) -> None:
+        await self.pool.start()
+
+    def expire_sessions(self) -> None:
+        now = time.time()
+        for id, session in list(self.sessions.items()):
+            if session.lock.locked():
+                continue
+            if now - session.last_used > self.session_ttl:
+                del self.sessions[id]
+
+    def get_session(self, request: web.Request) -> Session:
+        session = self.sessions.get(request.match_info["id"])
+        if session is None:
+            raise web.HTTPNotFound(text="Unknown session")
+        return session
+
+    async def ask(
+        self, session: Session, message: str, on_token: TokenSink | None = None
+    ) -> str:
+        async with session.lock:
+            session.last_used = time.time()
+            async with self.pool.acquire() as main_agent:
+
+                def run() -> str:
+                    main_agent.load(session.history)
+                    result = main_agent.run(message, on_token)
+                    session.history = main_agent.history()
+                    return result.content if result is not None else ""
+
+                answer = await asyncio.to_thread(run)
+            session.last_used = time.time()
+            return answer
+
+    async def relay(
+        self,
+        session: Session,
+        message: str,
+        send: Callable[[Dict[str, Any]], Awaitable[Any]],
+    ) -> str:
+        """
+        Answers `message`, sending the tokens of the plugins' answers as
+        `{"source": <agent>, "token": <text>}` events while they are generated.
+        """
+        loop = asyncio.get_running_loop()
+        events: asyncio.Queue[Dict[str, Any] | None] = asyncio.Queue()
+
+        def on_token(source: str, text: str) -> None:
+            # Called by the thread running the agents
+            loop.call_soon_threadsafe(
+                events.put_nowait, {"source": source, "token": text}
+            )
+
+        ask = asyncio.create_task(self.ask(session, message, on_token))
+        ask.add_done_callback(lambda _: events.put_nowait(None))
+        while (event := await events.get()) is not None:
+            await send(event)
+        return await ask
+
+    async def create_session(self, request: web.Request) -> web.Response:
+        self.expire_sessions()
+        if len(self.sessions) >= self.max_sessions:
+            raise web.HTTPServiceUnavailable(text="Too many sessions")
+        session = Session(id=uuid.uuid4().hex)
+        self.sessions[session.id] = session
+        return web.json_response({"session_id": session.id})
+
+    async def delete_session(self, request: web.Request) -> web.Response:
+        session = self.get_session(request)
+        del self.sessions[session.id]
+        return web.json_response({"session_id": session.id})
+
+    async def post_message(self, request: web.Request) -> web.Response:
+        session = self.get_session(request)
+        body = await request.json()
+        message = body.get("message", "").strip()
+        if not message:
+            raise web.HTTPBadRequest(text="Empty message")
+        if body.get("stream"):
+            return await self.stream_message(request, session, message)
+        try:
+            answer = await self.ask(session, message)
+        except Overloaded as e:
+            raise web.HTTPServiceUnavailable(text=str(e))
+        return web.json_response({"session_id": session.id, "answer": answer})
+
+    async def stream_message(
+        self, request: web.Request, session: Session, message: str
+    ) -> web.StreamResponse:
+        """Answers with one JSON event per line, the last one is the answer."""
+        response = web.StreamResponse(
+            headers={"Content-Type": "application/x-ndjson"}
+        )
+        await response.prepare(request)
+
+        async def send(event: Dict[str, Any]) -> None:
+            await response.write((json.dumps(event) + "\n").encode())
+
+        try:
+            answer = await self.relay(session, message, send)
+            await send({"session_id": session.id, "answer": answer})
+        except Overloaded as e:
+            await send({"error": str(e)})
+        await response.write_eof()
+        return response
+
+    async def websocket(self, request: web.Request) -> web.WebSocketResponse:
+        session = self.get_session(request)
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                break
+            try:
+                answer = await self.relay(session, msg.data, ws.send_json)
+                await ws.send_json({"answer": answer})
+            except Overloaded as e:
+                await ws.send_json({"error": str(e)})
+        return ws
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response(
+            {
+                "sessions": len(self.sessions),
+                "pool": {"size": self.pool.size, "idle": self.pool.idle},
+                "tiers": get_tier_limiter().stats(),
+                "ollama": get_ollama().stats(),
+                "answer_cache": self.pool.cache.stats() if self.pool.cache else None,
+                "spans": get_tracer().summary(),
+            }
+        )
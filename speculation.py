@@ -0,0 +1,187 @@
+import contextvars
+import json
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+import langroid as lr
+
+from config import SPECULATIVE_RUNS
+from dispatch import dispatch
+from plugin import PluginManager, PluginTasks, discard_on
+from response_cache import ResponseCache
+from router import PluginRouter
+from streaming import relay_to
+from tools import AnswerTool, RoutedQuestion
+
+# A complete string field of the question_tool JSON
+INSTRUCTION = re.compile(r'"instruction"\s*:\s*"((?:[^"\\]|\\.)*)"')
+# A complete question of the batch_question_tool JSON
+QUESTION = re.compile(r"\{[^{}]*\}")
+
+
+def stable_questions(text: str) -> List[Dict[str, str]]:
+    """
+    The questions found in `text`, the start of a `question_tool` or
+    `batch_question_tool` JSON, whose fields won't change anymore: the
+    instruction of a single question once its string is closed, and the
+    questions of a batch once their object is.
+    """
+    questions = []
+    if '"questions"' not in text:
+        for raw in INSTRUCTION.findall(text):
+            try:
+                questions.append({"instruction": json.loads(f'"{raw}"')})
+            except ValueError:
+                continue
+        return questions
+    for match in QUESTION.finditer(text):
+        try:
+            fields = json.loads(match.group())
+        except ValueError:
+            continue
+        if isinstance(fields.get("instruction"), str) and isinstance(
+            fields.get("recipient"), str
+        ):
+            questions.append(fields)
+    return questions
+
+
+def question_key(question: RoutedQuestion) -> Tuple[str, str]:
+    return question.recipient, question.instruction.strip()
+
+
+class Speculator:
+    """
+    Starts the plugins on the questions of the orchestrator as soon as they
+    can be read from the tool JSON it streams, so that they answer while the
+    orchestrator is still generating. A single question is only started when
+    the router is confident about its plugin, as it is then where the
+    question_tool sends it.
+
+    The speculative runs use task sets of their own, at most `max_runs` of
+    them, so they never get in the way of the tasks of the MainAgent. Their
+    answers are taken by the final tool call if it asks the same question to
+    the same plugin, and discarded otherwise: a discarded run stops before
+    its next generation, so it doesn't keep a slot of its LLM tier from the
+    question actually asked. They still go through `cache`, since they are
+    the answers to real questions.
+    """
+
+    def __init__(
+        self,
+        plugin_manager: PluginManager,
+        router: PluginRouter | None = None,
+        cache: ResponseCache | None = None,
+        max_runs: int = SPECULATIVE_RUNS,
+    ):
+        self.plugin_manager = plugin_manager
+        self.router = router
+        self.cache = cache
+        self.max_runs = max_runs
+        self.started = 0
+        self.used = 0
+        self.discarded = 0
+        self.__idle: List[PluginTasks] = []
+        self.__sets = 0
+        self.__runs: Dict[Tuple[str, str], Future] = {}
+        self.__discards: Dict[Tuple[str, str], threading.Event] = {}
+        self.__pool = ThreadPoolExecutor(max_runs, thread_name_prefix="speculation")
+        self.__lock = threading.Lock()
+
+    def route(self, fields: Dict[str, str]) -> RoutedQuestion | None:
+        recipient = fields.get("recipient")
+        if recipient is None:
+            route = self.router.route(fields["instruction"]) if self.router else None
+            if route is None or not route.confident:
+                return None
+            recipient = route.recipient
+        if recipient not in self.plugin_manager.plugin_names:
+            return None
+        return RoutedQuestion(recipient=recipient, instruction=fields["instruction"])
+
+    def feed(self, text: str) -> None:
+        """Starts the questions of `text`, all the tool JSON streamed so far."""
+        for fields in stable_questions(text):
+            question = self.route(fields)
+            if question is not None:
+                self.start(question)
+
+    def start(self, question: RoutedQuestion) -> None:
+        with self.__lock:
+            if question_key(question) in self.__runs:
+                return
+            if self.__idle:
+                tasks = self.__idle.pop()
+            elif self.__sets < self.max_runs:
+                tasks = PluginTasks(self.plugin_manager)
+                self.__sets += 1
+            else:
+                return
+            self.started += 1
+            discard = self.__discards[question_key(question)] = threading.Event()
+            self.__runs[question_key(question)] = future = self.__pool.submit(
+                contextvars.copy_context().run, self.run, tasks, question, discard
+            )
+        future.add_done_callback(lambda _: self.__release(tasks))
+
+    def run(
+        self, tasks: PluginTasks, question: RoutedQuestion, discard: threading.Event
+    ) -> AnswerTool:
+        # The user must not see the answers that may be discarded
+        with relay_to(None), discard_on(discard):
+            [answer] = dispatch(tasks, [question], self.cache)
+        return answer
+
+    def __release(self, tasks: PluginTasks) -> None:
+        with self.__lock:
+            self.__idle.append(tasks)
+
+    def take(self, question: RoutedQuestion) -> Future | None:
+        """The speculative run of `question`, if one was started."""
+        with self.__lock:
+            future = self.__runs.pop(question_key(question), None)
+            self.__discards.pop(question_key(question), None)
+            if future is not None:
+                self.used += 1
+        return future
+
+    def reset(self) -> None:
+        """Discards the runs that were not taken by the tool call."""
+        with self.__lock:
+            self.discarded += len(self.__runs)
+            for discard in self.__discards.values():
+                discard.set()
+            self.__runs.clear()
+            self.__discards.clear()
+
+    def watch(self, agent: lr.ChatAgent) -> lr.ChatAgent:
+        """Feeds what the LLM of `agent` streams while it picks its tools."""
+        start_llm_stream = agent.callbacks.start_llm_stream
+
+        def watching_start_llm_stream() -> Any:
+            streamer = start_llm_stream()
+            if not (agent.expecting_question_tool or agent.expecting_question):
+                return streamer
+            streamed: List[str] = []
+
+            def watching_streamer(text: Any) -> None:
+                streamer(text)
+                if isinstance(text, str) and text:
+                    streamed.append(text)
+                    # A field or a question can only end with one of these
+                    if '"' in text or "}" in text:
+                        self.feed("".join(streamed))
+
+            return watching_streamer
+
+        agent.callbacks.start_llm_stream = watching_start_llm_stream
+        return agent
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "started": self.started,
+            "used": self.used,
+            "discarded": self.discarded,
+        }
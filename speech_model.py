@@ -0,0 +1,154 @@
+import threading
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import List
+
+import numpy as np
+
+
+@dataclass
+class Word:
+    start: float
+    end: float
+    text: str
+
+    @property
+    def key(self) -> str:
+        """Normalized form used to compare words across hypotheses."""
+        return self.text.strip().lower().strip(".,!?;:\"'")
+
+
+@dataclass
+class SpeechModelConfig:
+    """
+    size: whisper model size ("tiny", "base", "small", "medium", ...).
+    device: "auto", "cpu" or "cuda". "auto" uses CUDA when it is available.
+    backend: "whisper" (openai-whisper) or "faster-whisper" (CTranslate2).
+    compute_type: CPU precision of the faster-whisper backend, "int8" runs
+        the quantized model.
+    """
+
+    size: str = "small"
+    device: str = "auto"
+    backend: str = "whisper"
+    compute_type: str = "int8"
+
+
+def cuda_available() -> bool:
+    try:
+        import torch
+    except ImportError:
+        return False
+    return torch.cuda.is_available()
+
+
+class SpeechModel(ABC):
+    @abstractmethod
+    def transcribe(
+        self, audio: np.ndarray, initial_prompt: str | None = None
+    ) -> List[Word]:
+        """
+        Transcribes 16kHz float32 audio.
+
+        Returns:
+            List[Word]: the words, with timestamps relative to the audio start.
+        """
+
+
+class WhisperBackend(SpeechModel):
+    def __init__(self, config: SpeechModelConfig, device: str):
+        import whisper
+
+        self.model = whisper.load_model(config.size, device=device)
+        self.fp16 = device == "cuda"
+
+    def transcribe(
+        self, audio: np.ndarray, initial_prompt: str | None = None
+    ) -> List[Word]:
+        import whisper
+
+        result = whisper.transcribe(
+            model=self.model,
+            audio=audio,
+            initial_prompt=initial_prompt,
+            word_timestamps=True,
+            condition_on_previous_text=False,
+            fp16=self.fp16,
+        )
+        return [
+            Word(word["start"], word["end"], word["word"])
+            for segment in result["segments"]
+            for word in segment.get("words", [])
+        ]
+
+
+class FasterWhisperBackend(SpeechModel):
+    def __init__(self, config: SpeechModelConfig, device: str):
+        try:
+            from faster_whisper import WhisperModel
+        except ImportError:
+            raise ImportError(
+                """
+                The faster-whisper backend needs the faster-whisper package:
+                pip install faster-whisper
+                """
+            )
+
+        compute_type = config.compute_type if device == "cpu" else "float16"
+        self.model = WhisperModel(config.size, device=device, compute_type=compute_type)
+
+    def transcribe(
+        self, audio: np.ndarray, initial_prompt: str | None = None
+    ) -> List[Word]:
+        segments, _ = self.model.transcribe(
+            audio,
+            initial_prompt=initial_prompt,
+            word_timestamps=True,
+            condition_on_previous_text=False,
+        )
+        return [
+            Word(word.start, word.end, word.word)
+            for segment in segments
+            for word in segment.words or []
+        ]
+
+
+BACKENDS = {
+    "whisper": WhisperBackend,
+    "faster-whisper": FasterWhisperBackend,
+}
+
+
+class SpeechModelProvider:
+    """
+    Gives access to the speech model, loading it the first time it is needed
+    so that importing the transcription code stays cheap.
+    """
+
+    def __init__(self, config: SpeechModelConfig | None = None):
+        self.config = config or SpeechModelConfig()
+        if self.config.backend not in BACKENDS:
+            raise ValueError(
+                f"Unknown speech backend {self.config.backend}, "
+                f"expected one of {list(BACKENDS)}"
+            )
+        self.__model: SpeechModel | None = None
+        self.__lock = threading.Lock()
+
+    @property
+    def device(self) -> str:
+        if self.config.device != "auto":
+            return self.config.device
+        return "cuda" if cuda_available() else "cpu"
+
+    @property
+    def loaded(self) -> bool:
+        return self.__model is not None
+
+    def get(self) -> SpeechModel:
+        if self.__model is None:
+            with self.__lock:
+                if self.__model is None:
+                    backend = BACKENDS[self.config.backend]
+                    self.__model = backend(self.config, self.device)
+        return self.__model
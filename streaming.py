@@ -0,0 +1,71 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Iterator
+
+import langroid as lr
+
+"""
+TokenSink: Callable[[str, str], None]
+    Receives the name of the agent and each piece of text its LLM streams.
+"""
+TokenSink = Callable[[str, str], None]
+
+_sink: ContextVar[TokenSink | None] = ContextVar("token_sink", default=None)
+
+
+@contextmanager
+def relay_to(sink: TokenSink | None) -> Iterator[None]:
+    """
+    Sends the answers the plugin agents stream while the block runs (in this
+    thread or asyncio task, or the ones it starts) to `sink`.
+    """
+    token = _sink.set(sink)
+    try:
+        yield
+    finally:
+        _sink.reset(token)
+
+
+def relay_agent(agent: lr.ChatAgent) -> lr.ChatAgent:
+    """
+    Forwards what the LLM of `agent` streams to the current sink, except for
+    the turns where a PluginAgent is expected to pick a tool, whose JSON is of
+    no use to the user.
+    """
+    name = agent.config.name
+    start_llm_stream = agent.callbacks.start_llm_stream
+
+    def relaying_start_llm_stream() -> Any:
+        streamer = start_llm_stream()
+        sink = _sink.get()
+        if sink is None or getattr(agent, "expecting_tool_use", False):
+            return streamer
+
+        def relaying_streamer(text: Any) -> None:
+            streamer(text)
+            if isinstance(text, str) and text:
+                sink(name, text)
+
+        return relaying_streamer
+
+    agent.callbacks.start_llm_stream = relaying_start_llm_stream
+    # The async responses (e.g. of `run_async`) stream through their own callback
+    start_llm_stream_async = getattr(agent.callbacks, "start_llm_stream_async", None)
+    if start_llm_stream_async is None:
+        return agent
+
+    async def relaying_start_llm_stream_async() -> Any:
+        streamer_async = await start_llm_stream_async()
+        sink = _sink.get()
+        if sink is None or getattr(agent, "expecting_tool_use", False):
+            return streamer_async
+
+        async def relaying_streamer_async(text: Any) -> None:
+            await streamer_async(text)
+            if isinstance(text, str) and text:
+                sink(name, text)
+
+        return relaying_streamer_async
+
+    agent.callbacks.start_llm_stream_async = relaying_start_llm_stream_async
+    return agent
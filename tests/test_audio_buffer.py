@@ -0,0 +1,66 @@
+import threading
+
+import numpy as np
+import pytest
+
+from audio_buffer import AudioRingBuffer
+
+
+def make_buffer(capacity: int, blocking: bool = False) -> AudioRingBuffer:
+    return AudioRingBuffer(capacity_seconds=capacity, sample_rate=1, blocking=blocking)
+
+
+def test_view_across_the_wrap_is_contiguous():
+    buffer = make_buffer(8)
+    buffer.write(np.arange(6, dtype=np.float32))
+    buffer.write(np.arange(6, 11, dtype=np.float32))
+    view = buffer.view(5, 11)
+    assert view.tolist() == [5, 6, 7, 8, 9, 10]
+    assert view.base is not None
+
+
+def test_overwritten_range_raises():
+    buffer = make_buffer(4)
+    buffer.write(np.arange(6, dtype=np.float32))
+    assert buffer.start == 2
+    with pytest.raises(ValueError):
+        buffer.view(1, 3)
+    with pytest.raises(ValueError):
+        buffer.view(3, 7)
+
+
+def test_write_longer_than_capacity_keeps_the_newest_samples():
+    buffer = make_buffer(4)
+    buffer.write(np.arange(10, dtype=np.float32))
+    assert (buffer.start, buffer.end) == (6, 10)
+    assert buffer.view(6, 10).tolist() == [6, 7, 8, 9]
+
+
+def test_write_pcm16_is_normalized():
+    buffer = make_buffer(4)
+    buffer.write_pcm16(np.array([-32768, 0, 16384], dtype=np.int16).tobytes())
+    assert buffer.view(0, 3).tolist() == [-1.0, 0.0, 0.5]
+
+
+def test_wait_returns_false_once_closed():
+    buffer = make_buffer(4)
+    buffer.write(np.zeros(2, dtype=np.float32))
+    assert buffer.wait(2)
+    assert not buffer.wait(3, timeout=0.01)
+    buffer.close()
+    assert not buffer.wait(3)
+
+
+def test_blocking_producer_waits_for_release():
+    buffer = make_buffer(4, blocking=True)
+    buffer.write(np.arange(4, dtype=np.float32))
+    writer = threading.Thread(
+        target=buffer.write, args=(np.arange(4, 6, dtype=np.float32),)
+    )
+    writer.start()
+    writer.join(0.05)
+    assert writer.is_alive()
+    buffer.release(2)
+    writer.join(1)
+    assert not writer.is_alive()
+    assert buffer.view(2, 6).tolist() == [2, 3, 4, 5]
@@ -0,0 +1,44 @@
+import pytest
+
+pytest.importorskip("langroid")
+
+from chunk_store import ChunkStore  # noqa: E402
+
+
+@pytest.fixture
+def store(tmp_path) -> ChunkStore:
+    return ChunkStore(str(tmp_path / "chunks.sqlite"), batch_size=2)
+
+
+PIECES = [("A", "one"), ("A > B", "two"), ("C", "three")]
+
+
+def test_pieces_are_only_cached_once_all_are_stored(store):
+    assert store.get_pieces("file", "chunker") is None
+    written = store.put_pieces("file", "chunker", iter(PIECES))
+    assert next(written) == PIECES[0]
+    assert store.get_pieces("file", "chunker") is None
+    assert list(written) == PIECES[1:]
+    assert list(store.get_pieces("file", "chunker")) == PIECES
+
+
+def test_same_file_chunked_twice_at_once(store):
+    first = store.put_pieces("file", "chunker", iter(PIECES))
+    second = store.put_pieces("file", "chunker", iter(PIECES))
+    next(first)
+    next(second)
+    assert list(first) + list(second) == PIECES[1:] * 2
+    assert list(store.get_pieces("file", "chunker")) == PIECES
+
+
+def test_vectors_are_embedded_once(store):
+    calls = []
+
+    def embed(texts):
+        calls.append(texts)
+        return [[float(len(text))] for text in texts]
+
+    cached = store.embedding_fn(embed, "model")
+    assert cached(["a", "bb"]) == [[1.0], [2.0]]
+    assert cached(["bb", "ccc"]) == [[2.0], [3.0]]
+    assert calls == [["a", "bb"], ["ccc"]]
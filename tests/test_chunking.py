@@ -0,0 +1,52 @@
+import pytest
+
+pytest.importorskip("langroid")
+
+from langroid.parsing.parser import ParsingConfig  # noqa: E402
+
+from chunking import MarkdownChunker, content_hash, to_document  # noqa: E402
+
+INTRO = "Some intro text that is long enough to stand alone as a chunk here.\n"
+USAGE = "Call the function with the right arguments to get the result you want.\n"
+
+
+def chunker(chunk_size: int = 40) -> MarkdownChunker:
+    return MarkdownChunker(ParsingConfig(chunk_size=chunk_size))
+
+
+def lines(text: str):
+    return text.splitlines(keepends=True)
+
+
+def test_sections_are_chunked_with_their_heading_trail():
+    text = f"# Intro\n{INTRO}\n## Usage\n{USAGE}"
+    pieces = list(chunker().split(lines(text)))
+    assert [trail for trail, _ in pieces] == ["Intro", "Intro > Usage"]
+    assert pieces[1][1].startswith("## Usage")
+
+
+def test_editing_a_section_leaves_the_others_unchanged():
+    before = list(chunker().split(lines(f"# Intro\n{INTRO}\n## Usage\n{USAGE}")))
+    after = list(chunker().split(lines(f"# Intro\n{INTRO}\n## Usage\nChanged.\n")))
+    assert before[0] == after[0]
+    assert before[1] != after[1]
+
+
+def test_long_code_blocks_keep_their_fences():
+    text = "```python\n" + "value = compute(1, 2)\n" * 30 + "```\n"
+    pieces = list(chunker().split(lines(text)))
+    assert len(pieces) > 1
+    for _, content in pieces:
+        assert content.startswith("```python")
+        assert content.endswith("```")
+
+
+def test_fingerprint_follows_the_parsing_config():
+    assert chunker(40).fingerprint() == chunker(40).fingerprint()
+    assert chunker(40).fingerprint() != chunker(80).fingerprint()
+
+
+def test_documents_are_identified_by_their_content():
+    doc = to_document("docs.md", "Intro", "hello")
+    assert doc.id() == content_hash("hello")
+    assert doc.metadata.source == "docs.md: Intro"
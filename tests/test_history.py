@@ -0,0 +1,67 @@
+from types import SimpleNamespace
+from typing import List
+
+import pytest
+
+pytest.importorskip("langroid")
+
+from langroid.language_models import LLMMessage, Role  # noqa: E402
+
+from history import TRUNCATED, HistoryCompactor  # noqa: E402
+
+
+def compactor(budget: int) -> HistoryCompactor:
+    # Without a parser, a token is counted as 4 characters
+    agent = SimpleNamespace(parser=None)
+    return HistoryCompactor(agent, budget=budget, keep_recent=2, result_tokens=20)
+
+
+def history() -> List[LLMMessage]:
+    return [
+        LLMMessage(role=Role.SYSTEM, content="s" * 40),
+        LLMMessage(role=Role.USER, content="q" * 40),
+        LLMMessage(role=Role.ASSISTANT, content="a" * 400),
+        LLMMessage(role=Role.USER, content="u" * 40),
+        LLMMessage(role=Role.ASSISTANT, content="b" * 40),
+    ]
+
+
+def test_under_budget_is_untouched():
+    messages = history()
+    assert compactor(budget=1000).compact(messages) == 140
+    assert [m.content for m in messages] == [m.content for m in history()]
+
+
+def test_old_long_messages_are_truncated_first():
+    messages = history()
+    history_compactor = compactor(budget=100)
+    assert history_compactor.compact(messages) == 61
+    assert messages[2].content == "a" * 80 + TRUNCATED
+    assert history_compactor.stats() == {
+        "truncated": 1,
+        "dropped": 0,
+        "tokens_saved": 79,
+    }
+
+
+def test_oldest_messages_are_dropped_but_query_is_kept():
+    messages = history()
+    history_compactor = compactor(budget=40)
+    assert history_compactor.compact(messages) == 40
+    assert [m.content[0] for m in messages] == ["s", "q", "u", "b"]
+    assert history_compactor.stats()["dropped"] == 1
+
+
+def test_recent_messages_are_kept_over_budget():
+    messages = history()
+    assert compactor(budget=1).compact(messages) == 40
+    assert len(messages) == 4
+
+
+def test_truncated_messages_are_not_truncated_again():
+    messages = history()
+    history_compactor = compactor(budget=100)
+    history_compactor.compact(messages)
+    history_compactor.budget = 60
+    assert history_compactor.compact(messages) == 40
+    assert history_compactor.stats()["truncated"] == 1
@@ -0,0 +1,53 @@
+from typing import List
+
+import numpy as np
+import pytest
+
+pytest.importorskip("langroid")
+
+from response_cache import ResponseCache  # noqa: E402
+
+VECTORS = {
+    "how do I install it?": [1.0, 0.0],
+    "how can I install it?": [0.96, 0.28],
+    "what is a task?": [0.0, 1.0],
+}
+
+
+def embed(texts: List[str]) -> np.ndarray:
+    return np.array([VECTORS[text] for text in texts])
+
+
+def test_paraphrase_hits():
+    cache = ResponseCache(embed=embed, threshold=0.9)
+    cache.put("docs", "1", "how do I install it?", "pip install")
+    assert cache.get("docs", "1", "how can I install it?") == "pip install"
+    assert cache.get("docs", "1", "what is a task?") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_other_plugin_or_version_misses():
+    cache = ResponseCache(embed=embed)
+    cache.put("docs", "1", "how do I install it?", "pip install")
+    assert cache.get("web", "1", "how do I install it?") is None
+    assert cache.get("docs", "2", "how do I install it?") is None
+
+
+def test_expired_answers_are_ignored():
+    cache = ResponseCache(embed=embed, ttl_seconds=-1)
+    cache.put("docs", "1", "how do I install it?", "pip install")
+    assert cache.get("docs", "1", "how do I install it?") is None
+    assert len(cache) == 0
+    assert cache.stats()["expirations"] == 1
+
+
+def test_least_recently_used_is_evicted():
+    cache = ResponseCache(embed=embed, max_entries=2)
+    cache.put("docs", "1", "how do I install it?", "pip install")
+    cache.put("docs", "1", "what is a task?", "a runner")
+    assert cache.get("docs", "1", "how do I install it?") == "pip install"
+    cache.put("web", "1", "what is a task?", "a job")
+    assert cache.get("docs", "1", "what is a task?") is None
+    assert cache.get("docs", "1", "how do I install it?") == "pip install"
+    assert cache.stats()["evictions"] == 1
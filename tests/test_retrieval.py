@@ -0,0 +1,64 @@
+import pytest
+
+pytest.importorskip("langroid")
+
+from langroid.mytypes import DocMetaData, Document  # noqa: E402
+
+from retrieval import BM25Index, fuse, terms  # noqa: E402
+
+
+def doc(id: str) -> Document:
+    return Document(content=id, metadata=DocMetaData(id=id))
+
+
+def test_terms_split_identifiers():
+    assert list(terms("RecipientTool")) == ["recipienttool", "recipient", "tool"]
+    assert list(terms("recipient_tool 42")) == [
+        "recipient_tool",
+        "recipient",
+        "tool",
+        "42",
+    ]
+    assert list(terms("HTTPServer")) == ["httpserver", "http", "server"]
+
+
+TEXTS = [
+    "Use the RecipientTool to address an agent.",
+    "A task runs an agent in a loop.",
+    "The recipient_tool field names the recipient of a message.",
+    "Install the package with pip.",
+]
+
+
+def test_bm25_matches_identifier_parts():
+    index = BM25Index(TEXTS)
+    found = [i for i, _ in index.search("recipient tool", k=4)]
+    assert sorted(found) == [0, 2]
+
+
+def test_bm25_ranks_and_limits():
+    index = BM25Index(TEXTS)
+    results = index.search("install pip", k=1)
+    assert [i for i, _ in results] == [3]
+    assert results[0][1] > 0
+    assert index.search("unknown", k=4) == []
+
+
+def test_bm25_ignores_common_terms():
+    # "the" is in three of the four texts
+    assert BM25Index(TEXTS).search("the", k=4) == []
+
+
+def test_bm25_empty_index():
+    assert BM25Index([]).search("anything", k=3) == []
+
+
+def test_fuse_favours_documents_ranked_by_both():
+    a, b, c = doc("a"), doc("b"), doc("c")
+    fused = fuse([[a, b], [c, b]])
+    assert [d.id() for d in fused] == ["b", "a", "c"]
+
+
+def test_fuse_keeps_one_copy():
+    fused = fuse([[doc("a")], [doc("a")]])
+    assert len(fused) == 1
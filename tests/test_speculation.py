@@ -0,0 +1,33 @@
+import pytest
+
+pytest.importorskip("langroid")
+
+from speculation import stable_questions  # noqa: E402
+
+
+def test_instruction_is_stable_once_its_string_is_closed():
+    text = '{"request": "question_tool", "instruction": "How do I inst'
+    assert stable_questions(text) == []
+    text += 'all it?", "recip'
+    assert stable_questions(text) == [{"instruction": "How do I install it?"}]
+
+
+def test_escapes_in_the_instruction():
+    text = '{"instruction": "What is \\"Task\\"?\\nIn short"'
+    assert stable_questions(text) == [{"instruction": 'What is "Task"?\nIn short'}]
+
+
+def test_batch_questions_are_stable_once_their_object_is_closed():
+    text = (
+        '{"request": "batch_question_tool", "questions": ['
+        '{"recipient": "Docs", "instruction": "What is a task?"}, '
+        '{"recipient": "Web", "instruction": "Latest rel'
+    )
+    assert stable_questions(text) == [
+        {"recipient": "Docs", "instruction": "What is a task?"}
+    ]
+
+
+def test_batch_questions_need_a_recipient():
+    text = '{"questions": [{"instruction": "What is a task?"}, {"recipient": 1,'
+    assert stable_questions(text) == []
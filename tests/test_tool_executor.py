@@ -0,0 +1,93 @@
+import threading
+import time
+from typing import List
+
+import pytest
+
+pytest.importorskip("langroid")
+
+import langroid as lr  # noqa: E402
+
+from tool_executor import ToolExecutor, combine_results  # noqa: E402
+
+
+class EchoTool(lr.ToolMessage):
+    request: str = "echo"
+    purpose: str = "To echo <text>."
+    text: str
+
+
+class CachedEchoTool(EchoTool):
+    request: str = "cached_echo"
+
+    class Config:
+        idempotent = True
+
+
+class SlowTool(EchoTool):
+    request: str = "slow"
+
+    class Config:
+        timeout = 0.05
+
+
+class Agent:
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls: List[str] = []
+        self.release = threading.Event()
+
+    def handle_tool_message(self, tool, chat_doc=None):
+        self.calls.append(tool.text)
+        if isinstance(tool, SlowTool):
+            self.release.wait()
+        time.sleep(self.delay)
+        return tool.text.upper()
+
+
+def test_combine_results():
+    a, b = EchoTool(text="a"), EchoTool(text="b")
+    assert combine_results([a], ["A"]) == "A"
+    assert combine_results([a, b], [None, None]) is None
+    assert combine_results([a, b], ["A", "B"]) == (
+        "Result from echo: A\n\nResult from echo: B"
+    )
+    a.id, b.id = "1", "2"
+    assert combine_results([a, b], ["A", "B"]) == {"1": "A", "2": "B"}
+
+
+def test_tools_run_concurrently():
+    executor = ToolExecutor(max_workers=4)
+    start = time.time()
+    tools = [EchoTool(text=t) for t in "abc"]
+    assert executor.run(Agent(delay=0.2), tools) == ["A", "B", "C"]
+    assert time.time() - start < 0.5
+
+
+def test_idempotent_results_are_reused():
+    executor = ToolExecutor(max_workers=2)
+    agent = Agent()
+    tools = [CachedEchoTool(text="a"), EchoTool(text="b")]
+    for _ in range(2):
+        assert executor.run(agent, tools) == ["A", "B"]
+    assert agent.calls.count("a") == 1
+    assert agent.calls.count("b") == 2
+    assert executor.stats()["cache_hits"] == 1
+
+
+def test_stuck_tools_time_out_and_are_capped():
+    executor = ToolExecutor(max_workers=2, max_overdue=1)
+    agent = Agent()
+    [result] = executor.run(agent, [SlowTool(text="a")])
+    assert result.startswith("ERROR: slow did not finish")
+    [result] = executor.run(agent, [EchoTool(text="b")])
+    assert result.startswith("ERROR: echo can not run")
+    assert executor.stats()["overdue"] == 1
+    assert executor.stats()["rejected"] == 1
+
+    agent.release.set()
+    deadline = time.time() + 5
+    while executor.stats()["overdue"] and time.time() < deadline:
+        time.sleep(0.01)
+    assert executor.run(agent, [EchoTool(text="b")]) == ["B"]
+    assert executor.stats()["timeouts"] == 1
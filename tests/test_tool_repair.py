@@ -0,0 +1,65 @@
+import pytest
+
+pytest.importorskip("langroid")
+
+import langroid as lr  # noqa: E402
+
+from tool_repair import (  # noqa: E402
+    closest,
+    json_candidates,
+    loads_lenient,
+    repair_tool,
+)
+
+
+class SearchTool(lr.ToolMessage):
+    request: str = "search"
+    purpose: str = "To search for <query>."
+    query: str
+    limit: int = 5
+
+
+TOOLS = {"search": SearchTool}
+
+
+def test_json_candidates_skip_the_text_around_them():
+    text = 'Sure! ```json\n{"a": {"b": "}"}}\n``` and {"c": 1}'
+    assert json_candidates(text) == ['{"a": {"b": "}"}}', '{"c": 1}']
+
+
+def test_json_candidates_close_a_truncated_object():
+    assert json_candidates('{"a": ["x", "y') == ['{"a": ["x", "y"]}']
+
+
+def test_loads_lenient():
+    assert loads_lenient('{"a": 1,}') == {"a": 1}
+    assert loads_lenient("{'a': true, 'b': null}") == {"a": True, "b": None}
+    assert loads_lenient("not json") is None
+
+
+def test_closest():
+    assert closest("Search", ["search", "open"]) == "search"
+    assert closest("serach", ["search", "open"]) == "search"
+    assert closest("unrelated", ["search", "open"]) is None
+
+
+def test_repair_tool_fixes_misspelled_names():
+    tool = repair_tool(TOOLS, {"request": "serach", "qeury": "bm25", "limit": 2})
+    assert isinstance(tool, SearchTool)
+    assert (tool.query, tool.limit) == ("bm25", 2)
+
+
+def test_repair_tool_guesses_the_single_missing_field():
+    tool = repair_tool(TOOLS, {"request": "search", "text": "bm25"})
+    assert tool.query == "bm25"
+
+
+def test_repair_tool_unwraps_a_schema():
+    data = {"request": "search", "properties": {"query": "bm25"}}
+    assert repair_tool(TOOLS, data).query == "bm25"
+
+
+def test_repair_tool_needs_a_known_request():
+    assert repair_tool(TOOLS, {"query": "bm25"}) is None
+    assert repair_tool(TOOLS, {"request": "weather", "query": "bm25"}) is None
+    assert repair_tool(TOOLS, ["search"]) is None
@@ -0,0 +1,81 @@
+from typing import List
+
+import numpy as np
+
+from audio_buffer import SAMPLE_RATE, AudioRingBuffer
+from speech_model import Word
+from transcriber import HypothesisBuffer, StreamingTranscriber, join_words
+
+
+def words(*items: tuple) -> List[Word]:
+    return [Word(start, end, f" {text}") for start, end, text in items]
+
+
+def test_only_the_prefix_of_two_hypotheses_is_committed():
+    buffer = HypothesisBuffer()
+    buffer.insert(words((0, 1, "hello"), (1, 2, "word")), 0)
+    assert buffer.flush() == []
+    buffer.insert(words((0, 1, "hello"), (1, 2, "world"), (2, 3, "again")), 0)
+    assert join_words(buffer.flush()) == "hello"
+    assert join_words(buffer.complete()) == "world again"
+
+
+def test_repeated_words_at_the_window_start_are_dropped():
+    buffer = HypothesisBuffer()
+    for _ in range(2):
+        buffer.insert(words((0, 1, "hello"), (1, 2, "world")), 0)
+        buffer.flush()
+    # The window is trimmed after the commit, as StreamingTranscriber does
+    buffer.pop_committed(2.0)
+    buffer.insert(words((0, 0.5, "world"), (0.6, 1, "again")), 1.8)
+    assert join_words(buffer.new) == "again"
+
+
+class ScriptedModel:
+    """Returns the next transcription of `script` for each window."""
+
+    def __init__(self, script: List[List[Word]]):
+        self.script = script
+        self.windows: List[int] = []
+
+    def get(self) -> "ScriptedModel":
+        return self
+
+    def transcribe(self, audio: np.ndarray, prompt: str | None) -> List[Word]:
+        self.windows.append(len(audio))
+        return self.script.pop(0)
+
+
+def make_transcriber(script: List[List[Word]]) -> StreamingTranscriber:
+    ring = AudioRingBuffer(capacity_seconds=10)
+    ring.write(np.zeros(5 * SAMPLE_RATE, dtype=np.float32))
+    return StreamingTranscriber(ScriptedModel(script), ring)
+
+
+def test_committed_audio_is_cut_from_the_window():
+    hypothesis = words((0, 1, "hello"), (1, 2, "world"))
+    transcriber = make_transcriber([hypothesis, hypothesis])
+    transcriber.extend(0, 3 * SAMPLE_RATE)
+    assert transcriber.process() == ([], hypothesis)
+    committed, tail = transcriber.process()
+    assert join_words(committed) == "hello world" and tail == []
+    assert transcriber.window_start == 2 * SAMPLE_RATE
+    assert transcriber.text == "hello world"
+
+
+def test_skip_to_drops_the_words_of_the_lost_audio():
+    transcriber = make_transcriber([words((0, 1, "lost"), (3, 4, "kept"))])
+    transcriber.extend(0, 5 * SAMPLE_RATE)
+    transcriber.process()
+    transcriber.skip_to(2 * SAMPLE_RATE)
+    assert transcriber.window_start == 2 * SAMPLE_RATE
+    assert join_words(transcriber.hypothesis.complete()) == "kept"
+
+
+def test_finish_returns_every_word_and_resets():
+    transcriber = make_transcriber([words((0, 1, "hi"))])
+    transcriber.extend(0, SAMPLE_RATE)
+    transcriber.process()
+    assert join_words(transcriber.finish()) == "hi"
+    assert not transcriber.active
+    assert transcriber.window_start == SAMPLE_RATE
@@ -0,0 +1,49 @@
+import numpy as np
+
+from vad import SAMPLE_RATE, EnergyVAD, SpeechGate
+
+
+def silence(seconds: float) -> np.ndarray:
+    return np.zeros(int(seconds * SAMPLE_RATE), dtype=np.float32)
+
+
+def tone(seconds: float, frequency: float = 220.0) -> np.ndarray:
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    return (0.3 * np.sin(2 * np.pi * frequency * t)).astype(np.float32)
+
+
+def noise(seconds: float) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    return (0.3 * rng.standard_normal(int(seconds * SAMPLE_RATE))).astype(np.float32)
+
+
+def test_tone_is_speech_and_silence_is_not():
+    vad = EnergyVAD()
+    assert not vad.speech_frames(silence(0.3)).any()
+    assert vad.speech_frames(tone(0.3)).all()
+
+
+def test_loud_flat_noise_is_not_speech():
+    assert not EnergyVAD().speech_frames(noise(0.3)).any()
+
+
+def test_silent_chunk_has_no_span():
+    assert SpeechGate().process(silence(1.0)) == []
+
+
+def test_utterance_is_cut_after_the_hangover():
+    gate = SpeechGate(hangover_ms=300, padding_ms=0)
+    audio = np.concatenate([silence(0.3), tone(0.6), silence(0.6)])
+    [span] = gate.process(audio)
+    assert span.final
+    frame = gate.vad.frame_length
+    assert abs(span.start - int(0.3 * SAMPLE_RATE)) <= frame
+    assert abs(span.stop - int(0.9 * SAMPLE_RATE)) <= frame
+
+
+def test_utterance_continues_in_the_next_chunk():
+    gate = SpeechGate(hangover_ms=300)
+    [first] = gate.process(np.concatenate([silence(0.3), tone(0.6)]))
+    assert not first.final
+    [second] = gate.process(np.concatenate([tone(0.3), silence(0.6)]))
+    assert second.start == 0 and second.final
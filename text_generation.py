@@ -1,25 +1,33 @@
-import whisper
-import pyaudio
-import queue
+import bisect
+import json
+import resource
+import wave
 import numpy as np
 import time
 import threading
-from typing import Dict, List
+import typer
+from typing import Callable, Dict, Iterator, List, Tuple
 
-text_generation_model = whisper.load_model("small", device="cuda")
+from audio_buffer import AudioRingBuffer, SAMPLE_RATE
+from speech_model import SpeechModelConfig, SpeechModelProvider, Word
+from transcriber import StreamingTranscriber, join_words
+from vad import SpeechGate
 
-audio_queue = queue.Queue()
-length_queue = queue.Queue(maxsize=6)
+CHUNK_SIZE = 16000  # 1 second of audio
 
+app = typer.Typer()
+
+
+def producer_thread(audio_buffer: AudioRingBuffer):
+    import pyaudio
 
-def producer_thread():
     audio = pyaudio.PyAudio()
     stream = audio.open(
         format=pyaudio.paInt16,
         channels=1,
         rate=16000,
         input=True,
-        frames_per_buffer=16000,  # 1 second of audio
+        frames_per_buffer=CHUNK_SIZE,
     )
 
     print("-" * 80)
@@ -29,46 +37,108 @@ def producer_thread():
     print("-" * 80)
 
     while True:
-        audio_data = b""
-        for _ in range(1):
-            chunk = stream.read(16000)  # Read 1 second of audio data
-            audio_data += chunk
+        # The samples are converted straight into the shared buffer
+        audio_buffer.write_pcm16(stream.read(CHUNK_SIZE))
 
-        audio_queue.put(audio_data)
 
+def read_pcm16(path: str) -> Iterator[bytes]:
+    """
+    Reads a 16kHz mono 16 bit WAV file, or a raw PCM file with the same
+    format, one chunk at a time. The last chunk is padded with silence.
+    """
+    if path.endswith(".wav"):
+        with wave.open(path, "rb") as wav:
+            if (
+                wav.getframerate() != SAMPLE_RATE
+                or wav.getnchannels() != 1
+                or wav.getsampwidth() != 2
+            ):
+                raise ValueError(f"{path} must be 16kHz mono 16 bit PCM")
+            while chunk := wav.readframes(CHUNK_SIZE):
+                yield chunk.ljust(CHUNK_SIZE * 2, b"\0")
+    else:
+        with open(path, "rb") as pcm:
+            while chunk := pcm.read(CHUNK_SIZE * 2):
+                yield chunk.ljust(CHUNK_SIZE * 2, b"\0")
 
-def consumer_thread(stats):
-    while True:
-        if length_queue.qsize() >= 6:
-            with length_queue.mutex:
-                length_queue.queue.clear()
-                print()
 
-        audio_data = audio_queue.get()
-        transcription_start_time = time.time()
-        length_queue.put(audio_data)
+def file_producer_thread(
+    audio_buffer: AudioRingBuffer,
+    path: str,
+    speed: float,
+    feed_times: List[Tuple[int, float]],
+):
+    """
+    Replays `path` in place of the microphone, `speed` times faster than real
+    time. With a speed of 0 the file is fed as fast as the consumer releases
+    the buffer. `feed_times` records when each chunk became available.
+    """
+    start_time = time.time()
+    for pcm in read_pcm16(path):
+        if speed > 0:
+            due = start_time + audio_buffer.end / SAMPLE_RATE / speed
+            time.sleep(max(0.0, due - time.time()))
+        audio_buffer.write_pcm16(pcm)
+        feed_times.append((audio_buffer.end, time.time()))
+    audio_buffer.close()
 
-        # Concatenate audio data in the lenght_queue
-        audio_data_to_process = b""
-        for i in range(length_queue.qsize()):
-            # We index it so it won't get removed
-            audio_data_to_process += length_queue.queue[i]
 
-        # convert the bytes data toa  numpy array
-        audio_data_array: np.ndarray = (
-            np.frombuffer(audio_data_to_process, np.int16).astype(np.float32) / 255.0
-        )
+def consumer_thread(
+    audio_buffer: AudioRingBuffer,
+    speech_model: SpeechModelProvider,
+    stats,
+    on_commit: Callable[[List[Word]], None] | None = None,
+    on_utterance: Callable[[str], None] | None = None,
+    verbose: bool = True,
+):
+    transcriber = StreamingTranscriber(speech_model, audio_buffer)
+    gate = SpeechGate()
+    position = 0
+    while audio_buffer.wait(position + CHUNK_SIZE):
+        if position < audio_buffer.start:
+            # We fell behind by more than the buffer, skip the overwritten audio
+            position = audio_buffer.start
+            transcriber.reset(position)
+            continue
+        if transcriber.active and transcriber.window_start < audio_buffer.start:
+            # The start of the utterance was overwritten, only the rest is decoded
+            transcriber.skip_to(audio_buffer.start)
+        chunk_start = position
+        position += CHUNK_SIZE
+        transcription_start_time = time.time()
 
-        segments, _ = whisper.transcribe(
-            model=text_generation_model,
-            audio=audio_data_array,
+        chunk = audio_buffer.view(chunk_start, position)
+        audio_buffer.release(
+            transcriber.window_start if transcriber.active else chunk_start
         )
 
-        segments = [s.text for s in segments]
+        # Silent chunks never reach the model
+        spans = gate.process(chunk)
+        if not spans:
+            stats["dropped"] += 1
+            continue
+
+        tail: List[Word] = []
+        for span in spans:
+            transcriber.extend(chunk_start + span.start, chunk_start + span.stop)
+            # Only the audio after the last committed word is decoded again
+            committed, tail = transcriber.process()
+            if committed and on_commit:
+                on_commit(committed)
+            if span.final:
+                n_committed = len(transcriber.committed)
+                words = transcriber.finish()
+                if words[n_committed:] and on_commit:
+                    on_commit(words[n_committed:])
+                if verbose:
+                    print(join_words(words), flush=True)
+                if on_utterance:
+                    on_utterance(join_words(words))
+                tail = []
 
         transcription_end_time = time.time()
 
-        transcription = " ".join(segments)
+        transcription = f"{transcriber.text} {join_words(tail)}".strip()
         # remove anything from the text which is between () or [] --> these are non-verbal background noises/music/etc.
         # transcription = re.sub(r"\[.*\]", "", transcription)
         # transcription = re.sub(r"\(.*\)", "", transcription)
@@ -77,9 +147,8 @@ def consumer_thread(stats):
 
         transcription_postprocessing_end_time = time.time()
 
-        print(transcription, end="\r", flush=True)
-
-        audio_queue.task_done()
+        if verbose:
+            print(transcription, end="\r", flush=True)
 
         overall_elapsed_time = (
             transcription_postprocessing_end_time - transcription_start_time
@@ -91,39 +160,205 @@ def consumer_thread(stats):
         stats["overall"].append(overall_elapsed_time)
         stats["transcription"].append(transcription_elapsed_time)
         stats["postprocessing"].append(postprocessing_elapsed_time)
+        stats["window"].append(transcriber.window_seconds)
 
+    # The stream ended in the middle of an utterance
+    if transcriber.active:
+        n_committed = len(transcriber.committed)
+        words = transcriber.finish()
+        if words[n_committed:] and on_commit:
+            on_commit(words[n_committed:])
+        if on_utterance and words:
+            on_utterance(join_words(words))
 
-stats: Dict[str, List[float]] = {
-    "overall": [],
-    "transcription": [],
-    "postprocessing": [],
-}
 
-producer = threading.Thread(target=producer_thread)
-producer.start()
+def new_stats() -> Dict[str, List[float] | int]:
+    return {
+        "overall": [],
+        "transcription": [],
+        "postprocessing": [],
+        "window": [],
+        "dropped": 0,
+    }
 
-consumer = threading.Thread(target=consumer_thread, args=(stats,))
-consumer.start()
 
-try:
-    producer.join()
-    consumer.join()
-except KeyboardInterrupt:
-    print("Exiting...")
-    # print out the statistics
-    print("Number of processed chunks: ", len(stats["overall"]))
-    print(
-        f"Overall time: avg: {np.mean(stats['overall']):.4f}s, std: {np.std(stats['overall']):.4f}s"
+def latency_summary(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"count": 0}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "count": len(values),
+        "mean": float(np.mean(values)),
+        "p50": float(p50),
+        "p95": float(p95),
+        "p99": float(p99),
+        "max": float(np.max(values)),
+    }
+
+
+@app.command()
+def transcribe(
+    model_size: str = typer.Option("small", "--model", "-m", help="whisper size"),
+    device: str = typer.Option("auto", "--device", "-d", help="auto, cpu or cuda"),
+    backend: str = typer.Option(
+        "whisper", "--backend", "-b", help="whisper or faster-whisper"
+    ),
+    compute_type: str = typer.Option(
+        "int8", "--compute-type", "-c", help="faster-whisper CPU precision"
+    ),
+) -> None:
+    speech_model = SpeechModelProvider(
+        SpeechModelConfig(
+            size=model_size,
+            device=device,
+            backend=backend,
+            compute_type=compute_type,
+        )
     )
-    print(
-        f"Transcription time: avg: {np.mean(stats['transcription']):.4f}s, std: {np.std(stats['transcription']):.4f}s"
+    # Load now rather than on the first chunk, so the first words are not late
+    speech_model.get()
+    audio_buffer = AudioRingBuffer(capacity_seconds=30)
+
+    stats = new_stats()
+
+    producer = threading.Thread(target=producer_thread, args=(audio_buffer,))
+    producer.daemon = True
+    producer.start()
+
+    consumer = threading.Thread(
+        target=consumer_thread, args=(audio_buffer, speech_model, stats)
     )
-    print(
-        f"Postprocessing time: avg: {np.mean(stats['postprocessing']):.4f}s, std: {np.std(stats['postprocessing']):.4f}s"
+    consumer.daemon = True
+    consumer.start()
+
+    try:
+        producer.join()
+        consumer.join()
+    except KeyboardInterrupt:
+        print("Exiting...")
+        # print out the statistics
+        print("Number of processed chunks: ", len(stats["overall"]))
+        print("Number of silent chunks dropped: ", stats["dropped"])
+        print(
+            f"Overall time: avg: {np.mean(stats['overall']):.4f}s, std: {np.std(stats['overall']):.4f}s"
+        )
+        print(
+            f"Transcription time: avg: {np.mean(stats['transcription']):.4f}s, std: {np.std(stats['transcription']):.4f}s"
+        )
+        print(
+            f"Postprocessing time: avg: {np.mean(stats['postprocessing']):.4f}s, std: {np.std(stats['postprocessing']):.4f}s"
+        )
+        # A word is committed once a second window confirms it, so the latency is
+        # the decoding time plus the chunk it was heard in and the one confirming it.
+        print(f"Average decoded window: {np.mean(stats['window']):.2f}s")
+        print(f"The average latency is {np.mean(stats['overall'])+2:.4f}s")
+
+
+def benchmark_file(
+    speech_model: SpeechModelProvider, path: str, speed: float
+) -> Dict[str, object]:
+    """Runs `path` through the producer/consumer pipeline and measures it."""
+    audio_buffer = AudioRingBuffer(capacity_seconds=30, blocking=speed <= 0)
+    stats = new_stats()
+    feed_times: List[Tuple[int, float]] = []
+    word_latencies: List[float] = []
+    transcript: List[str] = []
+
+    def on_commit(words: List[Word]) -> None:
+        now = time.time()
+        positions = [position for position, _ in feed_times]
+        for word in words:
+            # Latency from the moment the end of the word could be heard
+            fed = bisect.bisect_left(positions, int(word.end * SAMPLE_RATE))
+            if fed < len(feed_times):
+                word_latencies.append(now - feed_times[fed][1])
+
+    producer = threading.Thread(
+        target=file_producer_thread, args=(audio_buffer, path, speed, feed_times)
+    )
+    start_time = time.time()
+    producer.start()
+    consumer_thread(
+        audio_buffer,
+        speech_model,
+        stats,
+        on_commit=on_commit,
+        on_utterance=transcript.append,
+        verbose=False,
     )
-    # We need to add the step_in_sec to the latency as we need to wait for that chunk of audio
-    print(f"The average latency is {np.mean(stats['overall'])+6:.4f}s")
+    producer.join()
+    wall_time = time.time() - start_time
+
+    audio_seconds = audio_buffer.end / SAMPLE_RATE
+    return {
+        "file": path,
+        "audio_seconds": audio_seconds,
+        "wall_seconds": wall_time,
+        "compute_seconds": float(np.sum(stats["overall"])),
+        # Compute spent per second of audio, below 1 keeps up with real time
+        "real_time_factor": float(np.sum(stats["overall"])) / audio_seconds
+        if audio_seconds
+        else 0.0,
+        "chunks": len(stats["overall"]) + stats["dropped"],
+        "dropped_chunks": stats["dropped"],
+        "chunk_latency": latency_summary(stats["overall"]),
+        "word_latency": latency_summary(word_latencies),
+        "mean_window_seconds": float(np.mean(stats["window"]))
+        if stats["window"]
+        else 0.0,
+        "transcript": " ".join(transcript),
+    }
+
+
+@app.command()
+def bench(
+    files: List[str] = typer.Argument(..., help="16kHz mono 16 bit WAV/PCM files"),
+    speed: float = typer.Option(
+        0.0, "--speed", "-s", help="replay speed, 1 is real time, 0 is unthrottled"
+    ),
+    output: str = typer.Option("", "--output", "-o", help="write the JSON here"),
+    model_size: str = typer.Option("small", "--model", "-m", help="whisper size"),
+    device: str = typer.Option("auto", "--device", "-d", help="auto, cpu or cuda"),
+    backend: str = typer.Option(
+        "whisper", "--backend", "-b", help="whisper or faster-whisper"
+    ),
+    compute_type: str = typer.Option(
+        "int8", "--compute-type", "-c", help="faster-whisper CPU precision"
+    ),
+) -> None:
+    config = SpeechModelConfig(
+        size=model_size,
+        device=device,
+        backend=backend,
+        compute_type=compute_type,
+    )
+    speech_model = SpeechModelProvider(config)
+    load_start_time = time.time()
+    speech_model.get()
+    load_time = time.time() - load_start_time
+
+    results = [benchmark_file(speech_model, path, speed) for path in files]
+    audio_seconds = sum(r["audio_seconds"] for r in results)
+    report = {
+        "model": {**config.__dict__, "device": speech_model.device},
+        "speed": speed,
+        "load_seconds": load_time,
+        "audio_seconds": audio_seconds,
+        "real_time_factor": sum(r["compute_seconds"] for r in results)
+        / audio_seconds
+        if audio_seconds
+        else 0.0,
+        # ru_maxrss is in kilobytes on Linux
+        "peak_memory_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "files": results,
+    }
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
 
 
-print(stats.get("transcription"))
-exit()
+if __name__ == "__main__":
+    app()
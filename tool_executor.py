@@ -0,0 +1,181 @@
+import contextvars
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Dict, List, Set
+
+import langroid as lr
+from langroid import ChatDocument
+
+from config import TOOL_TIMEOUT, TOOL_WORKERS
+
+
+def tool_key(tool: lr.ToolMessage) -> str:
+    """Identifies a tool call by its name and arguments."""
+    arguments = tool.dict(exclude={"request", "purpose", "id"})
+    return tool.default_value("request") + json.dumps(
+        arguments, sort_keys=True, default=str
+    )
+
+
+def tool_option(tool: lr.ToolMessage, name: str, default: Any) -> Any:
+    """
+    An option set in the `Config` of a tool, like `handle_only`:
+
+        class Config:
+            idempotent = True  # its results may be reused
+            timeout = 10  # seconds
+    """
+    return getattr(tool.__config__, name, default)
+
+
+def combine_results(
+    tools: List[lr.ToolMessage], results: List[Any]
+) -> None | str | ChatDocument | Dict[str, str]:
+    """Combines the results of `tools` the way ChatAgent.handle_message does."""
+    if len(tools) == 1 and isinstance(results[0], ChatDocument):
+        return results[0]
+    # A document can't be returned for several tools without losing the others
+    results = [
+        result.content if isinstance(result, ChatDocument) else result
+        for result in results
+    ]
+    named = [
+        (tool.default_value("request"), result)
+        for tool, result in zip(tools, results)
+        if result is not None
+    ]
+    if not named:
+        return None
+    if len(named) > 1 and all(tool.id != "" for tool in tools):
+        return OrderedDict(
+            (tool.id, result)
+            for tool, result in zip(tools, results)
+            if isinstance(result, str)
+        )
+    if len(named) == 1 and isinstance(named[0][1], str):
+        return named[0][1]
+    return "\n\n".join(
+        f"Result from {name}: {result}"
+        for name, result in named
+        if isinstance(result, str)
+    )
+
+
+class ToolExecutor:
+    """
+    Runs the tools of an LLM message concurrently on a thread pool shared by
+    all the agents, so that slow I/O tools don't wait for each other. A tool
+    that takes longer than its timeout gets an error as result. The results
+    of the tools marked as idempotent are reused for the same arguments.
+
+    A tool that timed out still takes a worker until it finishes. Once
+    `max_overdue` of them do, the new tools get an error right away rather
+    than waiting for a worker.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = TOOL_WORKERS,
+        timeout: float = TOOL_TIMEOUT,
+        cache_size: int = 1024,
+        max_overdue: int | None = None,
+    ):
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self.max_overdue = max_overdue or max(1, max_workers // 2)
+        self.calls = 0
+        self.cache_hits = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.__pool = ThreadPoolExecutor(max_workers, thread_name_prefix="tool")
+        self.__results: OrderedDict[str, str] = OrderedDict()
+        self.__overdue: Set[Future] = set()
+        self.__lock = threading.Lock()
+
+    def cached(self, tool: lr.ToolMessage) -> str | None:
+        if not tool_option(tool, "idempotent", False):
+            return None
+        with self.__lock:
+            result = self.__results.get(tool_key(tool))
+            if result is not None:
+                self.__results.move_to_end(tool_key(tool))
+                self.cache_hits += 1
+            return result
+
+    def remember(self, tool: lr.ToolMessage, result: Any) -> None:
+        # Only text results: documents and tools drive the orchestration
+        if not tool_option(tool, "idempotent", False) or not isinstance(result, str):
+            return
+        with self.__lock:
+            self.__results[tool_key(tool)] = result
+            if len(self.__results) > self.cache_size:
+                self.__results.popitem(last=False)
+
+    def run(
+        self,
+        agent: lr.ChatAgent,
+        tools: List[lr.ToolMessage],
+        chat_doc: ChatDocument | None = None,
+    ) -> List[Any]:
+        """The results of `agent.handle_tool_message` for each of `tools`."""
+        start = time.time()
+        pending: Dict[int, Future] = {}
+        results: List[Any] = [self.cached(tool) for tool in tools]
+        for i, tool in enumerate(tools):
+            if results[i] is None and len(self.__overdue) >= self.max_overdue:
+                with self.__lock:
+                    self.rejected += 1
+                name = tool.default_value("request")
+                results[i] = f"ERROR: {name} can not run, too many tools are stuck"
+            elif results[i] is None:
+                # The tool spans are children of the current span
+                context = contextvars.copy_context()
+                pending[i] = self.__pool.submit(
+                    context.run, agent.handle_tool_message, tool, chat_doc
+                )
+        with self.__lock:
+            self.calls += len(pending)
+        for i, future in pending.items():
+            timeout = tool_option(tools[i], "timeout", self.timeout)
+            try:
+                results[i] = future.result(max(0.0, start + timeout - time.time()))
+            except FutureTimeoutError:
+                with self.__lock:
+                    self.timeouts += 1
+                    self.__overdue.add(future)
+                future.add_done_callback(self.__finished)
+                name = tools[i].default_value("request")
+                results[i] = f"ERROR: {name} did not finish within {timeout} seconds"
+                continue
+            self.remember(tools[i], results[i])
+        return results
+
+    def __finished(self, future: Future) -> None:
+        with self.__lock:
+            self.__overdue.discard(future)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "calls": self.calls,
+            "cache_hits": self.cache_hits,
+            "timeouts": self.timeouts,
+            "overdue": len(self.__overdue),
+            "rejected": self.rejected,
+        }
+
+
+_tool_executor: ToolExecutor | None = None
+_tool_executor_lock = threading.Lock()
+
+
+def get_tool_executor() -> ToolExecutor:
+    """Returns the ToolExecutor shared by the whole process."""
+    global _tool_executor
+    with _tool_executor_lock:
+        if _tool_executor is None:
+            _tool_executor = ToolExecutor()
+    return _tool_executor
@@ -0,0 +1,233 @@
+import ast
+import difflib
+import json
+import re
+import threading
+from typing import Any, Dict, List, Type
+
+import langroid as lr
+from langroid.mytypes import Entity
+from langroid.pydantic_v1 import ValidationError
+
+from config import MAX_TOOL_RETRIES
+from tracing import get_tracer
+
+# Fields of every ToolMessage that the LLM does not have to fill
+TOOL_FIELDS = {"request", "purpose", "id"}
+
+
+def json_candidates(text: str) -> List[str]:
+    """
+    The top-level `{...}` substrings of `text`, ignoring any text around
+    them. An object that is not closed at the end of the text is closed.
+    """
+    text = re.sub(r"```\w*", "", text)
+    candidates = []
+    stack: List[str] = []
+    start = 0
+    quote: str | None = None
+    escaped = False
+    for i, char in enumerate(text):
+        if quote:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == quote:
+                quote = None
+            continue
+        if char in "\"'" and stack:
+            quote = char
+        elif char in "{[":
+            if not stack:
+                if char == "[":
+                    continue
+                start = i
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]" and stack:
+            if char == stack[-1]:
+                stack.pop()
+            if not stack:
+                candidates.append(text[start : i + 1])
+    if stack:
+        tail = text[start:] + (quote or "")
+        candidates.append(tail + "".join(reversed(stack)))
+    return candidates
+
+
+def loads_lenient(text: str) -> Any:
+    """
+    Parses almost valid JSON: trailing commas, single quotes, and Python
+    literals. Returns None if nothing works.
+    """
+    no_trailing_commas = re.sub(r",\s*([}\]])", r"\1", text)
+    for candidate in (text, no_trailing_commas):
+        try:
+            return json.loads(candidate)
+        except ValueError:
+            pass
+        python = re.sub(r"\btrue\b", "True", candidate)
+        python = re.sub(r"\bfalse\b", "False", python)
+        python = re.sub(r"\bnull\b", "None", python)
+        try:
+            return ast.literal_eval(python)
+        except (ValueError, SyntaxError, MemoryError, RecursionError):
+            pass
+    return None
+
+
+def closest(name: str, names: List[str]) -> str | None:
+    by_lower = {n.lower(): n for n in names}
+    if name.lower() in by_lower:
+        return by_lower[name.lower()]
+    matches = difflib.get_close_matches(name.lower(), by_lower, n=1, cutoff=0.6)
+    return by_lower[matches[0]] if matches else None
+
+
+def tool_fields(tool: Type[lr.ToolMessage]) -> Dict[str, bool]:
+    """The fields the LLM fills, and whether they are required."""
+    return {
+        name: field.required
+        for name, field in tool.__fields__.items()
+        if name not in TOOL_FIELDS
+    }
+
+
+def repair_fields(
+    tool: Type[lr.ToolMessage], data: Dict[str, Any], guess: bool
+) -> Dict[str, Any]:
+    """
+    Renames the misspelled fields of `data` to the fields of `tool`. With
+    `guess`, a single unknown field is taken as the single missing one.
+    """
+    fields = tool_fields(tool)
+    repaired: Dict[str, Any] = {}
+    unknown: Dict[str, Any] = {}
+    for key, value in data.items():
+        if key in TOOL_FIELDS:
+            continue
+        field = closest(str(key), [f for f in fields if f not in repaired])
+        if field is None:
+            unknown[key] = value
+        else:
+            repaired[field] = value
+    missing = [f for f, required in fields.items() if required and f not in repaired]
+    if guess and len(missing) == 1 and len(unknown) == 1:
+        repaired[missing[0]] = next(iter(unknown.values()))
+    return repaired
+
+
+def repair_tool(
+    tools: Dict[str, Type[lr.ToolMessage]], data: Any
+) -> lr.ToolMessage | None:
+    """
+    Matches the parsed `data` to the tool of `tools` its request names,
+    fixing its names. JSON that names no tool is left alone: it may be quoted
+    in a plain answer, and guessing the tool from the fields could run one
+    with side effects (e.g. open the browser).
+    """
+    if not isinstance(data, dict):
+        return None
+    request = data.get("request")
+    if isinstance(data.get("properties"), dict):
+        # Weak LLMs sometimes wrap the tool in a JSON schema
+        data = data["properties"]
+        request = request or data.get("request")
+    name = closest(request, list(tools)) if isinstance(request, str) else None
+    if name is None:
+        return None
+    fields = repair_fields(tools[name], data, guess=True)
+    try:
+        return tools[name].parse_obj({**fields, "request": name})
+    except ValidationError:
+        return None
+
+
+class ToolRepair:
+    """
+    Repairs the tool messages of an LLM that don't parse, before the agent
+    falls back to asking the LLM again, and bounds the number of times it
+    does so in a row to `max_retries`.
+    """
+
+    def __init__(
+        self, agent: lr.ChatAgent, max_retries: int = MAX_TOOL_RETRIES
+    ):
+        self.agent = agent
+        self.max_retries = max_retries
+        self.retries = 0
+        self.fallbacks = 0
+        self.repaired = 0
+        self.exhausted = 0
+        self.__lock = threading.Lock()
+
+    def handled_tools(self) -> Dict[str, Type[lr.ToolMessage]]:
+        return {
+            name: tool
+            for name, tool in self.agent.llm_tools_map.items()
+            if name in self.agent.llm_tools_handled
+        }
+
+    def raw_tools(self, msg: lr.ChatDocument) -> List[Any]:
+        if msg.oai_tool_calls:
+            return [
+                {"request": call.function.name, **(call.function.arguments or {})}
+                for call in msg.oai_tool_calls
+                if call.function is not None
+            ]
+        if msg.function_call is not None:
+            call = msg.function_call
+            return [{"request": call.name, **(call.arguments or {})}]
+        return [loads_lenient(text) for text in json_candidates(msg.content)]
+
+    def apply(self, msg: str | lr.ChatDocument) -> str | lr.ChatDocument:
+        """
+        Returns `msg`, or a copy with its tools repaired if it is an LLM
+        message with tools the agent fails to parse.
+        """
+        if not isinstance(msg, lr.ChatDocument):
+            return msg
+        if msg.metadata.sender != Entity.LLM:
+            return msg
+        try:
+            if self.agent.get_tool_messages(msg):
+                with self.__lock:
+                    self.retries = 0
+                return msg
+        except (ValidationError, ValueError):
+            pass
+        if not (msg.function_call or msg.oai_tool_calls or "{" in msg.content):
+            return msg
+
+        with get_tracer().span("repair", self.agent.config.name) as span:
+            tools = self.handled_tools()
+            repaired = [repair_tool(tools, data) for data in self.raw_tools(msg)]
+            repaired = [tool for tool in repaired if tool is not None]
+            span.attributes["tools"] = [t.default_value("request") for t in repaired]
+        if not repaired:
+            return msg
+        with self.__lock:
+            self.repaired += 1
+            self.retries = 0
+        return lr.ChatDocument(
+            content="\n".join(tool.to_json() for tool in repaired),
+            metadata=msg.metadata.copy(),
+        )
+
+    def retry(self) -> bool:
+        """Counts a fallback to the LLM, False once the budget is spent."""
+        with self.__lock:
+            if self.retries >= self.max_retries:
+                self.retries = 0
+                self.exhausted += 1
+                return False
+            self.retries += 1
+            self.fallbacks += 1
+            return True
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "repaired": self.repaired,
+            "fallbacks": self.fallbacks,
+            "exhausted": self.exhausted,
+        }
@@ -1,7 +1,7 @@
 from typing import List
 
 from langroid.agent.tool_message import ToolMessage
-from langroid.pydantic_v1 import Field
+from langroid.pydantic_v1 import BaseModel, Field
 from langroid.agent.tools.orchestration import SendTool
 
 import webbrowser
@@ -25,6 +25,37 @@ class QuestionTool(ToolMessage):
         ]
 
 
+class RoutedQuestion(BaseModel):
+    recipient: str = Field(..., description="Name of the specialist to ask")
+    instruction: str = Field(..., description="SINGLE instruction to execute")
+
+
+class BatchQuestionTool(ToolMessage):
+    request: str = "batch_question_tool"
+    purpose: str = """
+    Give several INDEPENDENT <questions> at once, each with the <recipient>
+    specialist that can execute its <instruction>. They are executed concurrently.
+    """
+    questions: List[RoutedQuestion]
+
+    @classmethod
+    def examples(cls) -> List[ToolMessage]:
+        return [
+            cls(
+                questions=[
+                    RoutedQuestion(
+                        recipient="LangroidAgent",
+                        instruction="How do I define a tool in Langroid?",
+                    ),
+                    RoutedQuestion(
+                        recipient="VitepressAgent",
+                        instruction="How do I add a sidebar in Vitepress?",
+                    ),
+                ]
+            ),
+        ]
+
+
 class AnswerTool(ToolMessage):
     request = "answer_tool"
     purpose = "Present the <task_result> from a TASK execution"
@@ -0,0 +1,306 @@
+import json
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from typing import Any, Deque, Dict, Iterator, List
+
+import numpy as np
+import langroid as lr
+import langroid.language_models as lm
+
+from config import LLM_CONFIGS
+
+
+@dataclass
+class Span:
+    """
+    A timed stage of the handling of a query.
+
+    kind: "query", "route", "dispatch", "llm_response" (a whole agent
+        response, including e.g. the retrieval of a DocChatAgent),
+        "generation" (a single LLM call), "retrieval", "tool" or "fallback",
+        and outside of the queries "index" (the sync of a doc index) and
+        "reload" (of a plugin package).
+    model: the `LLM_CONFIGS` tier of the LLM, for the LLM spans.
+    first_token: when the first streamed token was received, for the
+        "generation" spans.
+    """
+
+    kind: str
+    name: str
+    trace_id: str
+    id: str = field(default_factory=lambda: uuid.uuid4().hex[:16])
+    parent_id: str | None = None
+    start: float = field(default_factory=time.time)
+    end: float | None = None
+    first_token: float | None = None
+    model: str | None = None
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    error: str | None = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.time()) - self.start
+
+    @property
+    def time_to_first_token(self) -> float | None:
+        if self.first_token is None:
+            return None
+        return self.first_token - self.start
+
+    def add_usage(self, response: Any) -> None:
+        """Adds the token usage of an LLM response (a ChatDocument)."""
+        usage = getattr(getattr(response, "metadata", None), "usage", None)
+        if usage is not None:
+            self.prompt_tokens += usage.prompt_tokens
+            self.completion_tokens += usage.completion_tokens
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            **asdict(self),
+            "duration": self.duration,
+            "time_to_first_token": self.time_to_first_token,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Span":
+        data = {k: v for k, v in data.items() if k in cls.__dataclass_fields__}
+        return cls(**data)
+
+
+_current_span: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+
+def current_span() -> Span | None:
+    return _current_span.get()
+
+
+class Tracer:
+    """
+    Records the spans of the agents, keeping the last `max_spans` in memory
+    and appending every finished span to the JSONL file `path`, if any.
+
+    The current span is held in a context variable, so spans opened while
+    another one is running (in the same thread or asyncio task) are its
+    children.
+    """
+
+    def __init__(self, path: str | None = None, max_spans: int = 10000):
+        self.path = path
+        self.spans: Deque[Span] = deque(maxlen=max_spans)
+        self.__lock = threading.Lock()
+
+    @contextmanager
+    def span(self, kind: str, name: str, **attributes: Any) -> Iterator[Span]:
+        parent = current_span()
+        span = Span(
+            kind=kind,
+            name=name,
+            trace_id=parent.trace_id if parent else uuid.uuid4().hex[:16],
+            parent_id=parent.id if parent else None,
+            attributes=attributes,
+        )
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = repr(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end = time.time()
+            self.record(span)
+
+    def record(self, span: Span) -> None:
+        with self.__lock:
+            self.spans.append(span)
+            if self.path:
+                with open(self.path, "a") as f:
+                    f.write(json.dumps(span.to_dict(), default=str) + "\n")
+
+    def summary(self) -> List[Dict[str, Any]]:
+        with self.__lock:
+            return summarize(list(self.spans))
+
+
+def load_spans(path: str) -> List[Span]:
+    with open(path) as f:
+        return [Span.from_dict(json.loads(line)) for line in f if line.strip()]
+
+
+def summarize(spans: List[Span]) -> List[Dict[str, Any]]:
+    """Time and tokens spent per kind of span, most expensive first."""
+    groups: Dict[tuple, List[Span]] = defaultdict(list)
+    for span in spans:
+        groups[(span.kind, span.name, span.model)].append(span)
+    rows = []
+    for (kind, name, model), group in groups.items():
+        durations = [span.duration for span in group]
+        ttfts = [
+            span.time_to_first_token
+            for span in group
+            if span.time_to_first_token is not None
+        ]
+        rows.append(
+            {
+                "kind": kind,
+                "name": name,
+                "model": model,
+                "count": len(group),
+                "total_seconds": float(np.sum(durations)),
+                "mean_seconds": float(np.mean(durations)),
+                "p95_seconds": float(np.percentile(durations, 95)),
+                "mean_ttft_seconds": float(np.mean(ttfts)) if ttfts else None,
+                "prompt_tokens": sum(span.prompt_tokens for span in group),
+                "completion_tokens": sum(span.completion_tokens for span in group),
+                "errors": sum(span.error is not None for span in group),
+            }
+        )
+    return sorted(rows, key=lambda row: row["total_seconds"], reverse=True)
+
+
+def format_summary(rows: List[Dict[str, Any]]) -> str:
+    lines = [
+        f"{'kind':<13}{'name':<28}{'model':<8}{'count':>6}{'total':>9}"
+        f"{'mean':>8}{'p95':>8}{'ttft':>8}{'tokens in/out':>16}"
+    ]
+    for row in rows:
+        ttft = row["mean_ttft_seconds"]
+        lines.append(
+            f"{row['kind']:<13}{row['name'][:27]:<28}{row['model'] or '-':<8}"
+            f"{row['count']:>6}{row['total_seconds']:>8.2f}s"
+            f"{row['mean_seconds']:>7.2f}s{row['p95_seconds']:>7.2f}s"
+            + (f"{ttft:>7.2f}s" if ttft is not None else f"{'-':>8}")
+            + f"{row['prompt_tokens']:>9}/{row['completion_tokens']:<6}"
+        )
+    return "\n".join(lines)
+
+
+def model_name(chat_model: str) -> str:
+    """The name of the model on the Ollama server, e.g. "phi3:mini"."""
+    return chat_model.removeprefix("ollama/")
+
+
+def model_tier(config: lm.LLMConfig | None) -> str | None:
+    """The `LLM_CONFIGS` tier of `config`, or its model name."""
+    if config is None:
+        return None
+    # The LLMs drop the "ollama/" prefix from the chat_model of their config
+    for tier, tier_config in LLM_CONFIGS.items():
+        if model_name(tier_config.chat_model) == model_name(config.chat_model):
+            return tier
+    return config.chat_model
+
+
+def trace_agent(agent: lr.ChatAgent, tracer: "Tracer | None" = None) -> lr.ChatAgent:
+    """
+    Records the responses of `agent` as spans: its LLM responses and the LLM
+    calls they make (with the time to the first streamed token), the tools
+    it handles and its fallbacks.
+    """
+    tracer = tracer or get_tracer()
+    name = agent.config.name
+
+    def model() -> str | None:
+        # The LLM may be swapped for another tier by a ModelLadder
+        return model_tier(agent.llm.config if agent.llm else agent.config.llm)
+
+    llm_response = agent.llm_response
+    llm_response_async = agent.llm_response_async
+    llm_response_messages = agent.llm_response_messages
+    llm_response_messages_async = agent.llm_response_messages_async
+    handle_tool_message = agent.handle_tool_message
+    handle_message_fallback = agent.handle_message_fallback
+    start_llm_stream = agent.callbacks.start_llm_stream
+    # Only in the langroid versions where the async responses stream on their own
+    start_llm_stream_async = getattr(agent.callbacks, "start_llm_stream_async", None)
+
+    def traced_llm_response(*args: Any, **kwargs: Any) -> Any:
+        with tracer.span("llm_response", name) as span:
+            span.model = model()
+            result = llm_response(*args, **kwargs)
+            span.add_usage(result)
+            return result
+
+    async def traced_llm_response_async(*args: Any, **kwargs: Any) -> Any:
+        with tracer.span("llm_response", name) as span:
+            span.model = model()
+            result = await llm_response_async(*args, **kwargs)
+            span.add_usage(result)
+            return result
+
+    def traced_llm_response_messages(*args: Any, **kwargs: Any) -> Any:
+        with tracer.span("generation", name) as span:
+            span.model = model()
+            result = llm_response_messages(*args, **kwargs)
+            span.add_usage(result)
+            return result
+
+    async def traced_llm_response_messages_async(*args: Any, **kwargs: Any) -> Any:
+        with tracer.span("generation", name) as span:
+            span.model = model()
+            result = await llm_response_messages_async(*args, **kwargs)
+            span.add_usage(result)
+            return result
+
+    def traced_handle_tool_message(tool: lr.ToolMessage, *args: Any, **kwargs: Any):
+        with tracer.span("tool", tool.default_value("request"), agent=name):
+            return handle_tool_message(tool, *args, **kwargs)
+
+    def traced_handle_message_fallback(*args: Any, **kwargs: Any) -> Any:
+        with tracer.span("fallback", name) as span:
+            result = handle_message_fallback(*args, **kwargs)
+            span.attributes["retried"] = result is not None
+            return result
+
+    def traced_start_llm_stream() -> Any:
+        streamer = start_llm_stream()
+        span = current_span()
+
+        def traced_streamer(text: Any) -> None:
+            if span is not None and span.first_token is None:
+                span.first_token = time.time()
+            streamer(text)
+
+        return traced_streamer
+
+    async def traced_start_llm_stream_async() -> Any:
+        streamer_async = await start_llm_stream_async()
+        span = current_span()
+
+        async def traced_streamer_async(text: Any) -> None:
+            if span is not None and span.first_token is None:
+                span.first_token = time.time()
+            await streamer_async(text)
+
+        return traced_streamer_async
+
+    agent.llm_response = traced_llm_response
+    agent.llm_response_async = traced_llm_response_async
+    agent.llm_response_messages = traced_llm_response_messages
+    agent.llm_response_messages_async = traced_llm_response_messages_async
+    agent.handle_tool_message = traced_handle_tool_message
+    agent.handle_message_fallback = traced_handle_message_fallback
+    agent.callbacks.start_llm_stream = traced_start_llm_stream
+    if start_llm_stream_async is not None:
+        agent.callbacks.start_llm_stream_async = traced_start_llm_stream_async
+    return agent
+
+
+_tracer: Tracer | None = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer() -> Tracer:
+    """Returns the Tracer shared by the whole process."""
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer()
+    return _tracer
@@ -0,0 +1,179 @@
+from typing import List, Tuple
+
+from audio_buffer import AudioRingBuffer, SAMPLE_RATE
+from speech_model import SpeechModelProvider, Word
+
+# The longest run of committed words looked for at the start of a new window
+MAX_REPEAT = 5
+
+
+def join_words(words: List[Word]) -> str:
+    return "".join(w.text for w in words).strip()
+
+
+class HypothesisBuffer:
+    """
+    Keeps the words of the last transcription that are not committed yet.
+
+    A word is committed once two consecutive transcriptions of the growing
+    window agree on it (local agreement), so only the prefix both windows
+    share is ever printed as final text.
+    """
+
+    def __init__(self):
+        self.committed: List[Word] = []
+        self.buffer: List[Word] = []
+        self.new: List[Word] = []
+        self.last_committed_time: float = 0.0
+
+    def insert(self, words: List[Word], offset: float) -> None:
+        words = [Word(w.start + offset, w.end + offset, w.text) for w in words]
+        self.new = [w for w in words if w.start > self.last_committed_time - 0.1]
+
+        # Whisper tends to repeat the last committed words at the start of the
+        # window, drop them if they are an exact n-gram repetition.
+        if self.new and self.committed:
+            if abs(self.new[0].start - self.last_committed_time) < 1:
+                n_max = min(len(self.committed), len(self.new), MAX_REPEAT)
+                for n in range(n_max, 0, -1):
+                    tail = [w.key for w in self.committed[-n:]]
+                    head = [w.key for w in self.new[:n]]
+                    if tail == head:
+                        del self.new[:n]
+                        break
+
+    def flush(self) -> List[Word]:
+        """Commits the longest common prefix of the last two hypotheses."""
+        commit: List[Word] = []
+        while self.new and self.buffer:
+            if self.new[0].key != self.buffer[0].key:
+                break
+            word = self.new.pop(0)
+            self.buffer.pop(0)
+            commit.append(word)
+            self.last_committed_time = word.end
+        self.buffer = self.new
+        self.new = []
+        self.committed.extend(commit)
+        return commit
+
+    def pop_committed(self, time: float) -> None:
+        """
+        Forgets committed words that are no longer part of the audio window,
+        except the last ones, that the next window may repeat.
+        """
+        while len(self.committed) > MAX_REPEAT and self.committed[0].end <= time:
+            self.committed.pop(0)
+
+    def complete(self) -> List[Word]:
+        return self.buffer
+
+
+class StreamingTranscriber:
+    """
+    Incremental transcription over a sliding audio window.
+
+    Every call to `process` decodes only the audio after the last committed
+    word: committed text is cut from the window and passed back to whisper as
+    prompt, so the per-chunk cost no longer grows with the whole utterance.
+
+    The window is a range of absolute sample positions in `ring`, read as a
+    view, so timestamps are positions in the stream.
+    """
+
+    def __init__(
+        self,
+        model: SpeechModelProvider,
+        ring: AudioRingBuffer,
+        max_window_seconds: float = 15.0,
+        prompt_chars: int = 200,
+    ):
+        self.model = model
+        self.ring = ring
+        self.max_window_seconds = max_window_seconds
+        self.prompt_chars = prompt_chars
+        self.reset()
+
+    def reset(self, position: int = 0) -> None:
+        self.window_start = position
+        self.window_stop = position
+        self.active = False
+        self.hypothesis = HypothesisBuffer()
+        self.hypothesis.last_committed_time = position / SAMPLE_RATE
+        self.committed: List[Word] = []
+
+    @property
+    def window_offset(self) -> float:
+        return self.window_start / SAMPLE_RATE
+
+    @property
+    def window_seconds(self) -> float:
+        return (self.window_stop - self.window_start) / SAMPLE_RATE
+
+    @property
+    def text(self) -> str:
+        return join_words(self.committed)
+
+    def extend(self, start: int, stop: int) -> None:
+        """Extends the window up to `stop`, starting it at `start` if idle."""
+        if not self.active:
+            self.reset(start)
+            self.active = True
+        self.window_stop = stop
+
+    def skip_to(self, position: int) -> None:
+        """Starts the window at `position`, the audio before being lost."""
+        if position <= self.window_start:
+            return
+        self.window_start = min(position, self.window_stop)
+        time = self.window_offset
+        # The words of the lost audio can't be confirmed by the next windows
+        self.hypothesis.buffer = [w for w in self.hypothesis.buffer if w.start >= time]
+        self.hypothesis.pop_committed(time)
+
+    def _prompt(self) -> str:
+        return join_words(self.committed)[-self.prompt_chars :]
+
+    def _trim(self, time: float) -> None:
+        position = min(int(time * SAMPLE_RATE), self.window_stop)
+        if position <= self.window_start:
+            return
+        self.window_start = position
+        self.hypothesis.pop_committed(time)
+
+    def process(self) -> Tuple[List[Word], List[Word]]:
+        """
+        Transcribes the current window.
+
+        Returns:
+            Tuple[List[Word], List[Word]]: the newly committed words and the
+                unconfirmed tail.
+        """
+        if self.window_stop == self.window_start:
+            return [], []
+        audio = self.ring.view(self.window_start, self.window_stop)
+        words = self.model.get().transcribe(audio, self._prompt() or None)
+        self.hypothesis.insert(words, self.window_offset)
+        commit = self.hypothesis.flush()
+        self.committed.extend(commit)
+
+        if commit:
+            self._trim(commit[-1].end)
+        elif self.window_seconds > self.max_window_seconds:
+            # Nothing got confirmed for too long, accept the current hypothesis
+            # rather than letting the window (and its cost) grow without bound.
+            commit = self.hypothesis.complete()
+            self.committed.extend(commit)
+            self.hypothesis.committed.extend(commit)
+            self.hypothesis.buffer = []
+            end = commit[-1].end if commit else self.window_stop / SAMPLE_RATE
+            self.hypothesis.last_committed_time = end
+            self._trim(end)
+
+        return commit, self.hypothesis.complete()
+
+    def finish(self) -> List[Word]:
+        """Commits whatever is left in the window, and returns all the words."""
+        words = self.committed + self.hypothesis.complete()
+        self.reset(self.window_stop)
+        return words
@@ -0,0 +1,137 @@
+from dataclasses import dataclass
+from typing import List
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+
+
+@dataclass
+class SpeechSpan:
+    """
+    A span of speech inside an audio chunk.
+
+    `start` and `stop` are sample indexes in the chunk given to
+    `SpeechGate.process`, `final` is True when the utterance ends at `stop`.
+    """
+
+    start: int
+    stop: int
+    final: bool
+
+
+class EnergyVAD:
+    """
+    Frame level voice activity detection based on energy and spectral flatness.
+
+    A frame is speech when its energy is `margin_db` above the running noise
+    floor, and its spectrum is not flat (white-ish noise such as fans or hiss
+    is loud but flat, voiced speech is not).
+    """
+
+    def __init__(
+        self,
+        sample_rate: int = SAMPLE_RATE,
+        frame_ms: int = 30,
+        margin_db: float = 10.0,
+        min_energy_db: float = -55.0,
+        max_flatness: float = 0.5,
+        noise_floor_db: float = -60.0,
+        noise_adaptation: float = 0.05,
+    ):
+        self.frame_length = sample_rate * frame_ms // 1000
+        self.margin_db = margin_db
+        self.min_energy_db = min_energy_db
+        self.max_flatness = max_flatness
+        self.noise_floor_db = noise_floor_db
+        self.noise_adaptation = noise_adaptation
+
+    def frames(self, audio: np.ndarray) -> np.ndarray:
+        n_frames = len(audio) // self.frame_length
+        return audio[: n_frames * self.frame_length].reshape(
+            n_frames, self.frame_length
+        )
+
+    def speech_frames(self, audio: np.ndarray) -> np.ndarray:
+        """
+        Classifies each frame of `audio` (float32 in [-1, 1]).
+
+        Returns:
+            np.ndarray: one boolean per frame, True for speech.
+        """
+        frames = self.frames(audio)
+        if len(frames) == 0:
+            return np.zeros(0, dtype=bool)
+
+        energy_db = 10 * np.log10(np.mean(frames**2, axis=1) + 1e-10)
+        power = np.abs(np.fft.rfft(frames, axis=1)) ** 2 + 1e-10
+        flatness = np.exp(np.mean(np.log(power), axis=1)) / np.mean(power, axis=1)
+
+        flags = np.zeros(len(frames), dtype=bool)
+        for i, (db, flat) in enumerate(zip(energy_db, flatness)):
+            flags[i] = (
+                db > self.noise_floor_db + self.margin_db
+                and db > self.min_energy_db
+                and flat < self.max_flatness
+            )
+            if not flags[i]:
+                self.noise_floor_db += self.noise_adaptation * (
+                    db - self.noise_floor_db
+                )
+        return flags
+
+
+class SpeechGate:
+    """
+    Cuts the chunk stream into utterances so only speech reaches the model.
+
+    An utterance starts after `min_speech_ms` of consecutive speech frames and
+    ends after `hangover_ms` of silence. `padding_ms` of audio is kept on both
+    sides so word onsets and endings are not clipped.
+    """
+
+    def __init__(
+        self,
+        vad: EnergyVAD | None = None,
+        min_speech_ms: int = 90,
+        hangover_ms: int = 600,
+        padding_ms: int = 150,
+    ):
+        self.vad = vad or EnergyVAD()
+        frame_ms = self.vad.frame_length * 1000 // SAMPLE_RATE
+        self.min_speech_frames = max(1, min_speech_ms // frame_ms)
+        self.hangover_frames = max(1, hangover_ms // frame_ms)
+        self.padding_frames = padding_ms // frame_ms
+        self.in_speech = False
+        self.speech_run = 0
+        self.silence_run = 0
+
+    def process(self, audio: np.ndarray) -> List[SpeechSpan]:
+        """
+        Returns the speech spans of `audio`, an empty list means the whole
+        chunk can be dropped.
+        """
+        frame_length = self.vad.frame_length
+        flags = self.vad.speech_frames(audio)
+        spans: List[SpeechSpan] = []
+        start = 0
+
+        for i, is_speech in enumerate(flags):
+            if not self.in_speech:
+                self.speech_run = self.speech_run + 1 if is_speech else 0
+                if self.speech_run >= self.min_speech_frames:
+                    self.in_speech = True
+                    self.silence_run = 0
+                    first = i - self.speech_run + 1 - self.padding_frames
+                    start = max(0, first) * frame_length
+            else:
+                self.silence_run = 0 if is_speech else self.silence_run + 1
+                if self.silence_run >= self.hangover_frames:
+                    last = max(0, i - self.silence_run + 1 + self.padding_frames)
+                    spans.append(SpeechSpan(start, last * frame_length, True))
+                    self.in_speech = False
+                    self.speech_run = 0
+
+        if self.in_speech:
+            spans.append(SpeechSpan(start, len(audio), False))
+        return spans
@@ -0,0 +1,153 @@
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Tuple
+
+import numpy as np
+
+from audio_buffer import AudioRingBuffer
+from config import VOICE_DEBOUNCE, VOICE_QUEUE_SIZE
+from MainAgent import MainAgent
+from speech_model import SpeechModelProvider
+from text_generation import (
+    consumer_thread,
+    file_producer_thread,
+    new_stats,
+    producer_thread,
+)
+
+# An utterance without a word is background noise
+WORD = re.compile(r"\w")
+
+
+class UtteranceQueue:
+    """
+    Bounded queue of the utterances transcribed, waiting for the agent.
+
+    An utterance only becomes a query once nothing else was heard for
+    `debounce` seconds, and the utterances heard meanwhile are joined in
+    it, so a sentence cut by a pause, or several said while the agent was
+    busy, are one query. When more than `maxsize` utterances wait, the
+    oldest are dropped.
+    """
+
+    def __init__(
+        self, maxsize: int = VOICE_QUEUE_SIZE, debounce: float = VOICE_DEBOUNCE
+    ):
+        self.maxsize = maxsize
+        self.debounce = debounce
+        self.utterances = 0
+        self.dropped = 0
+        self.__pending: Deque[Tuple[float, str]] = deque()
+        self.__closed = False
+        self.__condition = threading.Condition()
+
+    def put(self, text: str) -> None:
+        text = text.strip()
+        if not WORD.search(text):
+            return
+        with self.__condition:
+            self.utterances += 1
+            if len(self.__pending) >= self.maxsize:
+                self.__pending.popleft()
+                self.dropped += 1
+            self.__pending.append((time.time(), text))
+            self.__condition.notify()
+
+    def close(self) -> None:
+        """No more utterances: the pending ones are still returned."""
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify()
+
+    def get(self) -> Tuple[str, float] | None:
+        """
+        Blocks until the next query.
+
+        Returns:
+            Tuple[str, float] | None: the query and when its last utterance
+                was heard, or None once closed and empty.
+        """
+        with self.__condition:
+            while True:
+                if self.__pending:
+                    heard = self.__pending[-1][0]
+                    wait = heard + self.debounce - time.time()
+                    if wait <= 0 or self.__closed:
+                        query = " ".join(text for _, text in self.__pending)
+                        self.__pending.clear()
+                        return query, heard
+                    self.__condition.wait(wait)
+                elif self.__closed:
+                    return None
+                else:
+                    self.__condition.wait()
+
+
+def listen(
+    speech_model: SpeechModelProvider,
+    queue: UtteranceQueue,
+    path: str | None = None,
+    speed: float = 1.0,
+) -> threading.Thread:
+    """
+    Transcribes the microphone, or the file `path` replayed `speed` times
+    faster than real time, into `queue`, in the background.
+    """
+    audio_buffer = AudioRingBuffer(capacity_seconds=30)
+    if path:
+        producer = threading.Thread(
+            target=file_producer_thread, args=(audio_buffer, path, speed, [])
+        )
+    else:
+        producer = threading.Thread(target=producer_thread, args=(audio_buffer,))
+    producer.daemon = True
+    producer.start()
+
+    def consume() -> None:
+        try:
+            consumer_thread(
+                audio_buffer,
+                speech_model,
+                new_stats(),
+                on_utterance=queue.put,
+                verbose=False,
+            )
+        finally:
+            queue.close()
+
+    consumer = threading.Thread(target=consume, daemon=True)
+    consumer.start()
+    return consumer
+
+
+def run_queries(main_agent: MainAgent, queue: UtteranceQueue) -> Dict[str, Any]:
+    """
+    Runs the spoken queries with `main_agent` until the queue is closed,
+    while the transcription goes on.
+
+    Returns:
+        Dict[str, Any]: the statistics of the queries.
+    """
+    waits: List[float] = []
+    agent_times: List[float] = []
+    while (item := queue.get()) is not None:
+        query, heard = item
+        start = time.time()
+        waits.append(start - heard)
+        print(f"QUERY: {query}")
+        main_agent.run(query)
+        agent_times.append(time.time() - start)
+
+    def mean(values: List[float]) -> float | None:
+        return float(np.mean(values)) if values else None
+
+    return {
+        "utterances": queue.utterances,
+        "dropped": queue.dropped,
+        "queries": len(agent_times),
+        # From the end of the transcription to the start of the agent
+        "mean_wait_seconds": mean(waits),
+        "mean_agent_seconds": mean(agent_times),
+    }